@@ -1,4 +1,4 @@
 #!/bin/bash
 # build.sh
 pip install --upgrade pip
-pip install --force-reinstall --no-cache-dir python-telegram-bot==20.7 Flask==3.0.0
+pip install --force-reinstall --no-cache-dir python-telegram-bot==20.7
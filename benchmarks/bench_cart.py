@@ -0,0 +1,134 @@
+"""
+Бенчмарк кошика на великій таблиці carts (за замовчуванням 1 млн рядків).
+
+Спочатку будує базу зі старою схемою (без індексів) і вимірює старі
+запити кошика: add_to_cart як SELECT + UPDATE/INSERT, get_cart_items,
+clear_cart. Потім відкриває ту саму базу через bot.py - init_database
+застосовує міграцію (унікальний ключ carts(user_id, product_id) та
+індекси) - і вимірює ті самі операції через Database.
+
+Запуск:
+    python benchmarks/bench_cart.py --rows 1000000 --ops 2000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import load_bot
+
+# Схема до міграції: таблиці з init_database без індексів
+LEGACY_SCHEMA = '''
+    CREATE TABLE users (user_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT,
+                        username TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE TABLE carts (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, product_id INTEGER,
+                        quantity REAL, added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+'''
+
+
+def build_legacy(path: str, rows: int, users: int, seed: int):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(LEGACY_SCHEMA)
+    rng = random.Random(seed)
+    # Кожен користувач має до 6 різних продуктів, тож дублів позицій немає
+    batch = []
+    for user_id in range(1, users + 1):
+        for product_id in rng.sample(range(1, 7), rng.randint(1, 6)):
+            batch.append((user_id, product_id, rng.choice([0.5, 1, 1.5, 2])))
+        if len(batch) >= rows:
+            break
+    conn.executemany("INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, ?)", batch[:rows])
+    conn.commit()
+    conn.close()
+    return min(len(batch), rows)
+
+
+class Legacy:
+    """Запити кошика до міграції"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+
+    def add_to_cart(self, user_id: int, product_id: int, quantity: float):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, quantity FROM carts WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+        existing = cursor.fetchone()
+        if existing:
+            cursor.execute("UPDATE carts SET quantity = ?, added_at = CURRENT_TIMESTAMP WHERE id = ?",
+                           (existing[1] + quantity, existing[0]))
+        else:
+            cursor.execute("INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, ?)",
+                           (user_id, product_id, quantity))
+        self.conn.commit()
+
+    def get_cart_items(self, user_id: int):
+        return self.conn.execute("SELECT id, product_id, quantity FROM carts WHERE user_id = ?",
+                                 (user_id,)).fetchall()
+
+    def clear_cart(self, user_id: int):
+        self.conn.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+        self.conn.commit()
+
+
+def measure(func, calls) -> dict:
+    timings = []
+    for args in calls:
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "ops": len(timings),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 3),
+        "mean_ms": round(statistics.mean(timings), 3),
+    }
+
+
+def run_suite(target, users: int, ops: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    picks = [rng.randint(1, users) for _ in range(ops)]
+    return {
+        "add_to_cart": measure(target.add_to_cart, [(u, rng.randint(1, 6), 1.0) for u in picks]),
+        "get_cart_items": measure(target.get_cart_items, [(u,) for u in picks]),
+        "clear_cart": measure(target.clear_cart, [(u,) for u in picks]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="рядків у carts")
+    parser.add_argument("--ops", type=int, default=2000, help="викликів кожної операції з індексами")
+    parser.add_argument("--legacy-ops", type=int, default=50, help="викликів кожної операції без індексів")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "farm_bot.db")
+    users = args.rows // 3
+    started = time.perf_counter()
+    rows = build_legacy(path, args.rows, users, args.seed)
+    print(f"База: {rows} рядків carts, {users} користувачів ({time.perf_counter() - started:.1f} с)")
+
+    results = {"без індексів": run_suite(Legacy(path), users, args.legacy_ops, args.seed)}
+
+    started = time.perf_counter()
+    bot = load_bot(path)
+    print(f"Міграція та ініціалізація: {time.perf_counter() - started:.1f} с")
+    results["з індексами"] = run_suite(bot.Database, users, args.ops, args.seed + 1)
+    bot.Database.connections.close()
+
+    print(f"\n{'схема':<14} {'операція':<16} {'викл.':>6} {'p50, мс':>9} {'p99, мс':>9}")
+    for schema, suite in results.items():
+        for name, result in suite.items():
+            print(f"{schema:<14} {name:<16} {result['ops']:>6} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
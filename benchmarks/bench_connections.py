@@ -0,0 +1,108 @@
+"""
+Бенчмарк з'єднань SQLite: нове з'єднання на кожен виклик проти ConnectionManager.
+
+Імітує одне натискання кнопки: save_user + save_user_session + get_cart_items.
+
+Запуск:
+    python benchmarks/bench_connections.py --presses 2000
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_press(path: str, user_id: int):
+    """Поведінка до ConnectionManager: connect/close на кожен метод"""
+    conn = sqlite3.connect(path, timeout=20, check_same_thread=False)
+    conn.execute('''
+        INSERT OR REPLACE INTO users (user_id, first_name, last_name, username)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, "Bench", "", ""))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(path, timeout=20, check_same_thread=False)
+    conn.execute('''
+        INSERT OR REPLACE INTO user_sessions (user_id, state, temp_data, last_section, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (user_id, "", "{}", "products"))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(path, timeout=20, check_same_thread=False)
+    conn.execute('SELECT id, product_id, quantity FROM carts WHERE user_id = ?', (user_id,)).fetchall()
+    conn.close()
+
+
+def managed_press(bot, user_id: int):
+    """Та сама послідовність через Database з тривалими з'єднаннями"""
+    bot.Database.save_user(user_id, "Bench", "", "")
+    bot.Database.save_user_session(user_id, last_section="products")
+    bot.Database.get_cart_items(user_id)
+
+
+def measure(name: str, func, presses: int) -> dict:
+    timings = []
+    for i in range(presses):
+        started = time.perf_counter()
+        func(i % 500)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    result = {
+        "name": name,
+        "presses": presses,
+        "ops_per_sec": presses / (sum(timings) / 1000),
+        "p50_ms": statistics.median(timings),
+        "p99_ms": timings[int(len(timings) * 0.99) - 1],
+    }
+    print(f"{name:<28} {result['ops_per_sec']:>10.0f} ops/s   "
+          f"p50 {result['p50_ms']:.3f} ms   p99 {result['p99_ms']:.3f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presses", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_conn_")
+    legacy_path = os.path.join(workdir, "legacy.db")
+    managed_path = os.path.join(workdir, "managed.db")
+
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["DB_PATH"] = managed_path
+    sys.path.insert(0, ROOT)
+    import bot
+
+    # Схема для "старого" варіанту створюється тим самим кодом, але без WAL
+    bot.init_database()
+    reader = bot.Database.connections.acquire_reader()
+    schema = reader.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name != 'sqlite_sequence'"
+    ).fetchall()
+    bot.Database.connections.release(reader)
+
+    legacy = sqlite3.connect(legacy_path)
+    for (table_sql,) in schema:
+        legacy.execute(table_sql)
+    legacy.commit()
+    legacy.close()
+
+    print(f"SQLite {sqlite3.sqlite_version}, {args.presses} натискань, база у {workdir}\n")
+    before = measure("connect/close per call", lambda uid: legacy_press(legacy_path, uid), args.presses)
+    after = measure("ConnectionManager (WAL)", lambda uid: managed_press(bot, uid), args.presses)
+    print(f"\nПрискорення: x{after['ops_per_sec'] / before['ops_per_sec']:.1f}")
+
+    bot.Database.connections.close()
+
+
+if __name__ == "__main__":
+    main()
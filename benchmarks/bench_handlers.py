@@ -0,0 +1,189 @@
+"""
+Мікробенчмарк обробників бота на синтетичних оновленнях.
+
+Проганяє start, button_handler і message_handler через Application.process_update
+сценаріями користувачів: перегляд продуктів, додавання в кошик, повне
+оформлення до confirm_order_yes і швидке замовлення дзвінком. Bot API
+замінено заглушкою без мережі, база - тимчасовий farm_bot.db.
+
+Для кожного сценарію і кроку рахує оновлень за секунду, p50/p99 затримки
+і пам'ять на оновлення (пік виділеної пам'яті за tracemalloc і блоки, що
+лишилися після обробки). Результати зберігаються в JSON для порівняння
+запусків.
+
+Запуск:
+    python benchmarks/bench_handlers.py --users 300 --output benchmarks/results/handlers.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import RecordingRequest, Updates, load_bot
+
+
+def flows(updates: Updates):
+    """Сценарії: назва -> список (назва кроку, функція user_id -> оновлення)"""
+    return {
+        "browse": [
+            ("start", lambda u: updates.message(u, "/start")),
+            ("products", lambda u: updates.callback(u, "products")),
+            ("product", lambda u: updates.callback(u, "product", 1 + u % 6)),
+            ("back_products", lambda u: updates.callback(u, "products")),
+            ("faq", lambda u: updates.callback(u, "faq")),
+            ("faq_item", lambda u: updates.callback(u, "faq_item", 1 + u % 5)),
+            ("main_menu", lambda u: updates.callback(u, "main_menu")),
+        ],
+        "add_to_cart": [
+            ("product", lambda u: updates.callback(u, "product", 1)),
+            ("add_to_cart", lambda u: updates.callback(u, "add_to_cart", 1)),
+            ("quantity", lambda u: updates.message(u, "2")),
+            ("cart", lambda u: updates.callback(u, "cart")),
+        ],
+        "checkout": [
+            ("add_to_cart", lambda u: updates.callback(u, "add_to_cart", 3)),
+            ("quantity", lambda u: updates.message(u, "1.5")),
+            ("cart", lambda u: updates.callback(u, "cart")),
+            ("checkout_cart", lambda u: updates.callback(u, "checkout_cart")),
+            ("name", lambda u: updates.message(u, "Іванов Іван Іванович")),
+            ("phone", lambda u: updates.message(u, "0501234567")),
+            ("city", lambda u: updates.message(u, "Київ")),
+            ("np_department", lambda u: updates.message(u, "Відділення №25")),
+            ("confirm_order_yes", lambda u: updates.callback(u, "confirm_order_yes")),
+        ],
+        "quick_call": [
+            ("quick_order", lambda u: updates.callback(u, "quick_order", 2)),
+            ("quick_call", lambda u: updates.callback(u, "quick_call", 2)),
+            ("phone", lambda u: updates.message(u, "+380671112233")),
+        ],
+    }
+
+
+def summarize(timings, elapsed: float, peaks, retained_blocks: float) -> dict:
+    ordered = sorted(timings)
+    return {
+        "updates": len(ordered),
+        "ops_per_sec": round(len(ordered) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "peak_alloc_bytes": int(statistics.median(peaks)) if peaks else None,
+        "retained_blocks_per_update": round(retained_blocks, 2),
+    }
+
+
+async def run(bot, args) -> dict:
+    request = RecordingRequest()
+    application = bot.build_application(request=request)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    from telegram import Update
+
+    updates = Updates(bot)
+    users = itertools.count(1)
+    results = {}
+
+    async def process(update_json):
+        await application.process_update(Update.de_json(update_json, application.bot))
+
+    for flow_name, steps in flows(updates).items():
+        # Прогрев: первые обращения строят кэши и подготовленные запросы
+        for _ in range(args.warmup):
+            user_id = next(users)
+            for _, make in steps:
+                await process(make(user_id))
+
+        step_timings = {name: [] for name, _ in steps}
+        flow_timings = []
+        started = time.perf_counter()
+        for _ in range(args.users):
+            user_id = next(users)
+            for name, make in steps:
+                update = make(user_id)
+                t0 = time.perf_counter()
+                await process(update)
+                duration = time.perf_counter() - t0
+                step_timings[name].append(duration)
+                flow_timings.append(duration)
+        elapsed = time.perf_counter() - started
+
+        # Память отдельным проходом: tracemalloc заметно замедляет обработку
+        peaks = []
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        measured = 0
+        for _ in range(args.memory_users):
+            user_id = next(users)
+            for _, make in steps:
+                update = make(user_id)
+                base = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                await process(update)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+                measured += 1
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        retained = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+        results[flow_name] = summarize(flow_timings, elapsed, peaks, retained / max(measured, 1))
+        results[flow_name]["steps"] = {
+            name: {key: value for key, value in summarize(timings, sum(timings), [], 0).items()
+                   if key in ("updates", "ops_per_sec", "p50_ms", "p99_ms")}
+            for name, timings in step_timings.items()
+        }
+
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    results["_bot_api_calls"] = dict(request.calls)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300, help="користувачів на сценарій")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--memory-users", type=int, default=50, help="користувачів для вимірювання пам'яті")
+    parser.add_argument("--output", help="файл JSON з результатами")
+    args = parser.parse_args()
+
+    # Транспорт - заглушка, а не Telegram: загальний ліміт Bot API тут вимірював би
+    # лише сам себе (~33 мс на відповідь). OUTBOUND_GLOBAL_RATE=30 - з реальним лімітом
+    os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "100000")
+    bot = load_bot()
+    results = asyncio.run(run(bot, args))
+
+    print(f"{'сценарій':<12} {'оновл./с':>9} {'p50, мс':>8} {'p99, мс':>8} {'пік, КБ':>8} {'блоків':>7}")
+    for name, result in results.items():
+        if name.startswith("_"):
+            continue
+        print(f"{name:<12} {result['ops_per_sec']:>9.1f} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f} "
+              f"{result['peak_alloc_bytes'] / 1024:>8.1f} {result['retained_blocks_per_update']:>7.2f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        report = {
+            "benchmark": "handlers",
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "params": vars(args),
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультати збережено: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Мікробенчмарк статичних екранів: побудова на кожне натискання проти StaticScreens.
+
+Для кожного екрана вимірює час і кількість виділеної пам'яті (tracemalloc)
+на одне натискання.
+
+Запуск:
+    python benchmarks/bench_screens.py --presses 5000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def per_press(func, presses: int):
+    """Повертає (мкс на натискання, байт на натискання, блоків на натискання)"""
+    func()
+
+    started = time.perf_counter()
+    for _ in range(presses):
+        func()
+    elapsed_us = (time.perf_counter() - started) / presses * 1_000_000
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    keep = [func() for _ in range(presses)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del keep
+    return elapsed_us, size / presses, blocks / presses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presses", type=int, default=5000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    sys.path.insert(0, ROOT)
+    import bot
+
+    bot.screens.rebuild()
+
+    rebuilt = {
+        "main_menu": lambda: (bot.get_welcome_text(), bot.get_main_menu()),
+        "company": lambda: (bot.get_company_text(), bot.get_back_keyboard("main_menu")),
+        "products": lambda: (bot.get_products_text(), bot.get_products_menu()),
+        "faq": lambda: (bot.get_faq_list_text(), bot.get_faq_menu()),
+        "faq_1": lambda: (bot.get_faq_text(1), bot.get_back_keyboard("faq")),
+        "contact": lambda: (bot.get_contact_text(), bot.get_contact_menu()),
+        "call_us": lambda: (bot.get_contact_info_text("call_us"), bot.get_back_keyboard("contact")),
+    }
+
+    print(f"{'екран':<12} {'до, мкс':>9} {'після, мкс':>11} {'до, Б':>9} {'після, Б':>9} {'блоків до':>10} {'після':>6}")
+    for name, build in rebuilt.items():
+        old_us, old_bytes, old_blocks = per_press(build, args.presses)
+        new_us, new_bytes, new_blocks = per_press(lambda: bot.screens.get(name), args.presses)
+        print(f"{name:<12} {old_us:>9.2f} {new_us:>11.2f} {old_bytes:>9.0f} {new_bytes:>9.0f} "
+              f"{old_blocks:>10.1f} {new_blocks:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Бенчмарк трасування SQL: ціна TracedConnection на типових запитах бота.
+
+Ті самі запити виконуються на звичайному з'єднанні і на трасованому, через
+conn.execute() і через курсор. Заодно перевіряє, що трасування бачить усі
+шляхи виконання: запити, відправлені conn.execute/executemany/executescript,
+теж мають потрапити у виміри.
+
+Запуск:
+    python benchmarks/bench_sqltrace.py --ops 20000
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqltrace import SqlTracer  # noqa: E402
+
+SCHEMA = '''
+    CREATE TABLE carts (id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER, quantity INTEGER);
+    CREATE INDEX idx_carts_user ON carts(user_id);
+'''
+
+
+def press(conn: sqlite3.Connection, user_id: int):
+    """Одне натискання: запис у кошик і читання кошика"""
+    conn.execute('INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, 1)', (user_id, user_id % 7))
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, product_id, quantity FROM carts WHERE user_id = ?', (user_id,)).fetchall()
+    conn.commit()
+
+
+def measure(name: str, conn: sqlite3.Connection, ops: int) -> float:
+    started = time.perf_counter()
+    for i in range(ops):
+        press(conn, i % 500)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<20} {ops / elapsed:>10.0f} ops/s   {elapsed / ops * 1e6:.1f} мкс/натискання")
+    return elapsed
+
+
+def check_coverage(path: str) -> Counter:
+    """Запити через скорочення з'єднання мають бути в трасуванні"""
+    seen = Counter()
+    tracer = SqlTracer(slow_threshold=60, on_statement=lambda label, handler, seconds, rows: seen.update([label]))
+    conn = sqlite3.connect(path, factory=tracer.connection_factory())
+    conn.execute('SELECT COUNT(*) FROM carts').fetchone()
+    conn.executemany('UPDATE carts SET quantity = ? WHERE id = ?', [(2, 1), (3, 2)])
+    conn.executescript('DELETE FROM carts WHERE quantity > 100;')
+    conn.close()
+
+    expected = {"SELECT carts": 1, "UPDATE carts": 1, "DELETE carts": 1}
+    missing = {label: count for label, count in expected.items() if seen[label] < count}
+    if missing:
+        raise SystemExit(f"Трасування пропустило запити: {missing}, побачено: {dict(seen)}")
+    return seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_sqltrace_")
+    plain_path = os.path.join(workdir, "plain.db")
+    traced_path = os.path.join(workdir, "traced.db")
+
+    statements = Counter()
+    tracer = SqlTracer(slow_threshold=60,
+                       on_statement=lambda label, handler, seconds, rows: statements.update([label]))
+    plain = sqlite3.connect(plain_path)
+    traced = sqlite3.connect(traced_path, factory=tracer.connection_factory())
+    for conn in (plain, traced):
+        conn.executescript(SCHEMA)
+    statements.clear()
+
+    print(f"SQLite {sqlite3.sqlite_version}, {args.ops} натискань, база у {workdir}\n")
+    before = measure("sqlite3.Connection", plain, args.ops)
+    after = measure("TracedConnection", traced, args.ops)
+    print(f"\nНакладні витрати: {(after - before) / args.ops * 1e6:+.1f} мкс/натискання ({after / before - 1:+.0%})")
+    print("Виміряно запитів: " + ", ".join(f"{label} {count}" for label, count in statements.most_common()))
+    if statements["INSERT carts"] != args.ops:
+        raise SystemExit(f"conn.execute не потрапив у трасування: INSERT carts {statements['INSERT carts']}")
+    plain.close()
+    traced.close()
+
+    seen = check_coverage(traced_path)
+    print("Скорочення з'єднання: " + ", ".join(f"{label} {count}" for label, count in sorted(seen.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Порівняння затримки обробки оновлень: long polling проти webhook.
+
+Telegram імітується заглушкою транспорту Bot API: getUpdates віддає
+оновлення з локальної черги, а відповіді бота (sendMessage,
+editMessageText) фіксують час. Затримка рахується від моменту появи
+оновлення "в Telegram" до першої відповіді бота. Параметр --rtt додає
+мережеву затримку в обидві сторони кожного виклику.
+
+Запуск:
+    python benchmarks/bench_webhook.py --updates 300 --rate 10 --rtt 40
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": "Bench"}
+    chat = {"id": user_id, "type": "private"}
+    if update_id % 2:
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": 0, "chat": chat, "from": user, "text": "hello"}}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "data": BOT.router.encode("products"), "from": user,
+        "message": {"message_id": update_id, "date": 0, "chat": chat, "text": "menu"}}}
+
+
+async def main_async(args):
+    from telegram.request import BaseRequest
+    from tools.post_updates import WebhookClient
+
+    one_way = args.rtt / 2000
+
+    class FakeTelegram(BaseRequest):
+        """Заглушка Bot API: черга для getUpdates і час відповідей бота"""
+
+        def __init__(self):
+            self.pending: "asyncio.Queue[dict]" = asyncio.Queue()
+            self.started = {}
+            self.latencies = []
+            self.done = asyncio.Event()
+            self.expected = 0
+            self.message_ids = itertools.count(1)
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            name = url.rsplit("/", 1)[-1]
+            params = request_data.parameters if request_data else {}
+            await asyncio.sleep(one_way)
+
+            if name == "getUpdates":
+                result = []
+                try:
+                    result.append(await asyncio.wait_for(self.pending.get(), float(params.get("timeout") or 0) or 0.001))
+                    while not self.pending.empty():
+                        result.append(self.pending.get_nowait())
+                except asyncio.TimeoutError:
+                    pass
+            elif name == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+            elif name in ("sendMessage", "editMessageText"):
+                chat_id = int(params["chat_id"])
+                started = self.started.pop(chat_id, None)
+                if started is not None:
+                    self.latencies.append(time.perf_counter() - started)
+                    if len(self.latencies) == self.expected:
+                        self.done.set()
+                result = {"message_id": next(self.message_ids), "date": 0,
+                          "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+            else:
+                result = True
+
+            await asyncio.sleep(one_way)
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def run(mode: str):
+        fake = FakeTelegram()
+        fake.expected = args.updates
+        application = BOT.build_application(request=fake)
+        clients: "asyncio.Queue[WebhookClient]" = asyncio.Queue()
+        if mode == "webhook":
+            receiver = BOT.WebhookReceiver(application, "bench")
+            BOT.http_server.add_route("POST", BOT.WEBHOOK_PATH, receiver.handle)
+
+        # post_init запускает и общий HTTP-сервер бота
+        await application.initialize()
+        await application.post_init(application)
+        if mode == "polling":
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+        else:
+            url = f"http://127.0.0.1:{BOT.http_server.bound_port}{BOT.WEBHOOK_PATH}"
+            for _ in range(args.connections):
+                clients.put_nowait(WebhookClient(url, "bench"))
+        await application.start()
+
+        async def deliver(update):
+            # Telegram надсилає оновлення на webhook через одне з вільних з'єднань
+            await asyncio.sleep(one_way)
+            client = await clients.get()
+            try:
+                await client.post(update)
+            finally:
+                clients.put_nowait(client)
+
+        deliveries = []
+        users = itertools.count(1_000_000)
+        for update_id in range(1, args.updates + 1):
+            update = make_update(update_id, next(users))
+            fake.started[update["message" if "message" in update else "callback_query"]["from"]["id"]] = time.perf_counter()
+            if mode == "polling":
+                fake.pending.put_nowait(update)
+            else:
+                deliveries.append(asyncio.create_task(deliver(update)))
+            await asyncio.sleep(1 / args.rate)
+
+        await asyncio.wait_for(fake.done.wait(), 60)
+        await asyncio.gather(*deliveries)
+
+        if mode == "polling":
+            await application.updater.stop()
+        else:
+            while not clients.empty():
+                await clients.get_nowait().close()
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+        return fake.latencies
+
+    print(f"{'режим':<8} {'p50, мс':>9} {'p99, мс':>9} {'середнє, мс':>12}")
+    for mode in ("polling", "webhook"):
+        latencies = [value * 1000 for value in await run(mode)]
+        print(f"{mode:<8} {percentile(latencies, 0.5):>9.2f} {percentile(latencies, 0.99):>9.2f} "
+              f"{statistics.mean(latencies):>12.2f}")
+
+
+def main():
+    global BOT
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=10, help="оновлень за секунду")
+    parser.add_argument("--rtt", type=float, default=40, help="мережева затримка туди-назад, мс")
+    parser.add_argument("--connections", type=int, default=40, help="з'єднань webhook")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["HTTP_HOST"] = "127.0.0.1"
+    os.environ["PORT"] = "0"
+    sys.path.insert(0, ROOT)
+    import bot as BOT
+    logging_off()
+
+    BOT.init_database()
+    BOT.screens.rebuild()
+    BOT.conversation.compile()
+    asyncio.run(main_async(args))
+
+
+def logging_off():
+    import logging
+    logging.disable(logging.INFO)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Спільні заглушки для бенчмарків: транспорт Bot API без мережі і
+генератор синтетичних оновлень Telegram.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_bot(db_path: str = None):
+    """Імпортує bot.py з тимчасовою базою і вимкненими логами"""
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["DB_PATH"] = db_path or os.path.join(tempfile.mkdtemp(), "farm_bot.db")
+    os.environ["HTTP_HOST"] = "127.0.0.1"
+    os.environ["PORT"] = "0"
+    sys.path.insert(0, ROOT)
+    import bot
+
+    logging.disable(logging.WARNING)
+    bot.init_database()
+    bot.screens.rebuild()
+    bot.conversation.compile()
+    return bot
+
+
+class RecordingRequest(BaseRequest):
+    """Транспорт Bot API, що лише запам'ятовує виклики.
+
+    latency - штучна затримка кожного виклику в секундах.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.last = []
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[name] += 1
+        self.last.append((name, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif name in ("sendMessage", "editMessageText", "sendPhoto", "editMessageCaption", "editMessageMedia"):
+            chat_id = int(params.get("chat_id") or 1)
+            result = {"message_id": next(self._message_ids), "date": 0,
+                      "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        elif name == "getUpdates":
+            result = []
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class Updates:
+    """Фабрика JSON-оновлень Telegram з callback_data бота"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        message = {
+            "message_id": next(self._ids), "date": 0,
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id), "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._ids), "message": message}
+
+    def callback(self, user_id: int, action: str, *args) -> dict:
+        return self.raw_callback(user_id, self.bot.router.encode(action, *args))
+
+    def raw_callback(self, user_id: int, data: str) -> dict:
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "chat_instance": str(user_id), "data": data,
+            "from": self._user(user_id),
+            "message": {"message_id": next(self._ids), "date": 0,
+                        "chat": {"id": user_id, "type": "private"}, "text": "menu"},
+        }}
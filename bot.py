@@ -2,42 +2,276 @@
 БОТ ФЕРМИ "СМАК ПРИРОДИ" - ПОЛНЫЙ КОД ДЛЯ python-telegram-bot 20.7
 """
 
+import argparse
 import os
 import json
 import sqlite3
 import re
+import contextvars
+import hmac
+import itertools
+import secrets
+import signal
+import subprocess
+import sys
+import asyncio
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, TelegramError
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     filters,
     ContextTypes,
+    TypeHandler,
     CallbackContext
 )
+# Маркер остановки, который Application.stop() кладёт в очередь обновлений
+from telegram.ext._application import _STOP_SIGNAL
+
+from callbacks import CallbackDataError, CallbackRouter
+from catalog import Catalog, Product
+from conversation import Conversation, goto
+from eventlog import SamplingFilter, log_event, setup_logging
+from export import DATASETS, FORMATS, export_dataset, load_watermarks, open_readonly, save_watermarks, watermark_key
+from metrics import Registry
+from imagecache import ImageCache, ImageReport, available as pillow_available
+from photos import Photo, ProductPhotos
+from ratelimit import BULK, OutboundLimiter
+from retention import ARCHIVED_TABLES, Archiver, RetentionPolicy, group_by_month, open_reporting
+from sqltrace import SqlTracer, current_handler
+from webserver import HttpServer, Request, Response, text_response
 
 # ==================== НАСТРОЙКА ====================
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Формат логов: text (как раньше, поля событий в конце строки) или json (одна строка JSON на запись)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Доля нажатий кнопок, попадающих в лог
+LOG_CLICK_SAMPLE = float(os.getenv("LOG_CLICK_SAMPLE", "0.1"))
+
+setup_logging(LOG_FORMAT, logging.INFO, LOG_QUEUE_SIZE, on_drop=lambda record: LOG_DROPPED.inc())
 logger = logging.getLogger(__name__)
+click_logger = logging.getLogger(f"{__name__}.clicks")
+click_logger.addFilter(SamplingFilter(LOG_CLICK_SAMPLE))
 
 TOKEN = os.getenv("BOT_TOKEN")
-if not TOKEN:
-    logger.error("❌ Токен не найден! Добавьте BOT_TOKEN в переменные окружения Render")
-    exit(1)
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+# Telegram ID адміністраторів через кому: їм доступна команда /stats
+ADMIN_IDS = {int(value) for value in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if value}
+
+# ==================== МЕТРИКИ ====================
+
+metrics = Registry()
+
+CALLBACK_LATENCY = metrics.histogram(
+    "bot_callback_seconds", "Время обработки inline-кнопки", ["action"])
+STATE_LATENCY = metrics.histogram(
+    "bot_conversation_state_seconds", "Время обработки сообщения в состоянии диалога", ["state"])
+BOT_API_LATENCY = metrics.histogram(
+    "bot_api_request_seconds", "Время вызова Bot API", ["method"])
+BOT_API_ERRORS = metrics.counter(
+    "bot_api_errors_total", "Вызовы Bot API, завершившиеся ошибкой", ["method"])
+ORDERS_CREATED = metrics.counter(
+    "bot_orders_created_total", "Оформленные заказы", ["order_type"])
+QUICK_ORDERS_CREATED = metrics.counter(
+    "bot_quick_orders_created_total", "Быстрые заказы", ["contact_method"])
+ERRORS = metrics.counter(
+    "bot_errors_total", "Ошибки, после которых бот продолжает работу", ["where"])
+CALLBACK_REJECTED = metrics.counter(
+    "bot_callback_rejected_total", "Отклонённые callback_data: устаревшие, неизвестные, некорректные", ["reason"])
+LOG_DROPPED = metrics.counter(
+    "bot_log_dropped_total", "Записи лога, отброшенные из-за переполненной очереди")
+
+class ErrorCounter(logging.Handler):
+    """Считает записи уровня ERROR по функции, в которой они случились"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record: logging.LogRecord):
+        ERRORS.inc(record.funcName)
+
+logger.addHandler(ErrorCounter())
+
+class InstrumentedRequest(BaseRequest):
+    """Транспорт Bot API, замеряющий время каждого вызова"""
+
+    def __init__(self, request: BaseRequest):
+        self._request = request
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await self._request.do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        except Exception:
+            BOT_API_ERRORS.inc(api_method)
+            raise
+        finally:
+            BOT_API_LATENCY.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            BOT_API_ERRORS.inc(api_method)
+        return code, payload
 
 # ==================== БАЗА ДАННЫХ ====================
 
+DB_PATH = os.getenv("DB_PATH", "farm_bot.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "20"))
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+SQL_TRACE = os.getenv("SQL_TRACE", "0") == "1"
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))
+
+# Ключ записи в истории заказов: (created_at в секундах, вид "o"/"q", id).
+# Порядок истории - по убыванию ключа
+HistoryKey = Tuple[int, str, int]
+HISTORY_MAX_TS = 253402300799  # 9999-12-31 23:59:59
+HISTORY_MAX_ID = 2 ** 63 - 1
+
+def history_bound(kind: str, key: HistoryKey, older: bool) -> int:
+    """Граница id для ветки kind при сравнении (created_at, id) с ключом.
+
+    В пределах одной секунды записи другого вида целиком старше или
+    новее ключа, поэтому для них граница - "все" или "ничего".
+    """
+    _, key_kind, key_id = key
+    if kind == key_kind:
+        return key_id
+    everything = (kind < key_kind) == older
+    return (HISTORY_MAX_ID if older else -1) if everything else (-1 if older else HISTORY_MAX_ID)
+
+class ConnectionManager:
+    """Тривалі з'єднання з SQLite: одне для запису і невеликий пул для читання.
+
+    З'єднання відкриваються один раз і живуть до зупинки бота, тому
+    налаштування PRAGMA і кеш підготовлених запитів sqlite3 не втрачаються
+    між викликами. Запис завжди йде через єдине з'єднання під блокуванням.
+    """
+
+    def __init__(self, path: str, readers: int = 4, journal_mode: str = "WAL",
+                 synchronous: str = "NORMAL", timeout: float = 20, cached_statements: int = 256,
+                 tracer: SqlTracer = None):
+        self.path = path
+        self.max_readers = max(1, readers)
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.tracer = tracer
+
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.Lock()
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._readers_lock = threading.Lock()
+        self._all_readers: List[sqlite3.Connection] = []
+
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        """Відкриває та налаштовує нове з'єднання"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.tracer.connection_factory() if self.tracer else sqlite3.Connection
+        )
+        if not readonly:
+            # Действует только на новую базу и только до перехода в WAL;
+            # существующую переводит python bot.py archive --enable-incremental-vacuum
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # Режим журналу зберігається у файлі бази, тому достатньо writer-а
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def acquire_writer(self) -> sqlite3.Connection:
+        """Повертає з'єднання для запису (ексклюзивно до release)"""
+        if self.tracer is None:
+            self._writer_lock.acquire()
+        else:
+            started = time.perf_counter()
+            self._writer_lock.acquire()
+            self.tracer.lock_wait(time.perf_counter() - started)
+        try:
+            if self._writer is None:
+                self._writer = self._connect()
+            return self._writer
+        except Exception:
+            self._writer_lock.release()
+            raise
+
+    def acquire_reader(self) -> sqlite3.Connection:
+        """Повертає з'єднання для читання з пулу"""
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._readers_lock:
+            if len(self._all_readers) < self.max_readers:
+                conn = self._connect(readonly=True)
+                self._all_readers.append(conn)
+                return conn
+
+        return self._readers.get()
+
+    def release(self, conn: sqlite3.Connection):
+        """Повертає з'єднання до менеджера"""
+        # Незавершена транзакція після помилки не повинна потрапити в наступний виклик
+        if conn.in_transaction:
+            conn.rollback()
+
+        if conn is self._writer:
+            self._writer_lock.release()
+        else:
+            self._readers.put(conn)
+
+    def close(self):
+        """Закриває всі з'єднання"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers.clear()
+            self._readers = queue.LifoQueue()
+
 def init_database():
     """Инициализация базы данных"""
-    conn = sqlite3.connect('farm_bot.db', check_same_thread=False)
+    conn = Database.connections.acquire_writer()
     cursor = conn.cursor()
     
     # Таблица користувачів
@@ -132,39 +366,188 @@ def init_database():
     ''')
     
     conn.commit()
-    conn.close()
+    try:
+        migrate_database(conn)
+    finally:
+        Database.connections.release(conn)
     logger.info("✅ База данных инициализирована")
 
+# Миграции схемы: номер последней применённой хранится в PRAGMA user_version.
+# Каждая выполняется один раз, в одной транзакции с записью нового номера
+MIGRATIONS = [
+    ("уникальные позиции корзины и индексы по пользователю", [
+        # Дубли позиций, которые мог оставить старый add_to_cart, складываем в самую раннюю строку
+        '''
+        CREATE TEMP TABLE cart_merge AS
+        SELECT MIN(id) AS id, SUM(quantity) AS quantity FROM carts
+        GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        ''',
+        '''
+        UPDATE carts SET quantity = (SELECT quantity FROM cart_merge WHERE cart_merge.id = carts.id)
+        WHERE id IN (SELECT id FROM cart_merge)
+        ''',
+        'DELETE FROM carts WHERE id NOT IN (SELECT MIN(id) FROM carts GROUP BY user_id, product_id)',
+        'DROP TABLE cart_merge',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_carts_user_product ON carts(user_id, product_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages(user_id, created_at)',
+    ]),
+]
+
+# Счётчики статистики: имя -> полный пересчёт. Текущие значения лежат в таблице
+# counters и поддерживаются триггерами в той же транзакции, что и запись
+STATISTICS_QUERIES = {
+    "total_users": "SELECT COUNT(*) FROM users",
+    "total_orders": "SELECT COUNT(*) FROM orders",
+    "total_messages": "SELECT COUNT(*) FROM messages",
+    "quick_orders": "SELECT COUNT(*) FROM quick_orders",
+    "active_carts": "SELECT COUNT(DISTINCT user_id) FROM carts",
+}
+
+def _counter_triggers(table: str, counter: str) -> List[str]:
+    return [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+        BEGIN UPDATE counters SET value = value + 1 WHERE name = '{counter}'; END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+        BEGIN UPDATE counters SET value = value - 1 WHERE name = '{counter}'; END
+        ''',
+    ]
+
+def _recount_statements() -> List[str]:
+    return [f"INSERT OR REPLACE INTO counters (name, value) SELECT '{name}', ({query})"
+            for name, query in STATISTICS_QUERIES.items()]
+
+MIGRATIONS.append(("счётчики статистики", [
+    'CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID',
+    *_counter_triggers("users", "total_users"),
+    *_counter_triggers("orders", "total_orders"),
+    *_counter_triggers("messages", "total_messages"),
+    *_counter_triggers("quick_orders", "quick_orders"),
+    # Корзина активна, пока у пользователя есть хотя бы одна позиция
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_carts_count_insert AFTER INSERT ON carts
+    WHEN NEW.user_id IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM carts WHERE user_id = NEW.user_id AND id != NEW.id)
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'active_carts'; END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_carts_count_delete AFTER DELETE ON carts
+    WHEN OLD.user_id IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM carts WHERE user_id = OLD.user_id)
+    BEGIN UPDATE counters SET value = value - 1 WHERE name = 'active_carts'; END
+    ''',
+    *_recount_statements(),
+]))
+
+MIGRATIONS.append(("покрывающие индексы истории заказов", [
+    # Заменяет idx_orders_user_created: тот же префикс плюс поля страницы истории
+    'DROP INDEX IF EXISTS idx_orders_user_created',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_orders_user_history
+    ON orders(user_id, created_at, order_id, total, status, order_type)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_quick_orders_user_history
+    ON quick_orders(user_id, created_at, id, status, contact_method, product_name, quantity)
+    ''',
+]))
+
+MIGRATIONS.append(("file_id фото продуктов", [
+    # Ключ включает хеш файла: изменённое фото получает новую строку, старая остаётся для отката
+    '''
+    CREATE TABLE IF NOT EXISTS product_photos (
+        product_id INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (product_id, content_hash)
+    ) WITHOUT ROWID
+    ''',
+]))
+
+def migrate_database(conn: sqlite3.Connection):
+    """Доводить схему бази до останньої версії"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, (description, statements) in enumerate(MIGRATIONS[version:], start=version + 1):
+        started = time.perf_counter()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for sql in statements:
+                cursor.execute(sql)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("🔧 Миграция %s (%s): %.1f с", number, description, time.perf_counter() - started)
+
+# Трассировка SQL включается SQL_TRACE=1; без неё соединения обычные sqlite3
+SQL_LATENCY = metrics.histogram(
+    "bot_sql_seconds", "Время выполнения SQL-запроса", ["statement", "handler"])
+SQL_ROWS = metrics.counter(
+    "bot_sql_rows_total", "Строки, прочитанные или изменённые запросами", ["statement"])
+SQL_LOCK_WAIT = metrics.counter(
+    "bot_sql_lock_wait_seconds_total", "Время ожидания блокировки записи")
+SQL_LOCK_TIMEOUTS = metrics.counter(
+    "bot_sql_lock_timeouts_total", "Запросы, завершившиеся ошибкой database is locked")
+
+def observe_statement(statement: str, handler: str, seconds: float, rows: int):
+    SQL_LATENCY.observe(seconds, statement, handler)
+    if rows:
+        SQL_ROWS.inc(statement, amount=rows)
+
+def observe_lock_wait(seconds: float, timed_out: bool):
+    SQL_LOCK_WAIT.inc(amount=seconds)
+    if timed_out:
+        SQL_LOCK_TIMEOUTS.inc()
+
+sql_tracer = SqlTracer(SQL_SLOW_MS / 1000, observe_statement, observe_lock_wait) if SQL_TRACE else None
+
 class Database:
     """Клас для роботи з базою даних"""
     
-    @staticmethod
-    def get_connection():
-        """Повертає з'єднання з базою даних"""
-        return sqlite3.connect('farm_bot.db', timeout=20, check_same_thread=False)
+    connections = ConnectionManager(
+        DB_PATH,
+        readers=DB_READERS,
+        journal_mode=DB_JOURNAL_MODE,
+        synchronous=DB_SYNCHRONOUS,
+        timeout=DB_BUSY_TIMEOUT,
+        cached_statements=DB_CACHED_STATEMENTS,
+        tracer=sql_tracer
+    )
     
     @staticmethod
     def save_user(user_id: int, first_name: str = "", last_name: str = "", username: str = ""):
         """Зберігає або оновлює користувача"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
+            # UPSERT: REPLACE удаляет строку без триггера удаления и сбил бы счётчик пользователей
             cursor.execute('''
-                INSERT OR REPLACE INTO users (user_id, first_name, last_name, username)
+                INSERT INTO users (user_id, first_name, last_name, username)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    username = excluded.username
             ''', (user_id, first_name, last_name, username))
             
             conn.commit()
         except Exception as e:
-            logger.error(f"❌ Ошибка сохранения пользователя: {e}")
+            logger.error("❌ Ошибка сохранения пользователя: %s", e)
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
     def get_user_session(user_id: int) -> Dict:
         """Отримує сесію користувача"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_reader()
         cursor = conn.cursor()
         
         try:
@@ -186,15 +569,15 @@ class Database:
                 }
             return {"state": "", "temp_data": {}, "last_section": "main_menu"}
         except Exception as e:
-            logger.error(f"❌ Ошибка получения сессии: {e}")
+            logger.error("❌ Ошибка получения сессии: %s", e)
             return {"state": "", "temp_data": {}, "last_section": "main_menu"}
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
     def save_user_session(user_id: int, state: str = "", temp_data: Dict = None, last_section: str = ""):
         """Зберігає сесію користувача"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
@@ -207,64 +590,101 @@ class Database:
             
             conn.commit()
         except Exception as e:
-            logger.error(f"❌ Ошибка сохранения сессии: {e}")
+            logger.error("❌ Ошибка сохранения сессии: %s", e)
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
     def clear_user_session(user_id: int):
         """Очищає сесію користувача"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
             cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
             conn.commit()
         except Exception as e:
-            logger.error(f"❌ Ошибка очистки сессии: {e}")
+            logger.error("❌ Ошибка очистки сессии: %s", e)
+        finally:
+            Database.connections.release(conn)
+    
+    @staticmethod
+    def get_session_row(user_id: int) -> Optional[Tuple]:
+        """Отримує сирий рядок сесії (state, temp_data, last_section) або None"""
+        conn = Database.connections.acquire_reader()
+        
+        try:
+            return conn.execute('''
+                SELECT state, temp_data, last_section
+                FROM user_sessions
+                WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+        finally:
+            Database.connections.release(conn)
+    
+    @staticmethod
+    def save_sessions(upserts: List[Tuple], deletes: List[Tuple], patches: List[Tuple] = ()):
+        """Зберігає пачку змінених сесій однією транзакцією.
+
+        patches: (user_id, state, повний temp_data, last_section, json зі
+        зміненими полями) - temp_data оновлюється через json_patch без
+        перезапису цілого JSON. Якщо рядка вже немає (його видалила
+        архівація застарілих сесій), він вставляється з повним temp_data.
+        """
+        conn = Database.connections.acquire_writer()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.executemany('DELETE FROM user_sessions WHERE user_id = ?', deletes)
+            cursor.executemany('''
+                INSERT OR REPLACE INTO user_sessions (user_id, state, temp_data, last_section, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', upserts)
+            cursor.executemany('''
+                INSERT INTO user_sessions (user_id, state, temp_data, last_section, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    state = excluded.state,
+                    temp_data = json_patch(temp_data, ?),
+                    last_section = excluded.last_section,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', patches)
+            conn.commit()
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
-    def add_to_cart(user_id: int, product_id: int, quantity: float) -> bool:
-        """Додає товар до кошика"""
-        conn = Database.get_connection()
+    def add_to_cart(user_id: int, product_id: int, quantity: float) -> Optional[Tuple[int, float]]:
+        """Додає товар до кошика; повертає (cart_id, нова кількість) або None при помилці"""
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
-            # Проверяем, есть ли уже товар в корзине
+            # Одна инструкция вместо SELECT + UPDATE/INSERT: позиция уникальна по (user_id, product_id).
+            # RETURNING отдаёт итоговую строку, чтобы снимок корзины обновился без повторного чтения
             cursor.execute('''
-                SELECT id, quantity FROM carts 
-                WHERE user_id = ? AND product_id = ?
-            ''', (user_id, product_id))
-            
-            existing = cursor.fetchone()
-            
-            if existing:
-                cart_id, old_quantity = existing
-                new_quantity = old_quantity + quantity
-                cursor.execute('''
-                    UPDATE carts SET quantity = ?, added_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (new_quantity, cart_id))
-            else:
-                cursor.execute('''
-                    INSERT INTO carts (user_id, product_id, quantity)
-                    VALUES (?, ?, ?)
-                ''', (user_id, product_id, quantity))
-            
+                INSERT INTO carts (user_id, product_id, quantity)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id, product_id) DO UPDATE SET
+                    quantity = quantity + excluded.quantity,
+                    added_at = CURRENT_TIMESTAMP
+                RETURNING id, quantity
+            ''', (user_id, product_id, quantity))
+            row = cursor.fetchone()
+
             conn.commit()
-            return True
+            return row
         except Exception as e:
-            logger.error(f"❌ Ошибка добавления в корзину: {e}")
-            return False
+            logger.error("❌ Ошибка добавления в корзину: %s", e)
+            return None
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
-    def get_cart_items(user_id: int) -> List[Dict]:
-        """Отримує товари з кошика"""
-        conn = Database.get_connection()
+    def get_cart_items(user_id: int) -> Optional[List[Dict]]:
+        """Отримує товари з кошика; None - помилка читання"""
+        conn = Database.connections.acquire_reader()
         cursor = conn.cursor()
         
         try:
@@ -274,7 +694,7 @@ class Database:
             items = []
             for row in rows:
                 cart_id, product_id, quantity = row
-                product = next((p for p in PRODUCTS if p["id"] == product_id), None)
+                product = CATALOG.get(product_id)
                 if product:
                     items.append({
                         "cart_id": cart_id,
@@ -284,48 +704,53 @@ class Database:
             
             return items
         except Exception as e:
-            logger.error(f"❌ Ошибка получения корзины: {e}")
-            return []
+            logger.error("❌ Ошибка получения корзины: %s", e)
+            return None
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
-    def clear_cart(user_id: int):
+    def clear_cart(user_id: int) -> bool:
         """Очищає кошик"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
             cursor.execute('DELETE FROM carts WHERE user_id = ?', (user_id,))
             conn.commit()
+            return True
         except Exception as e:
-            logger.error(f"❌ Ошибка очистки корзины: {e}")
+            logger.error("❌ Ошибка очистки корзины: %s", e)
+            return False
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
-    def remove_from_cart(cart_id: int):
-        """Видаляє товар з кошика"""
-        conn = Database.get_connection()
+    def remove_from_cart(user_id: int, cart_id: int) -> bool:
+        """Видаляє товар з кошика користувача"""
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('DELETE FROM carts WHERE id = ?', (cart_id,))
+            # user_id в условии: чужую позицию через подделанный callback не удалить
+            cursor.execute('DELETE FROM carts WHERE id = ? AND user_id = ?', (cart_id, user_id))
             conn.commit()
+            return True
         except Exception as e:
-            logger.error(f"❌ Ошибка удаления из корзины: {e}")
+            logger.error("❌ Ошибка удаления из корзины: %s", e)
+            return False
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
     def create_order(order_data: Dict) -> int:
         """Створює замовлення"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
-            # Используем транзакцию для избежания блокировок
-            cursor.execute('BEGIN TRANSACTION')
+            # Сразу берём блокировку записи, чтобы не получить SQLITE_BUSY посреди транзакции
+            cursor.execute('BEGIN IMMEDIATE')
             
             cursor.execute('''
                 INSERT INTO orders (user_id, user_name, username, phone, city, np_department, total, order_type)
@@ -361,16 +786,16 @@ class Database:
             conn.commit()
             return order_id
         except Exception as e:
-            logger.error(f"❌ Ошибка создания заказа: {e}")
+            logger.error("❌ Ошибка создания заказа: %s", e)
             conn.rollback()
             return 0
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
     def save_message(user_id: int, user_name: str, username: str, text: str, message_type: str):
         """Зберігає повідомлення"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
@@ -381,16 +806,16 @@ class Database:
             
             conn.commit()
         except Exception as e:
-            logger.error(f"❌ Ошибка сохранения сообщения: {e}")
+            logger.error("❌ Ошибка сохранения сообщения: %s", e)
         finally:
-            conn.close()
+            Database.connections.release(conn)
     
     @staticmethod
     def save_quick_order(user_id: int, user_name: str, username: str, product_id: int, 
                         product_name: str, quantity: float, phone: str = None, 
                         contact_method: str = "chat") -> int:
         """Зберігає швидке замовлення"""
-        conn = Database.get_connection()
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
@@ -404,263 +829,1009 @@ class Database:
             conn.commit()
             return order_id
         except Exception as e:
-            logger.error(f"❌ Ошибка сохранения быстрого заказа: {e}")
+            logger.error("❌ Ошибка сохранения быстрого заказа: %s", e)
             return 0
         finally:
-            conn.close()
-    
+            Database.connections.release(conn)
+
     @staticmethod
-    def get_statistics() -> Dict:
-        """Повертає статистику"""
-        conn = Database.get_connection()
+    def get_order_history(user_id: int, limit: int = 5, key: Optional[HistoryKey] = None,
+                          older: bool = True) -> Tuple[List[Dict], bool]:
+        """Сторінка історії замовлень (звичайних і швидких) від нових до старих.
+
+        key - ключ крайнього запису попередньої сторінки, older - напрямок
+        гортання. Повертає записи сторінки і чи є ще записи в цьому напрямку.
+        """
+        if key is None:
+            key, older = (HISTORY_MAX_TS, "q", HISTORY_MAX_ID), True
+        created_at = datetime.fromtimestamp(key[0], timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        compare, order = ("<", "DESC") if older else (">", "ASC")
+
+        conn = Database.connections.acquire_reader()
+        cursor = conn.cursor()
+
+        try:
+            # Каждая ветка читает не больше страницы из своего покрывающего индекса
+            cursor.execute(f'''
+                SELECT kind, id, CAST(strftime('%s', created_at) AS INTEGER), total, status, detail,
+                       product_name, quantity
+                FROM (
+                    SELECT * FROM (
+                        SELECT 'o' AS kind, order_id AS id, created_at, total, status,
+                               order_type AS detail, NULL AS product_name, NULL AS quantity
+                        FROM orders
+                        WHERE user_id = ? AND (created_at, order_id) {compare} (?, ?)
+                        ORDER BY created_at {order}, order_id {order} LIMIT ?
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT 'q', id, created_at, NULL, status, contact_method, product_name, quantity
+                        FROM quick_orders
+                        WHERE user_id = ? AND (created_at, id) {compare} (?, ?)
+                        ORDER BY created_at {order}, id {order} LIMIT ?
+                    )
+                )
+                ORDER BY created_at {order}, kind {order}, id {order} LIMIT ?
+            ''', (
+                user_id, created_at, history_bound("o", key, older), limit + 1,
+                user_id, created_at, history_bound("q", key, older), limit + 1,
+                limit + 1
+            ))
+            rows = cursor.fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit] if older else rows[:limit][::-1]
+
+            entries = []
+            for kind, entry_id, ts, total, status, detail, product_name, quantity in rows:
+                entries.append({
+                    "kind": kind, "id": entry_id, "ts": ts, "total": total, "status": status,
+                    "detail": detail, "items": [(product_name, quantity)] if kind == "q" else []
+                })
+
+            # Позиции всех заказов страницы - одним запросом
+            by_id = {entry["id"]: entry for entry in entries if entry["kind"] == "o"}
+            if by_id:
+                cursor.execute(f'''
+                    SELECT order_id, product_name, quantity FROM order_items
+                    WHERE order_id IN ({",".join("?" * len(by_id))}) ORDER BY order_id, id
+                ''', tuple(by_id))
+                for order_id, product_name, quantity in cursor.fetchall():
+                    by_id[order_id]["items"].append((product_name, quantity))
+
+            return entries, has_more
+        except Exception as e:
+            logger.error("❌ Ошибка получения истории заказов: %s", e)
+            return [], False
+        finally:
+            Database.connections.release(conn)
+
+    @staticmethod
+    def save_batch(users: List[Tuple], messages: List[Tuple]):
+        """Зберігає пачку користувачів і повідомлень однією транзакцією"""
+        conn = Database.connections.acquire_writer()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('SELECT COUNT(*) FROM orders')
-            total_orders = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM messages')
-            total_messages = cursor.fetchone()[0]
+            cursor.execute('BEGIN IMMEDIATE')
             
-            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM carts')
-            active_carts = cursor.fetchone()[0]
+            # UPSERT замість INSERT OR REPLACE, щоб не скидати created_at
+            cursor.executemany('''
+                INSERT INTO users (user_id, first_name, last_name, username)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    username = excluded.username
+            ''', users)
             
-            cursor.execute('SELECT COUNT(*) FROM quick_orders')
-            quick_orders = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO messages (user_id, user_name, username, text, message_type, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', messages)
             
-            return {
-                "total_orders": total_orders,
-                "total_messages": total_messages,
-                "total_users": total_users,
-                "active_carts": active_carts,
-                "quick_orders": quick_orders
-            }
+            conn.commit()
+        finally:
+            Database.connections.release(conn)
+    
+    @staticmethod
+    def get_statistics() -> Dict:
+        """Повертає статистику"""
+        conn = Database.connections.acquire_reader()
+        cursor = conn.cursor()
+        
+        try:
+            # Счётчики ведут триггеры, поэтому чтение не зависит от объёма истории
+            cursor.execute('SELECT name, value FROM counters')
+            counters = dict(cursor.fetchall())
+            # Перенесённые в архив строки в таблицах уже не видны, но в итогах остаются
+            for spec in ARCHIVED_TABLES.values():
+                counters[spec.counter] = counters.get(spec.counter, 0) + counters.pop(spec.archived_counter, 0)
+            return counters
         except Exception as e:
-            logger.error(f"❌ Ошибка получения статистики: {e}")
+            logger.error("❌ Ошибка получения статистики: %s", e)
             return {}
         finally:
-            conn.close()
+            Database.connections.release(conn)
 
-# ==================== ДАНІ ПРОДУКТІВ ====================
+    @staticmethod
+    def reconcile_statistics() -> Dict[str, Tuple[int, int]]:
+        """Перераховує лічильники з таблиць; повертає розбіжності {назва: (було, стало)}"""
+        conn = Database.connections.acquire_writer()
+        cursor = conn.cursor()
 
-PRODUCTS = [
-    {
-        "id": 1,
-        "name": "Артишоки преміум",
-        "category": "овочі",
-        "description": "Свіжі артишоки вищого ґатунку, зібрані вручну",
-        "price": 350,
-        "unit": "кг",
-        "image": "🥬"
-    },
-    {
-        "id": 2,
-        "name": "Спаржа зелена",
-        "category": "овочі",
-        "description": "Нарізана спаржа, готова до приготування, без пестицидів",
-        "price": 280,
-        "unit": "кг",
-        "image": "🌱"
-    },
-    {
-        "id": 3,
-        "name": "Яблука Голден",
-        "category": "фрукти",
-        "description": "Солодкі яблука сорту Голден, ідеальні для пирогів",
-        "price": 60,
-        "unit": "кг",
-        "image": "🍎"
-    },
-    {
-        "id": 4,
-        "name": "Інжир свіжий",
-        "category": "фрукти",
-        "description": "Стиглий інжир прямо з саду, дуже соковитий",
-        "price": 200,
-        "unit": "кг",
-        "image": "🍈"
-    },
-    {
-        "id": 5,
-        "name": "Грецькі горіхи",
-        "category": "горіхи",
-        "description": "Великі смачні горіхи, багаті на вітаміни",
-        "price": 300,
-        "unit": "кг",
-        "image": "🌰"
-    },
-    {
-        "id": 6,
-        "name": "Мед акацієвий",
-        "category": "мед",
-        "description": "Натуральний мед з власної пасіки",
-        "price": 450,
-        "unit": "літр",
-        "image": "🍯"
-    }
-]
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT name, value FROM counters')
+            before = dict(cursor.fetchall())
+            for sql in _recount_statements():
+                cursor.execute(sql)
+            cursor.execute('SELECT name, value FROM counters')
+            after = dict(cursor.fetchall())
+            conn.commit()
+            return {name: (before.get(name), value) for name, value in after.items()
+                    if before.get(name) != value}
+        finally:
+            Database.connections.release(conn)
 
-FAQS = [
-    {
-        "question": "Які способи оплати ви приймаєте?",
-        "answer": "✅ Готівка при отриманні\n✅ Переказ на карту ПриватБанку\n✅ Оплата через LiqPay"
-    },
-    {
-        "question": "Які терміни доставки?",
-        "answer": "🚚 Київ - 1-2 дні\n🚚 Україна - 2-4 дні\n🚛 Великі партії - 3-5 днів"
-    },
-    {
-        "question": "Чи є гарантія якості?",
-        "answer": "⭐ Всі продукти екологічно чисті\n⭐ Без штучних добавок\n⭐ Щоденний контроль якості"
-    },
-    {
-        "question": "Як зберігати продукти?",
-        "answer": "❄️ Овочі/фрукти - у холодильнику\n🌰 Горіхи - у сухому місці\n🍯 Мед - кімнатна температура"
-    },
-    {
-        "question": "Чи є знижки?",
-        "answer": "🎁 Постійним клієнтам - 5%\n🎁 Замовлення від 1000 грн - 3%\n🎁 При самовивозі - 2%"
-    }
-]
+    @staticmethod
+    def archive_candidates(table: str, after_id: int = 0) -> List[Tuple[int, str]]:
+        """Наступна пачка рядків table, що підлягають архівації: [(id, місяць)]"""
+        conn = Database.connections.acquire_reader()
+        try:
+            return archiver.candidates(conn, table, after_id)
+        finally:
+            Database.connections.release(conn)
 
-COMPANY_INFO = {
-    "name": "🌱 Ферма 'Смак природи'",
-    "description": "Ми сімейна ферма, що спеціалізується на вирощуванні екологічно чистих овочів, фруктів та горіхів.",
-    "details": [
-        "👨‍🌾 Працюємо з 2015 року",
-        "📍 Розташування: Київська область, с. Зелене",
-        "📞 Телефон: +380 (67) 123-45-67",
-        "📧 Email: info@smak-pryrody.ua",
-        "🕒 Графік: Пн-Пт 9:00-18:00, Сб 10:00-15:00",
-        "🚚 Доставка: по всій Україні"
-    ]
-}
+    @staticmethod
+    def archive_rows(table: str, month: str, ids: List[int]) -> int:
+        """Переносить рядки в архів місяця"""
+        conn = Database.connections.acquire_writer()
+        try:
+            return archiver.move(conn, table, month, ids)
+        finally:
+            Database.connections.release(conn)
 
-# ==================== ГЕНЕРАТОРИ КЛАВІАТУР ====================
+    @staticmethod
+    def delete_stale_sessions() -> int:
+        """Видаляє пачку застарілих сесій"""
+        conn = Database.connections.acquire_writer()
+        try:
+            return archiver.delete_stale_sessions(conn)
+        finally:
+            Database.connections.release(conn)
 
-def create_inline_keyboard(buttons: List[List[Dict]]) -> InlineKeyboardMarkup:
-    """Створює inline клавіатуру"""
-    keyboard = []
-    
-    for row in buttons:
-        keyboard_row = []
-        for button in row:
-            keyboard_row.append(
-                InlineKeyboardButton(
-                    text=button.get("text", ""),
-                    callback_data=button.get("callback_data", "")
-                )
-            )
-        keyboard.append(keyboard_row)
+    @staticmethod
+    def vacuum_step(pages: int) -> Optional[int]:
+        """Крок incremental_vacuum; повертає кількість вільних сторінок, що лишилися"""
+        conn = Database.connections.acquire_writer()
+        try:
+            return archiver.vacuum_step(conn, pages)
+        finally:
+            Database.connections.release(conn)
     
-    return InlineKeyboardMarkup(keyboard)
+    @staticmethod
+    def get_product_photos() -> List[Tuple[int, str, str]]:
+        """Збережені file_id фото: [(product_id, content_hash, file_id)]"""
+        conn = Database.connections.acquire_reader()
+        try:
+            return conn.execute('SELECT product_id, content_hash, file_id FROM product_photos').fetchall()
+        finally:
+            Database.connections.release(conn)
 
-def get_main_menu() -> InlineKeyboardMarkup:
-    """Головне меню"""
-    buttons = [
-        [{"text": "🏢 Про компанію", "callback_data": "company"}],
-        [{"text": "📦 Наші продукти", "callback_data": "products"}],
-        [{"text": "❓ Часті запитання", "callback_data": "faq"}],
-        [
-            {"text": "🛒 Моя корзина", "callback_data": "cart"}, 
-            {"text": "📋 Мої замовлення", "callback_data": "my_orders"}
-        ],
-        [{"text": "📞 Зв'язатися з нами", "callback_data": "contact"}]
-    ]
-    return create_inline_keyboard(buttons)
+    @staticmethod
+    def save_product_photo(product_id: int, content_hash: str, file_id: str):
+        """Запам'ятовує file_id завантаженого фото"""
+        conn = Database.connections.acquire_writer()
+        try:
+            conn.execute('''
+                INSERT INTO product_photos (product_id, content_hash, file_id) VALUES (?, ?, ?)
+                ON CONFLICT(product_id, content_hash) DO UPDATE SET
+                    file_id = excluded.file_id,
+                    uploaded_at = CURRENT_TIMESTAMP
+            ''', (product_id, content_hash, file_id))
+            conn.commit()
+        except Exception as e:
+            logger.error("❌ Ошибка сохранения file_id фото: %s", e)
+        finally:
+            Database.connections.release(conn)
 
-def get_back_keyboard(back_to: str) -> InlineKeyboardMarkup:
-    """Повертає кнопку 'Назад'"""
-    buttons = [[{"text": "🔙 Назад", "callback_data": f"back_{back_to}"}]]
-    return create_inline_keyboard(buttons)
+    @staticmethod
+    def ping() -> bool:
+        """Перевіряє, що база відповідає на запити"""
+        conn = Database.connections.acquire_reader()
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        finally:
+            Database.connections.release(conn)
 
-def get_products_menu() -> InlineKeyboardMarkup:
-    """Меню продуктів"""
-    buttons = []
-    
-    for product in PRODUCTS:
-        buttons.append([{
-            "text": f"{product['image']} {product['name']} - {product['price']} грн/{product['unit']}",
-            "callback_data": f"product_{product['id']}"
-        }])
-    
-    buttons.append([{"text": "🔙 Назад", "callback_data": "back_main_menu"}])
-    return create_inline_keyboard(buttons)
+class AsyncDatabase:
+    """Асинхронний доступ до бази даних.
 
-def get_product_detail_menu(product_id: int) -> InlineKeyboardMarkup:
-    """Меню деталей продукту"""
-    buttons = [
-        [{"text": "🛒 Додати в кошик", "callback_data": f"add_to_cart_{product_id}"}],
-        [{"text": "⚡ Швидке замовлення", "callback_data": f"quick_order_{product_id}"}],
-        [{"text": "🔙 Назад", "callback_data": "back_products"}]
-    ]
-    return create_inline_keyboard(buttons)
+    Усі виклики Database виконуються в окремих потоках, тому очікування
+    блокування SQLite не зупиняє event loop і інші чати обслуговуються далі.
+    Запис іде через один потік writer-а, читання - через пул reader-ів.
+    """
 
-def get_quick_order_menu(product_id: int) -> InlineKeyboardMarkup:
-    """Меню швидкого замовлення"""
-    buttons = [
-        [{"text": "📞 Зателефонуйте мені", "callback_data": f"quick_call_{product_id}"}],
-        [{"text": "💬 Напишіть мені в чат", "callback_data": f"quick_chat_{product_id}"}],
-        [{"text": "🔙 Назад", "callback_data": f"product_{product_id}"}]
-    ]
-    return create_inline_keyboard(buttons)
+    _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+    _readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
 
-def get_faq_menu() -> InlineKeyboardMarkup:
-    """Меню FAQ"""
-    buttons = []
+    @staticmethod
+    async def _run(func: Callable, *args, **kwargs):
+        """Виконує синхронний метод Database у потоці writer-а"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(AsyncDatabase._writer, AsyncDatabase._call(func, args, kwargs))
+
+    @staticmethod
+    async def _read(func: Callable, *args, **kwargs):
+        """Виконує синхронний метод Database, що лише читає, у пулі reader-ів"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(AsyncDatabase._readers, AsyncDatabase._call(func, args, kwargs))
+
+    @staticmethod
+    def _call(func: Callable, args: Tuple, kwargs: Dict) -> Callable:
+        if SQL_TRACE:
+            # run_in_executor не переносит contextvars, а трассировке нужен обработчик
+            return partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return partial(func, *args, **kwargs)
+
+    @staticmethod
+    def shutdown():
+        """Дочікується завершення запитів, зупиняє потоки та закриває з'єднання.
+
+        Після зупинки створюються нові пули потоків, як і з'єднання, що
+        відкриваються заново при першому запиті, тому Application можна
+        запустити повторно в тому ж процесі.
+        """
+        AsyncDatabase._writer.shutdown(wait=True)
+        AsyncDatabase._readers.shutdown(wait=True)
+        Database.connections.close()
+        AsyncDatabase._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        AsyncDatabase._readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+
+    @staticmethod
+    async def save_user(user_id: int, first_name: str = "", last_name: str = "", username: str = ""):
+        return await AsyncDatabase._run(Database.save_user, user_id, first_name, last_name, username)
+
+    @staticmethod
+    async def get_user_session(user_id: int) -> Dict:
+        return await AsyncDatabase._read(Database.get_user_session, user_id)
+
+    @staticmethod
+    async def save_user_session(user_id: int, state: str = "", temp_data: Dict = None, last_section: str = ""):
+        return await AsyncDatabase._run(Database.save_user_session, user_id, state, temp_data, last_section)
+
+    @staticmethod
+    async def clear_user_session(user_id: int):
+        return await AsyncDatabase._run(Database.clear_user_session, user_id)
+
+    @staticmethod
+    async def add_to_cart(user_id: int, product_id: int, quantity: float) -> Optional[Tuple[int, float]]:
+        return await AsyncDatabase._run(Database.add_to_cart, user_id, product_id, quantity)
+
+    @staticmethod
+    async def get_cart_items(user_id: int) -> Optional[List[Dict]]:
+        return await AsyncDatabase._read(Database.get_cart_items, user_id)
+
+    @staticmethod
+    async def clear_cart(user_id: int) -> bool:
+        return await AsyncDatabase._run(Database.clear_cart, user_id)
+
+    @staticmethod
+    async def remove_from_cart(user_id: int, cart_id: int) -> bool:
+        return await AsyncDatabase._run(Database.remove_from_cart, user_id, cart_id)
+
+    @staticmethod
+    async def create_order(order_data: Dict) -> int:
+        order_id = await AsyncDatabase._run(Database.create_order, order_data)
+        if order_id:
+            ORDERS_CREATED.inc(order_data.get("order_type", ""))
+        return order_id
+
+    @staticmethod
+    async def save_message(user_id: int, user_name: str, username: str, text: str, message_type: str):
+        return await AsyncDatabase._run(Database.save_message, user_id, user_name, username, text, message_type)
+
+    @staticmethod
+    async def save_quick_order(user_id: int, user_name: str, username: str, product_id: int,
+                               product_name: str, quantity: float, phone: str = None,
+                               contact_method: str = "chat") -> int:
+        order_id = await AsyncDatabase._run(
+            Database.save_quick_order, user_id, user_name, username, product_id,
+            product_name, quantity, phone, contact_method
+        )
+        if order_id:
+            QUICK_ORDERS_CREATED.inc(contact_method)
+        return order_id
+
+    @staticmethod
+    async def get_order_history(user_id: int, limit: int = 5, key: Optional[HistoryKey] = None,
+                                older: bool = True) -> Tuple[List[Dict], bool]:
+        return await AsyncDatabase._read(Database.get_order_history, user_id, limit, key, older)
+
+    @staticmethod
+    async def get_statistics() -> Dict:
+        return await AsyncDatabase._read(Database.get_statistics)
+
+    @staticmethod
+    async def get_product_photos() -> List[Tuple[int, str, str]]:
+        return await AsyncDatabase._read(Database.get_product_photos)
+
+    @staticmethod
+    async def save_product_photo(product_id: int, content_hash: str, file_id: str):
+        return await AsyncDatabase._run(Database.save_product_photo, product_id, content_hash, file_id)
+
+    @staticmethod
+    async def ping() -> bool:
+        return await AsyncDatabase._read(Database.ping)
+
+class BackgroundFlusher:
+    """Базовий клас для буферів, що періодично зберігаються у фоні.
+
+    Підклас реалізує flush(); збереження відбувається раз на interval секунд
+    або раніше, якщо викликано request_flush().
+    """
+
+    # Чи викликати flush() ще раз при зупинці
+    flush_on_stop = True
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def flush(self):
+        raise NotImplementedError
+
+    def request_flush(self):
+        """Просить фонову задачу зберегти дані, не чекаючи інтервалу"""
+        self._wakeup.set()
+
+    async def _run(self):
+        current_handler.set(type(self).__name__)
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Запускає фонове збереження"""
+        if self._task is None:
+            # Подія прив'язується до циклу, тому створюється в тому, де працює задача
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Зупиняє фонове збереження і записує залишок"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.flush_on_stop:
+            await self.flush()
+
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "2"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500"))
+WRITE_BEHIND_KNOWN_USERS = int(os.getenv("WRITE_BEHIND_KNOWN_USERS", "100000"))
+
+class WriteBehindBuffer(BackgroundFlusher):
+    """Буфер відкладеного запису для таблиць users і messages.
+
+    Профіль користувача записується лише коли змінилися ім'я чи username,
+    а повідомлення накопичуються і зберігаються пачкою однією транзакцією:
+    раз на interval секунд, при досягненні max_pending рядків і при зупинці.
+    """
+
+    def __init__(self, interval: float = 2, max_pending: int = 500, known_users: int = 100000):
+        super().__init__(interval)
+        self.max_pending = max_pending
+        self.known_users_limit = known_users
+
+        self._known_users: "OrderedDict[int, Tuple]" = OrderedDict()
+        self._pending_users: Dict[int, Tuple] = {}
+        self._pending_messages: List[Tuple] = []
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending_users) + len(self._pending_messages)
+
+    def save_user(self, user_id: int, first_name: str = "", last_name: str = "", username: str = ""):
+        """Ставить користувача в чергу, якщо профіль змінився"""
+        profile = (first_name, last_name, username)
+        if self._known_users.get(user_id) == profile:
+            self._known_users.move_to_end(user_id)
+            return
+
+        self._known_users[user_id] = profile
+        self._known_users.move_to_end(user_id)
+        if len(self._known_users) > self.known_users_limit:
+            self._known_users.popitem(last=False)
+
+        self._pending_users[user_id] = (user_id, first_name, last_name, username)
+        self._check_size()
+
+    def save_message(self, user_id: int, user_name: str, username: str, text: str, message_type: str):
+        """Ставить повідомлення в чергу на запис"""
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self._pending_messages.append((user_id, user_name, username, text, message_type, created_at))
+        self._check_size()
+
+    def _check_size(self):
+        if self.pending >= self.max_pending:
+            self.request_flush()
+
+    async def flush(self):
+        """Записує все накопичене однією транзакцією"""
+        if not self.pending:
+            return
+
+        users = self._pending_users
+        messages = self._pending_messages
+        self._pending_users = {}
+        self._pending_messages = []
+
+        try:
+            await AsyncDatabase._run(Database.save_batch, list(users.values()), messages)
+        except Exception as e:
+            logger.error("❌ Ошибка пакетной записи (%s пользователей, %s сообщений): %s", len(users), len(messages), e)
+            # Возвращаем строки в очередь; более свежий профиль пользователя важнее старого
+            for user_id, row in users.items():
+                self._pending_users.setdefault(user_id, row)
+                self._known_users.pop(user_id, None)
+            self._pending_messages[:0] = messages
+
+write_buffer = WriteBehindBuffer(WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_KNOWN_USERS)
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+
+class SessionCache(BackgroundFlusher):
+    """Кеш сесій користувачів перед таблицею user_sessions.
+
+    Сесії тримаються в LRU з обмеженим розміром і TTL простою. Зміни лише
+    позначають сесію "брудною"; у базу потрапляє тільки останній стан
+    пачкою раз на interval секунд, тому clear + save одразу після нього
+    дають один запис, а збереження без змін не дає жодного. Якщо сесію
+    змінювали лише через update(), у базу йдуть тільки змінені поля
+    temp_data (json_patch), а не весь JSON.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 1800, interval: float = 5):
+        super().__init__(interval)
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # user_id -> (рядок сесії або None, час останнього звернення)
+        self._entries: "OrderedDict[int, Tuple[Optional[Tuple], float]]" = OrderedDict()
+        # user_id -> стан, який зараз лежить у базі
+        self._persisted: Dict[int, Optional[Tuple]] = {}
+        # user_id -> стан, який треба записати (None означає видалення)
+        self._dirty: Dict[int, Optional[Tuple]] = {}
+        # user_id -> змінені поля temp_data відносно рядка в базі
+        self._patches: Dict[int, Dict] = {}
+        # user_id -> стан, який зараз записує flush (після нього він і буде в базі)
+        self._inflight: Dict[int, Optional[Tuple]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.elided = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _to_session(row: Optional[Tuple]) -> Dict:
+        if row is None:
+            return {"state": "", "temp_data": {}, "last_section": "main_menu"}
+        state, temp_data_json, last_section = row
+        return {
+            "state": state,
+            "temp_data": json.loads(temp_data_json) if temp_data_json else {},
+            "last_section": last_section
+        }
+
+    def _remember(self, user_id: int, row: Optional[Tuple]):
+        self._entries[user_id] = (row, time.monotonic())
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            evicted_id, _ = self._entries.popitem(last=False)
+            # Брудна сесія залишається в _dirty до наступного збереження
+            self._persisted.pop(evicted_id, None)
+            self.evictions += 1
+
+    def _stored(self, user_id: int) -> Tuple[bool, Optional[Tuple]]:
+        """(чи відомий, рядок) - стан у базі після запису, що вже йде"""
+        if user_id in self._inflight:
+            return True, self._inflight[user_id]
+        return user_id in self._persisted, self._persisted.get(user_id)
+
+    def _set(self, user_id: int, row: Optional[Tuple], patch: Dict = None):
+        self._remember(user_id, row)
+        known, stored = self._stored(user_id)
+        if known and stored == row:
+            # Стан збігається з тим, що вже в базі - запис не потрібен
+            self._dirty.pop(user_id, None)
+            self._patches.pop(user_id, None)
+            self.elided += 1
+            return
+
+        # Частковий запис можливий, лише якщо рядок є в базі і всі зміни
+        # після нього теж були частковими
+        partial_ok = (
+            patch is not None
+            and stored is not None
+            and (user_id not in self._dirty or user_id in self._patches)
+        )
+        if partial_ok:
+            self._patches.setdefault(user_id, {}).update(patch)
+        else:
+            self._patches.pop(user_id, None)
+        self._dirty[user_id] = row
+
+    def _current_row(self, user_id: int) -> Optional[Tuple]:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            return entry[0]
+        return self._dirty.get(user_id)
+
+    async def get(self, user_id: int) -> Dict:
+        """Повертає сесію користувача (копію, яку можна змінювати)"""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            self._remember(user_id, entry[0])
+            return self._to_session(entry[0])
+
+        if user_id in self._dirty:
+            # Витіснена з LRU, але ще не збережена
+            self.hits += 1
+            row = self._dirty[user_id]
+            self._remember(user_id, row)
+            return self._to_session(row)
+
+        self.misses += 1
+        try:
+            row = await AsyncDatabase._read(Database.get_session_row, user_id)
+        except Exception as e:
+            logger.error("❌ Ошибка получения сессии: %s", e)
+            return self._to_session(None)
+
+        row = tuple(row) if row else None
+        # Поки читали, сесію могли змінити - свіжіший стан у кеші важливіший
+        if user_id in self._entries:
+            row = self._entries[user_id][0]
+        elif user_id in self._dirty:
+            row = self._dirty[user_id]
+        else:
+            self._persisted[user_id] = row
+            self._remember(user_id, row)
+        return self._to_session(row)
+
+    def save(self, user_id: int, state: str = "", temp_data: Dict = None, last_section: str = ""):
+        """Зберігає сесію користувача (повна заміна, як і в Database)"""
+        temp_data_json = json.dumps(temp_data) if temp_data else "{}"
+        self._set(user_id, (state, temp_data_json, last_section))
+
+    def update(self, user_id: int, state: str, changes: Dict):
+        """Переводить сесію в стан state, змінюючи лише вказані поля temp_data"""
+        row = self._current_row(user_id)
+        session = self._to_session(row)
+        temp_data = session["temp_data"]
+        temp_data.update(changes)
+        last_section = row[2] if row else ""
+        self._set(user_id, (state, json.dumps(temp_data), last_section), patch=changes)
+
+    def clear(self, user_id: int):
+        """Очищає сесію користувача"""
+        # None означає "рядка в базі немає"
+        self._set(user_id, None)
+
+    def evict_expired(self):
+        """Видаляє з кешу сесії, до яких не зверталися довше за TTL"""
+        deadline = time.monotonic() - self.ttl
+        while self._entries:
+            user_id, (_, last_access) = next(iter(self._entries.items()))
+            if last_access > deadline:
+                break
+            self._entries.popitem(last=False)
+            self._persisted.pop(user_id, None)
+            self.evictions += 1
+
+    async def flush(self):
+        """Записує брудні сесії однією транзакцією"""
+        self.evict_expired()
+        if not self._dirty:
+            return
+
+        dirty = self._dirty
+        patches = self._patches
+        self._dirty = {}
+        self._patches = {}
+        # Пока пачка пишется, _set сравнивает новые состояния с ней, а не с _persisted:
+        # иначе возврат к старому состоянию посчитался бы уже сохранённым
+        self._inflight = dirty
+
+        upserts, deletes, partial = [], [], []
+        for user_id, row in dirty.items():
+            if row is None:
+                deletes.append((user_id,))
+            elif user_id in patches:
+                partial.append((user_id,) + row + (json.dumps(patches[user_id]),))
+            else:
+                upserts.append((user_id,) + row)
+
+        try:
+            await AsyncDatabase._run(Database.save_sessions, upserts, deletes, partial)
+        except Exception as e:
+            self._inflight = {}
+            logger.error("❌ Ошибка сохранения сессий (%s): %s", len(dirty), e)
+            for user_id, row in dirty.items():
+                if user_id not in self._dirty:
+                    self._dirty[user_id] = row
+                    if user_id in patches:
+                        self._patches[user_id] = patches[user_id]
+                elif user_id in self._patches:
+                    if user_id in patches:
+                        # Новіші зміни накладаються поверх незбережених
+                        self._patches[user_id] = {**patches[user_id], **self._patches[user_id]}
+                    else:
+                        # Не записался полный снимок: патч поверх старой строки в базе потерял бы его,
+                        # поэтому следующий flush снова пишет сессию целиком
+                        del self._patches[user_id]
+            return
+
+        self._inflight = {}
+        self.writes += len(dirty)
+        for user_id, row in dirty.items():
+            if user_id not in self._entries:
+                continue
+            if row == self._current_row(user_id):
+                self._persisted[user_id] = row
+            else:
+                # Сессию уже изменили снова и новое состояние ждёт в _dirty;
+                # без известной строки следующая запись будет полной
+                self._persisted.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Лічильники кешу"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "writes": self.writes,
+            "elided": self.elided,
+            "evictions": self.evictions
+        }
+
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_TTL, SESSION_FLUSH_INTERVAL)
+
+# ==================== АРХИВАЦИЯ И ХРАНЕНИЕ ====================
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "archive")
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "86400"))  # 0 - только через python bot.py archive
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "500"))
+ARCHIVE_PAUSE = float(os.getenv("ARCHIVE_PAUSE", "0.01"))
+ARCHIVE_VACUUM_PAGES = int(os.getenv("ARCHIVE_VACUUM_PAGES", "1000"))
+
+archiver = Archiver(
+    ARCHIVE_DIR,
+    RetentionPolicy(
+        orders_days=int(os.getenv("ARCHIVE_ORDERS_DAYS", "180")),
+        messages_days=int(os.getenv("ARCHIVE_MESSAGES_DAYS", "365")),
+        sessions_days=int(os.getenv("SESSION_RETENTION_DAYS", "30")),
+        closed_statuses=tuple(
+            status.strip() for status in os.getenv("ARCHIVE_CLOSED_STATUSES", "виконано,скасовано").split(",")
+            if status.strip()
+        ),
+    ),
+    ARCHIVE_BATCH
+)
+
+async def run_retention() -> Counter:
+    """Один прохід архівації: пачки по ARCHIVE_BATCH рядків, кожна - своя транзакція.
+
+    Між пачками writer свободен для обработчиков, так что бот не ждёт
+    конца прохода.
+    """
+    moved = Counter()
+    for table in ARCHIVED_TABLES:
+        after_id = 0
+        while True:
+            rows = await AsyncDatabase._read(Database.archive_candidates, table, after_id)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            for month, ids in group_by_month(rows):
+                moved[table] += await AsyncDatabase._run(Database.archive_rows, table, month, ids)
+            await asyncio.sleep(ARCHIVE_PAUSE)
+
+    while True:
+        deleted = await AsyncDatabase._run(Database.delete_stale_sessions)
+        moved["user_sessions"] += deleted
+        if deleted < ARCHIVE_BATCH:
+            break
+        await asyncio.sleep(ARCHIVE_PAUSE)
+
+    while True:
+        free_pages = await AsyncDatabase._run(Database.vacuum_step, ARCHIVE_VACUUM_PAGES)
+        if free_pages is None:
+            logger.warning("⚠️ auto_vacuum не INCREMENTAL: место освободится только после "
+                           "python bot.py archive --enable-incremental-vacuum")
+            break
+        if not free_pages:
+            break
+        await asyncio.sleep(ARCHIVE_PAUSE)
+
+    moved = +moved  # без нулевых записей
+    if moved:
+        logger.info("🗄️ Архивация: %s", dict(moved))
+    return moved
+
+class RetentionJob(BackgroundFlusher):
+    """Періодична архівація раз на interval секунд"""
+
+    # Незавершённый проход продолжится в следующий раз, ждать его при остановке не нужно
+    flush_on_stop = False
+
+    async def flush(self):
+        try:
+            await run_retention()
+        except Exception as e:
+            logger.error("❌ Ошибка архивации: %s", e)
+
+retention_job = RetentionJob(ARCHIVE_INTERVAL)
+
+# ==================== ДАНІ ПРОДУКТІВ ====================
+
+CATALOG = Catalog([
+    Product(
+        id=1,
+        name="Артишоки преміум",
+        category="овочі",
+        description="Свіжі артишоки вищого ґатунку, зібрані вручну",
+        price=350,
+        unit="кг",
+        image="🥬"
+    ),
+    Product(
+        id=2,
+        name="Спаржа зелена",
+        category="овочі",
+        description="Нарізана спаржа, готова до приготування, без пестицидів",
+        price=280,
+        unit="кг",
+        image="🌱"
+    ),
+    Product(
+        id=3,
+        name="Яблука Голден",
+        category="фрукти",
+        description="Солодкі яблука сорту Голден, ідеальні для пирогів",
+        price=60,
+        unit="кг",
+        image="🍎"
+    ),
+    Product(
+        id=4,
+        name="Інжир свіжий",
+        category="фрукти",
+        description="Стиглий інжир прямо з саду, дуже соковитий",
+        price=200,
+        unit="кг",
+        image="🍈"
+    ),
+    Product(
+        id=5,
+        name="Грецькі горіхи",
+        category="горіхи",
+        description="Великі смачні горіхи, багаті на вітаміни",
+        price=300,
+        unit="кг",
+        image="🌰"
+    ),
+    Product(
+        id=6,
+        name="Мед акацієвий",
+        category="мед",
+        description="Натуральний мед з власної пасіки",
+        price=450,
+        unit="літр",
+        image="🍯"
+    )
+])
+
+FAQS = [
+    {
+        "question": "Які способи оплати ви приймаєте?",
+        "answer": "✅ Готівка при отриманні\n✅ Переказ на карту ПриватБанку\n✅ Оплата через LiqPay"
+    },
+    {
+        "question": "Які терміни доставки?",
+        "answer": "🚚 Київ - 1-2 дні\n🚚 Україна - 2-4 дні\n🚛 Великі партії - 3-5 днів"
+    },
+    {
+        "question": "Чи є гарантія якості?",
+        "answer": "⭐ Всі продукти екологічно чисті\n⭐ Без штучних добавок\n⭐ Щоденний контроль якості"
+    },
+    {
+        "question": "Як зберігати продукти?",
+        "answer": "❄️ Овочі/фрукти - у холодильнику\n🌰 Горіхи - у сухому місці\n🍯 Мед - кімнатна температура"
+    },
+    {
+        "question": "Чи є знижки?",
+        "answer": "🎁 Постійним клієнтам - 5%\n🎁 Замовлення від 1000 грн - 3%\n🎁 При самовивозі - 2%"
+    }
+]
+
+COMPANY_INFO = {
+    "name": "🌱 Ферма 'Смак природи'",
+    "description": "Ми сімейна ферма, що спеціалізується на вирощуванні екологічно чистих овочів, фруктів та горіхів.",
+    "details": [
+        "👨‍🌾 Працюємо з 2015 року",
+        "📍 Розташування: Київська область, с. Зелене",
+        "📞 Телефон: +380 (67) 123-45-67",
+        "📧 Email: info@smak-pryrody.ua",
+        "🕒 Графік: Пн-Пт 9:00-18:00, Сб 10:00-15:00",
+        "🚚 Доставка: по всій Україні"
+    ]
+}
+
+# ==================== ГЕНЕРАТОРИ КЛАВІАТУР ====================
+
+# Диспетчер inline-кнопок; дії реєструються разом з обробниками нижче
+router = CallbackRouter(
+    observer=lambda action, seconds: CALLBACK_LATENCY.observe(seconds, action),
+    on_reject=CALLBACK_REJECTED.inc
+)
+
+def create_inline_keyboard(buttons: List[List[Dict]]) -> InlineKeyboardMarkup:
+    """Створює inline клавіатуру"""
+    keyboard = []
+    
+    for row in buttons:
+        keyboard_row = []
+        for button in row:
+            keyboard_row.append(
+                InlineKeyboardButton(
+                    text=button.get("text", ""),
+                    callback_data=button.get("callback_data", "")
+                )
+            )
+        keyboard.append(keyboard_row)
+    
+    return InlineKeyboardMarkup(keyboard)
+
+def get_main_menu() -> InlineKeyboardMarkup:
+    """Головне меню"""
+    buttons = [
+        [{"text": "🏢 Про компанію", "callback_data": router.encode("company")}],
+        [{"text": "📦 Наші продукти", "callback_data": router.encode("products")}],
+        [{"text": "❓ Часті запитання", "callback_data": router.encode("faq")}],
+        [
+            {"text": "🛒 Моя корзина", "callback_data": router.encode("cart")}, 
+            {"text": "📋 Мої замовлення", "callback_data": router.encode("my_orders")}
+        ],
+        [{"text": "📞 Зв'язатися з нами", "callback_data": router.encode("contact")}]
+    ]
+    return create_inline_keyboard(buttons)
+
+def get_back_keyboard(back_to: str) -> InlineKeyboardMarkup:
+    """Повертає кнопку 'Назад'"""
+    buttons = [[{"text": "🔙 Назад", "callback_data": router.encode(back_to)}]]
+    return create_inline_keyboard(buttons)
+
+def get_products_menu() -> InlineKeyboardMarkup:
+    """Меню продуктів"""
+    buttons = []
+    
+    for product in CATALOG:
+        buttons.append([{
+            "text": f"{product.image} {product.name} - {product.price} грн/{product.unit}",
+            "callback_data": router.encode("product", product.id)
+        }])
+    
+    buttons.append([{"text": "🔙 Назад", "callback_data": router.encode("main_menu")}])
+    return create_inline_keyboard(buttons)
+
+def get_product_detail_menu(product_id: int) -> InlineKeyboardMarkup:
+    """Меню деталей продукту"""
+    buttons = [
+        [{"text": "🛒 Додати в кошик", "callback_data": router.encode("add_to_cart", product_id)}],
+        [{"text": "⚡ Швидке замовлення", "callback_data": router.encode("quick_order", product_id)}],
+        [{"text": "🔙 Назад", "callback_data": router.encode("products")}]
+    ]
+    return create_inline_keyboard(buttons)
+
+def get_quick_order_menu(product_id: int) -> InlineKeyboardMarkup:
+    """Меню швидкого замовлення"""
+    buttons = [
+        [{"text": "📞 Зателефонуйте мені", "callback_data": router.encode("quick_call", product_id)}],
+        [{"text": "💬 Напишіть мені в чат", "callback_data": router.encode("quick_chat", product_id)}],
+        [{"text": "🔙 Назад", "callback_data": router.encode("product", product_id)}]
+    ]
+    return create_inline_keyboard(buttons)
+
+def get_faq_menu() -> InlineKeyboardMarkup:
+    """Меню FAQ"""
+    buttons = []
     
     for i, faq in enumerate(FAQS, 1):
         buttons.append([{
             "text": f"❔ {faq['question'][:40]}...",
-            "callback_data": f"faq_{i}"
+            "callback_data": router.encode("faq_item", i)
         }])
     
-    buttons.append([{"text": "🔙 Назад", "callback_data": "back_main_menu"}])
+    buttons.append([{"text": "🔙 Назад", "callback_data": router.encode("main_menu")}])
     return create_inline_keyboard(buttons)
 
 def get_contact_menu() -> InlineKeyboardMarkup:
     """Меню контактів"""
     buttons = [
-        [{"text": "📞 Зателефонувати", "callback_data": "call_us"}],
-        [{"text": "📧 Написати email", "callback_data": "email_us"}],
-        [{"text": "📍 Наша адреса", "callback_data": "our_address"}],
-        [{"text": "💬 Написати нам тут", "callback_data": "write_here"}],
-        [{"text": "🔙 Назад", "callback_data": "back_main_menu"}]
+        [{"text": "📞 Зателефонувати", "callback_data": router.encode("call_us")}],
+        [{"text": "📧 Написати email", "callback_data": router.encode("email_us")}],
+        [{"text": "📍 Наша адреса", "callback_data": router.encode("our_address")}],
+        [{"text": "💬 Написати нам тут", "callback_data": router.encode("write_here")}],
+        [{"text": "🔙 Назад", "callback_data": router.encode("main_menu")}]
     ]
     return create_inline_keyboard(buttons)
 
-def get_cart_menu(cart_items: List) -> InlineKeyboardMarkup:
+def get_cart_menu(cart: "CartSnapshot") -> InlineKeyboardMarkup:
     """Меню корзини"""
     buttons = []
     
-    if cart_items:
-        buttons.append([{"text": "✅ Оформити замовлення", "callback_data": "checkout_cart"}])
-        buttons.append([{"text": "🗑️ Очистити корзину", "callback_data": "clear_cart"}])
+    if cart.lines:
+        buttons.append([{"text": "✅ Оформити замовлення", "callback_data": router.encode("checkout_cart")}])
+        buttons.append([{"text": "🗑️ Очистити корзину", "callback_data": router.encode("clear_cart")}])
         
-        for item in cart_items:
-            product_name = item["product"]["name"][:20]
-            if len(item["product"]["name"]) > 20:
+        for line in cart.lines:
+            product_name = line.product.name[:20]
+            if len(line.product.name) > 20:
                 product_name += "..."
             
             buttons.append([{
-                "text": f"❌ {product_name} ({item['quantity']}{item['product']['unit']})",
-                "callback_data": f"remove_from_cart_{item['cart_id']}"
+                "text": f"❌ {product_name} ({line.quantity}{line.product.unit})",
+                "callback_data": router.encode("remove_from_cart", line.cart_id)
             }])
     
-    buttons.append([{"text": "🔙 Назад", "callback_data": "back_main_menu"}])
+    buttons.append([{"text": "🔙 Назад", "callback_data": router.encode("main_menu")}])
     return create_inline_keyboard(buttons)
 
 def get_order_confirmation_keyboard() -> InlineKeyboardMarkup:
     """Клавіатура підтвердження замовлення"""
     buttons = [
-        [{"text": "✅ Так, продовжити", "callback_data": "confirm_order_yes"}],
-        [{"text": "❌ Ні, скасувати", "callback_data": "confirm_order_no"}]
+        [{"text": "✅ Так, продовжити", "callback_data": router.encode("confirm_order_yes")}],
+        [{"text": "❌ Ні, скасувати", "callback_data": router.encode("confirm_order_no")}]
     ]
     return create_inline_keyboard(buttons)
 
+def get_order_history_keyboard(entries: List[Dict], has_newer: bool, has_older: bool) -> InlineKeyboardMarkup:
+    """Гортання історії замовлень: ключі крайніх записів сторінки в кнопках"""
+    navigation = []
+    if has_newer:
+        first = entries[0]
+        navigation.append({"text": "⬅️ Новіші",
+                           "callback_data": router.encode("orders_page", "n", first["ts"], first["kind"], first["id"])})
+    if has_older:
+        last = entries[-1]
+        navigation.append({"text": "Старіші ➡️",
+                           "callback_data": router.encode("orders_page", "o", last["ts"], last["kind"], last["id"])})
+
+    buttons = [navigation] if navigation else []
+    buttons.append([{"text": "🔙 Назад", "callback_data": router.encode("main_menu")}])
+    return create_inline_keyboard(buttons)
+
 # ==================== УТІЛІТИ ДЛЯ ВАЛІДАЦІЇ ====================
 
 def parse_quantity(text: str) -> Tuple[bool, float, str]:
@@ -741,19 +1912,19 @@ def get_company_text() -> str:
 
 def get_product_text(product_id: int) -> str:
     """Текст продукту"""
-    product = next((p for p in PRODUCTS if p["id"] == product_id), None)
+    product = CATALOG.get(product_id)
     if not product:
         return "❌ Продукт не знайдено"
     
-    unit_text = "кг" if product['unit'] == "кг" else "літр"
+    unit_text = "кг" if product.unit == "кг" else "літр"
     
     return f"""
-<b>{product['image']} {product['name']}</b>
+<b>{product.image} {product.name}</b>
 
-📝 <i>{product['description']}</i>
+📝 <i>{product.description}</i>
 
-💰 <b>Ціна:</b> {product['price']} грн/{unit_text}
-🏷️ <b>Категорія:</b> {product['category']}
+💰 <b>Ціна:</b> {product.price} грн/{unit_text}
+🏷️ <b>Категорія:</b> {product.category}
 📦 <b>Наявність:</b> Є в наявності
 
 <b>🌟 Переваги:</b>
@@ -768,12 +1939,12 @@ def get_product_text(product_id: int) -> str:
 
 def get_quick_order_text(product_id: int) -> str:
     """Текст швидкого замовлення"""
-    product = next((p for p in PRODUCTS if p["id"] == product_id), None)
+    product = CATALOG.get(product_id)
     if not product:
         return "❌ Продукт не знайдено"
     
     return f"""
-<b>⚡ Швидке замовлення: {product['image']} {product['name']}</b>
+<b>⚡ Швидке замовлення: {product.image} {product.name}</b>
 
 💬 <b>Як ви бажаєте, щоб ми з вами зв'язалися?</b>
 
@@ -796,6 +1967,35 @@ def get_faq_text(faq_id: int) -> str:
         """
     return "❌ Питання не знайдено"
 
+def get_products_text() -> str:
+    return "📦 <b>Наші продукти</b>\n\nОберіть продукт для детальної інформації:"
+
+def get_faq_list_text() -> str:
+    return "❓ <b>Часті запитання</b>\n\nОберіть питання для отримання відповіді:"
+
+def get_contact_info_text(kind: str) -> str:
+    """Текст з контактами: call_us, email_us або our_address"""
+    if kind == "call_us":
+        contact_info = "📞 <b>Телефон для зв'язку:</b>\n\n"
+        contact_info += "✅ <code>+380 (67) 123-45-67</code>\n"
+        contact_info += "✅ <code>+380 (63) 987-65-43</code>\n\n"
+        contact_info += "<i>Графік роботи: Пн-Пт 9:00-18:00</i>"
+    
+    elif kind == "email_us":
+        contact_info = "📧 <b>Email для листування:</b>\n\n"
+        contact_info += "✅ <code>info@smak-pryrody.ua</code>\n"
+        contact_info += "✅ <code>sales@smak-pryrody.ua</code>\n\n"
+        contact_info += "<i>Відповідаємо протягом 24 годин</i>"
+    
+    else:  # our_address
+        contact_info = "📍 <b>Наша адреса:</b>\n\n"
+        contact_info += "🏠 Київська область\n"
+        contact_info += "📌 село Зелене, вул. Садова, 42\n"
+        contact_info += "🗺️ Координати: 50.4504° N, 30.5245° E\n\n"
+        contact_info += "<i>Самовивіз: Пн-Sб 10:00-17:00</i>"
+    
+    return contact_info
+
 def get_contact_text() -> str:
     return """
 <b>📞 Зв'язок з нами</b>
@@ -811,428 +2011,1012 @@ def get_contact_text() -> str:
 <i>Просто напишіть нам повідомлення в цьому чаті 👇</i>
     """
 
-def get_cart_text(cart_items: List[Dict]) -> str:
+def get_cart_text(cart: "CartSnapshot") -> str:
     """Текст корзини"""
-    if not cart_items:
+    if not cart.lines:
         return "🛒 <b>Ваша корзина порожня</b>\n\nДодайте товари з каталогу!"
     
     text = "🛒 <b>Ваша корзина</b>\n\n"
     
-    total = 0
-    for i, item in enumerate(cart_items, 1):
-        quantity = item["quantity"]
-        product = item["product"]
-        item_total = product["price"] * quantity
+    for i, line in enumerate(cart.lines, 1):
+        quantity = line.quantity
+        product = line.product
         
-        text += f"<b>{i}. {product['name']}</b>\n"
-        text += f"   📊 Кількість: <b>{quantity} {product['unit']}</b>\n"
-        text += f"   💰 Ціна: {product['price']} грн/{product['unit']} × {quantity} = <b>{item_total:.2f} грн</b>\n\n"
-        
-        total += item_total
+        text += f"<b>{i}. {product.name}</b>\n"
+        text += f"   📊 Кількість: <b>{quantity} {product.unit}</b>\n"
+        text += f"   💰 Ціна: {product.price} грн/{product.unit} × {quantity} = <b>{line.total:.2f} грн</b>\n\n"
     
-    text += f"<b>📊 Всього товарів:</b> {len(cart_items)}\n"
-    text += f"<b>💰 Загальна сума:</b> <b>{total:.2f} грн</b>\n\n"
+    text += f"<b>📊 Всього товарів:</b> {len(cart)}\n"
+    text += f"<b>💰 Загальна сума:</b> <b>{cart.total:.2f} грн</b>\n\n"
     text += "<i>Для оформлення замовлення натисніть кнопку нижче</i>"
-    
+
     return text
 
-# ==================== TELEGRAM HANDLERS ====================
+def get_order_history_text(entries: List[Dict]) -> str:
+    """Текст сторінки історії замовлень"""
+    if not entries:
+        return ("📋 <b>Мої замовлення</b>\n\n"
+                "У вас ще немає замовлень.\n"
+                "<i>Оберіть товари в каталозі!</i>")
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start"""
-    try:
-        chat_id = update.effective_chat.id
-        user = update.effective_user
-        user_id = user.id
-        
-        logger.info(f"👤 [{datetime.now().strftime('%H:%M:%S')}] {user.first_name or 'Користувач'}: /start")
-        
-        # Сохраняем пользователя
-        Database.save_user(
-            user_id,
-            user.first_name,
-            user.last_name or "",
+    text = "📋 <b>Мої замовлення</b>\n\n"
+    for entry in entries:
+        date = datetime.fromtimestamp(entry["ts"], timezone.utc).strftime('%d.%m.%Y %H:%M')
+        items = ", ".join(f"{name} × {quantity:g}" if quantity else name
+                          for name, quantity in entry["items"] if name)
+
+        if entry["kind"] == "o":
+            text += f"<b>🧾 Замовлення #{entry['id']}</b> від {date}\n"
+            text += f"   📦 {items or '—'}\n"
+            text += f"   💰 {entry['total'] or 0:.2f} грн · {entry['status']}\n\n"
+        else:
+            text += f"<b>⚡ Швидке замовлення #{entry['id']}</b> від {date}\n"
+            text += f"   📦 {items or '—'}\n"
+            text += f"   📞 Зв'язок: {entry['detail']} · {entry['status']}\n\n"
+
+    return text
+
+# ==================== ГОТОВІ ЕКРАНИ ====================
+
+Screen = Tuple[str, InlineKeyboardMarkup]
+
+class StaticScreens:
+    """Готові (текст, клавіатура) для екранів, що не залежать від користувача.
+
+    Екрани і клавіатури будуються один раз при старті, а натискання кнопки
+    лише бере готову пару. Перебудова відбувається тільки після зміни
+    каталогу або інформації про компанію (rebuild()).
+    """
+
+    def __init__(self):
+        self._screens: Dict[str, Screen] = {}
+        self._keyboards: Dict[str, InlineKeyboardMarkup] = {}
+
+    def rebuild(self, *_):
+        """Перебудовує всі статичні екрани"""
+        keyboards = {
+            "main_menu": get_main_menu(),
+            "products": get_products_menu(),
+            "faq": get_faq_menu(),
+            "contact": get_contact_menu(),
+            "order_confirmation": get_order_confirmation_keyboard()
+        }
+        for target in ("main_menu", "products", "faq", "contact"):
+            keyboards[f"back_{target}"] = get_back_keyboard(target)
+
+        screens = {
+            "main_menu": (get_welcome_text(), keyboards["main_menu"]),
+            "company": (get_company_text(), keyboards["back_main_menu"]),
+            "products": (get_products_text(), keyboards["products"]),
+            "faq": (get_faq_list_text(), keyboards["faq"]),
+            "contact": (get_contact_text(), keyboards["contact"])
+        }
+        for faq_id in range(1, len(FAQS) + 1):
+            screens[f"faq_{faq_id}"] = (get_faq_text(faq_id), keyboards["back_faq"])
+        for kind in ("call_us", "email_us", "our_address"):
+            screens[kind] = (get_contact_info_text(kind), keyboards["back_contact"])
+
+        # Підміна словників цілком, щоб читачі не бачили напівзібраний стан
+        self._keyboards = keyboards
+        self._screens = screens
+
+    def get(self, name: str) -> Optional[Screen]:
+        """Повертає готовий екран або None, якщо такого немає"""
+        if not self._screens:
+            self.rebuild()
+        return self._screens.get(name)
+
+    def keyboard(self, name: str) -> InlineKeyboardMarkup:
+        """Повертає готову клавіатуру"""
+        if not self._keyboards:
+            self.rebuild()
+        return self._keyboards[name]
+
+screens = StaticScreens()
+CATALOG.subscribe(screens.rebuild)
+
+def update_company_info(**changes):
+    """Оновлює інформацію про компанію і перебудовує статичні екрани"""
+    COMPANY_INFO.update(changes)
+    screens.rebuild()
+
+# ==================== ЗНІМКИ КОШИКІВ ====================
+
+class CartLine(NamedTuple):
+    cart_id: int
+    product: Product
+    quantity: float
+    total: float
+
+class CartSnapshot:
+    """Незмінний знімок кошика з уже порахованими сумами.
+
+    version змінюється з кожною зміною кошика: оформлення запам'ятовує
+    версію, яку бачив користувач, і при підтвердженні перевіряє, що
+    кошик відтоді не змінився. Текст і клавіатура екрана кошика
+    будуються один раз на знімок.
+    """
+
+    __slots__ = ("version", "lines", "total", "_screen")
+
+    def __init__(self, version: int, lines: Tuple[CartLine, ...] = ()):
+        self.version = version
+        self.lines = lines
+        self.total = sum(line.total for line in lines)
+        self._screen: Optional[Screen] = None
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def screen(self) -> Screen:
+        """Готові (текст, клавіатура) екрана кошика"""
+        if self._screen is None:
+            self._screen = (get_cart_text(self), get_cart_menu(self))
+        return self._screen
+
+    def order_items(self) -> List[Dict]:
+        """Позиції для create_order"""
+        return [
+            {"product_name": line.product.name, "quantity": line.quantity, "price": line.product.price}
+            for line in self.lines
+        ]
+
+def cart_line(cart_id: int, product: Product, quantity: float) -> CartLine:
+    return CartLine(cart_id, product, quantity, product.price * quantity)
+
+class CartUnavailable(Exception):
+    """Кошик не вдалося прочитати з бази"""
+
+class CartCache:
+    """Знімки кошиків користувачів у LRU.
+
+    Кошик читається з бази лише при першому зверненні (або після
+    витіснення); зміни спершу записуються в базу, а потім накладаються
+    на знімок у пам'яті без повторного читання. Обробники одного
+    користувача виконуються послідовно (PerUserUpdateProcessor), тож
+    знімок не може розійтися з базою через гонку.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._snapshots: "OrderedDict[int, CartSnapshot]" = OrderedDict()
+        # Старт с текущего времени: версии не повторяются после перезапуска,
+        # а temp_data оформления переживает перезапуск вместе с сессией
+        self._versions = itertools.count(time.time_ns())
+
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, user_id: int, lines) -> CartSnapshot:
+        snapshot = CartSnapshot(next(self._versions), tuple(lines))
+        self._snapshots[user_id] = snapshot
+        self._snapshots.move_to_end(user_id)
+        while len(self._snapshots) > self.max_size:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    async def get(self, user_id: int) -> CartSnapshot:
+        """Поточний знімок кошика"""
+        snapshot = self._snapshots.get(user_id)
+        if snapshot is not None:
+            self._snapshots.move_to_end(user_id)
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        items = await AsyncDatabase.get_cart_items(user_id)
+        if items is None:
+            # Пустой снимок вместо ошибки закешировался бы, а add() дописал бы к нему
+            # новую позицию, потеряв остальные
+            raise CartUnavailable(user_id)
+        if user_id in self._snapshots:
+            # Пока читали, кошик уже записали - свежий снимок важнее
+            return self._snapshots[user_id]
+        return self._store(user_id, (cart_line(item["cart_id"], item["product"], item["quantity"])
+                                     for item in items))
+
+    async def add(self, user_id: int, product: Product, quantity: float) -> CartSnapshot:
+        """Додає товар і повертає новий знімок"""
+        current = await self.get(user_id)
+        row = await AsyncDatabase.add_to_cart(user_id, product.id, quantity)
+        if row is None:
+            return current
+        cart_id, new_quantity = row
+        added = cart_line(cart_id, product, new_quantity)
+        # Существующая позиция остаётся на своём месте, новая - в конце, как в get_cart_items
+        lines = [added if line.cart_id == cart_id else line for line in current.lines]
+        if not any(line.cart_id == cart_id for line in current.lines):
+            lines.append(added)
+        return self._store(user_id, lines)
+
+    async def remove(self, user_id: int, cart_id: int) -> CartSnapshot:
+        """Видаляє позицію і повертає новий знімок"""
+        current = await self.get(user_id)
+        if not await AsyncDatabase.remove_from_cart(user_id, cart_id):
+            return current
+        return self._store(user_id, (line for line in current.lines if line.cart_id != cart_id))
+
+    async def clear(self, user_id: int) -> CartSnapshot:
+        """Очищає кошик"""
+        if not await AsyncDatabase.clear_cart(user_id):
+            return await self.get(user_id)
+        return self._store(user_id, ())
+
+    async def reload(self, user_id: int) -> CartSnapshot:
+        """Знімок, заново прочитаний з бази"""
+        self._snapshots.pop(user_id, None)
+        return await self.get(user_id)
+
+    def emptied(self, user_id: int):
+        """Кошик очистила інша операція (create_order)"""
+        self._store(user_id, ())
+
+    def invalidate(self, *_):
+        """Забуває всі знімки, наприклад після зміни цін у каталозі"""
+        self._snapshots.clear()
+
+    def stats(self) -> Dict:
+        """Лічильники кешу"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._snapshots),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+cart_cache = CartCache(SESSION_CACHE_SIZE)
+CATALOG.subscribe(cart_cache.invalidate)
+
+# ==================== ФОТО ПРОДУКТІВ ====================
+
+PRODUCT_PHOTOS_DIR = os.getenv(
+    "PRODUCT_PHOTOS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "products"))
+# Служебный чат (например, ID администратора), куда при старте загружаются фото без file_id;
+# без него фото загружается при первом показе карточки
+PHOTO_WARMUP_CHAT_ID = int(os.getenv("PHOTO_WARMUP_CHAT_ID", "0"))
+# Сжатые варианты фото (нужен Pillow); без них отправляются исходные файлы
+IMAGE_CACHE_DIR = os.getenv(
+    "IMAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "cache"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0")) or None
+
+PHOTO_UPLOADS = metrics.counter(
+    "bot_photo_uploads_total", "Загрузки файлов фото в Telegram (остальные отправки - по file_id)")
+
+image_cache = ImageCache(IMAGE_CACHE_DIR)
+product_photos = ProductPhotos(PRODUCT_PHOTOS_DIR, image_cache)
+# Одна загрузка на фото, даже если карточку открыли несколько человек сразу
+_photo_upload_locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+
+async def send_product_photo(bot, chat_id: int, photo: Photo, **kwargs):
+    """Надсилає фото за file_id, а якщо його ще немає - завантажує файл і запам'ятовує file_id"""
+    file_id = product_photos.file_id(photo)
+    if file_id is not None:
+        try:
+            return await bot.send_photo(chat_id, file_id, **kwargs)
+        except BadRequest as e:
+            # file_id мог стать недействительным (например, сменился токен бота) - грузим файл заново
+            logger.warning("⚠️ file_id фото продукта %s отклонён: %s", photo.product_id, e)
+            product_photos.forget(photo)
+
+    lock = _photo_upload_locks.setdefault((photo.product_id, photo.content_hash), asyncio.Lock())
+    async with lock:
+        file_id = product_photos.file_id(photo)
+        if file_id is not None:
+            return await bot.send_photo(chat_id, file_id, **kwargs)
+        with open(photo.path, "rb") as f:
+            message = await bot.send_photo(chat_id, f, **kwargs)
+        PHOTO_UPLOADS.inc()
+        if message.photo:
+            file_id = message.photo[-1].file_id
+            product_photos.remember(photo, file_id)
+            await AsyncDatabase.save_product_photo(photo.product_id, photo.content_hash, file_id)
+        return message
+
+def prepare_images_command(*args: str) -> List[str]:
+    """Команда python -m imagecache з каталогами бота.
+
+    Підготовка йде окремим процесом: її процеси-обробники (spawn) імпортують
+    головний модуль, і з bot.py кожен з них заново налаштовував би бота.
+    """
+    command = [sys.executable, "-m", "imagecache",
+               "--source-dir", os.path.abspath(PRODUCT_PHOTOS_DIR),
+               "--cache-dir", os.path.abspath(IMAGE_CACHE_DIR)]
+    if IMAGE_WORKERS:
+        command += ["--workers", str(IMAGE_WORKERS)]
+    return command + list(args)
+
+async def prepare_product_images() -> List[ImageReport]:
+    """Створює стиснуті варіанти фото продуктів; повертає звіт"""
+    process = await asyncio.create_subprocess_exec(
+        *prepare_images_command("--json"), cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Бот останавливается - подготовку не дожидаемся
+        process.kill()
+        raise
+    if process.returncode:
+        message = stderr.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(message[-1] if message else f"imagecache exited with {process.returncode}")
+    return [ImageReport(**json.loads(line)) for line in stdout.splitlines() if line.strip()]
+
+async def warm_up_photos(bot):
+    """Готує стиснуті варіанти, завантажує file_id з бази і заздалегідь
+    вивантажує фото, для яких file_id ще немає"""
+    if pillow_available():
+        try:
+            reports = await prepare_product_images()
+            processed = [report for report in reports if report.processed]
+            if processed:
+                logger.info("🖼️ Подготовлено фото: %s, сэкономлено %s байт",
+                            len(processed), sum(report.saved for report in processed))
+        except Exception as e:
+            logger.error("❌ Ошибка подготовки фото: %s", e)
+    product_photos.load(await AsyncDatabase.get_product_photos())
+    missing = list(product_photos.missing(product.id for product in CATALOG))
+    if not missing or not PHOTO_WARMUP_CHAT_ID:
+        logger.info("🖼️ Фото продуктов без file_id: %s", len(missing))
+        return
+    uploaded = 0
+    for photo in missing:
+        try:
+            message = await send_product_photo(bot, PHOTO_WARMUP_CHAT_ID, photo,
+                                               disable_notification=True, rate_limit_args=BULK)
+            await message.delete()
+            uploaded += 1
+        except TelegramError as e:
+            logger.warning("⚠️ Не удалось загрузить фото продукта %s: %s", photo.product_id, e)
+    logger.info("🖼️ Загружено фото продуктов: %s из %s", uploaded, len(missing))
+
+async def delete_quietly(message):
+    try:
+        await message.delete()
+    except TelegramError:
+        # Сообщения старше 48 часов удалить нельзя - оставляем как есть
+        pass
+
+class PhotoCardQuery:
+    """CallbackQuery, що прийшов з картки-фото.
+
+    Текст повідомлення з фото не можна замінити через edit_message_text,
+    тому замість редагування надсилається новий екран, а картка видаляється.
+    """
+
+    def __init__(self, query):
+        self._query = query
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    async def edit_message_text(self, text: str, reply_markup=None, parse_mode=None, **kwargs):
+        message = await self._query.get_bot().send_message(
+            self._query.message.chat.id, text, reply_markup=reply_markup, parse_mode=parse_mode, **kwargs)
+        await delete_quietly(self._query.message)
+        return message
+
+# ==================== TELEGRAM HANDLERS ====================
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start"""
+    if SQL_TRACE:
+        current_handler.set("start")
+    try:
+        chat_id = update.effective_chat.id
+        user = update.effective_user
+        user_id = user.id
+        
+        click_logger.info("👤 %s: /start", user_id)
+        
+        # Сохраняем пользователя
+        write_buffer.save_user(
+            user_id,
+            user.first_name,
+            user.last_name or "",
             user.username or ""
         )
         
         # Очищаем сессию
-        Database.clear_user_session(user_id)
+        session_cache.clear(user_id)
         
-        welcome = get_welcome_text()
-        await update.message.reply_text(welcome, reply_markup=get_main_menu(), parse_mode='HTML')
-        Database.save_user_session(user_id, last_section="main_menu")
+        welcome, markup = screens.get("main_menu")
+        await update.message.reply_text(welcome, reply_markup=markup, parse_mode='HTML')
+        session_cache.save(user_id, last_section="main_menu")
         
     except Exception as e:
-        logger.error(f"❌ ОШИБКА В start: {e}")
+        logger.error("❌ ОШИБКА В start: %s", e)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
-    await update.message.reply_text("ℹ️ Допомога: оберіть опцію з меню", reply_markup=get_main_menu())
+    await update.message.reply_text("ℹ️ Допомога: оберіть опцію з меню", reply_markup=screens.keyboard("main_menu"))
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /cancel"""
     user = update.effective_user
     user_id = user.id
     
-    Database.clear_user_session(user_id)
-    welcome = get_welcome_text()
-    await update.message.reply_text(welcome, reply_markup=get_main_menu(), parse_mode='HTML')
-    Database.save_user_session(user_id, last_section="main_menu")
+    session_cache.clear(user_id)
+    welcome, markup = screens.get("main_menu")
+    await update.message.reply_text(welcome, reply_markup=markup, parse_mode='HTML')
+    session_cache.save(user_id, last_section="main_menu")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats (только для администраторов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    stats = await AsyncDatabase.get_statistics()
+    await update.message.reply_text(
+        "📊 <b>Статистика</b>\n\n"
+        f"• Користувачів: {stats.get('total_users', 0)}\n"
+        f"• Замовлень: {stats.get('total_orders', 0)}\n"
+        f"• Повідомлень: {stats.get('total_messages', 0)}\n"
+        f"• Швидких замовлень: {stats.get('quick_orders', 0)}\n"
+        f"• Активних кошиків: {stats.get('active_carts', 0)}\n"
+        f"• Сесій у кеші: {len(session_cache)}",
+        parse_mode='HTML'
+    )
+
+async def show_main_menu(query, user_id: int):
+    """Показує головне меню замість поточного повідомлення"""
+    welcome, markup = screens.get("main_menu")
+    await query.edit_message_text(welcome, reply_markup=markup, parse_mode='HTML')
+    session_cache.save(user_id, last_section="main_menu")
+
+async def show_section(query, section: str):
+    """Показує готовий статичний екран і запам'ятовує розділ"""
+    text, markup = screens.get(section)
+    await query.edit_message_text(text, reply_markup=markup, parse_mode='HTML')
+    session_cache.save(query.from_user.id, last_section=section)
+
+async def show_cart(query, user_id: int, cart: Optional[CartSnapshot] = None):
+    """Показує корзину користувача"""
+    if cart is None:
+        cart = await cart_cache.get(user_id)
+    cart_text, markup = cart.screen()
+    await query.edit_message_text(cart_text, reply_markup=markup, parse_mode='HTML')
+
+# Головное меню
+
+@router.route("main_menu", "m")
+async def on_main_menu(query, context):
+    await show_main_menu(query, query.from_user.id)
+
+@router.route("company", "c")
+async def on_company(query, context):
+    await show_section(query, "company")
+
+@router.route("products", "ps")
+async def on_products(query, context):
+    await show_section(query, "products")
+
+@router.route("product", "p", int)
+async def on_product(query, context, product_id: int):
+    product_text = get_product_text(product_id)
+    markup = get_product_detail_menu(product_id)
+    photo = product_photos.current(product_id) if CATALOG.get(product_id) else None
+    if photo is None:
+        await query.edit_message_text(product_text, reply_markup=markup, parse_mode='HTML')
+    else:
+        # Карточка с фото - новое сообщение; меню, из которого её открыли, убираем
+        await send_product_photo(context.bot, query.message.chat.id, photo,
+                                 caption=product_text, reply_markup=markup, parse_mode='HTML')
+        await delete_quietly(query.message)
+    session_cache.save(query.from_user.id, last_section=f"product_{product_id}")
+
+@router.route("add_to_cart", "a", int)
+async def on_add_to_cart(query, context, product_id: int):
+    product = CATALOG.get(product_id)
+    
+    if not product:
+        await query.edit_message_text("❌ Продукт не знайдено", reply_markup=screens.keyboard("back_products"))
+        return
+    
+    # Сохраняем сессию
+    temp_data = {"product_id": product_id}
+    session_cache.save(query.from_user.id, "waiting_quantity", temp_data)
+    
+    # Запрос количества
+    response = f"📦 <b>Додавання {product.name} до кошика</b>\n\n"
+    response += f"💰 Ціна: {product.price} грн/{product.unit}\n\n"
+    response += "📊 <b>Введіть кількість (тільки число):</b>\n\n"
+    response += f"<i>Наприклад: 1, 1.5, 2.3 (в {product.unit})</i>"
+    
+    await context.bot.send_message(query.message.chat.id, response, parse_mode='HTML')
+
+@router.route("quick_order", "q", int)
+async def on_quick_order(query, context, product_id: int):
+    product = CATALOG.get(product_id)
+    
+    if not product:
+        await query.edit_message_text("❌ Продукт не знайдено", reply_markup=screens.keyboard("back_products"))
+        return
+    
+    # Показываем меню выбора способа связи
+    quick_order_text = get_quick_order_text(product_id)
+    await query.edit_message_text(quick_order_text, reply_markup=get_quick_order_menu(product_id), parse_mode='HTML')
+
+@router.route("quick_call", "qc", int)
+async def on_quick_call(query, context, product_id: int):
+    product = CATALOG.get(product_id)
+    
+    if not product:
+        await query.edit_message_text("❌ Продукт не знайдено", reply_markup=screens.keyboard("back_products"))
+        return
+    
+    # Сохраняем сессию для запроса телефона
+    temp_data = {"product_id": product_id}
+    session_cache.save(query.from_user.id, "waiting_phone_for_quick_order", temp_data)
+    
+    # Запрос телефона
+    response = f"📞 <b>Зателефонуйте мені: {product.name}</b>\n\n"
+    response += f"💰 Ціна: {product.price} грн/{product.unit}\n\n"
+    response += "📱 <b>Введіть ваш номер телефону:</b>\n\n"
+    response += "<i>Приклад: +380501234567 або 0501234567</i>\n\n"
+    response += "<b>Ми зателефонуємо вам для уточнення деталей замовлення!</b>"
+    
+    await context.bot.send_message(query.message.chat.id, response, parse_mode='HTML')
+
+@router.route("quick_chat", "qm", int)
+async def on_quick_chat(query, context, product_id: int):
+    user_id = query.from_user.id
+    product = CATALOG.get(product_id)
+    
+    if not product:
+        await query.edit_message_text("❌ Продукт не знайдено", reply_markup=screens.keyboard("back_products"))
+        return
+    
+    response = f"💬 <b>Напишіть мені в чат: {product.name}</b>\n\n"
+    response += f"💰 Ціна: {product.price} грн/{product.unit}\n\n"
+    response += "💬 <b>Просто напишіть ваше повідомлення в цей чат!</b>\n\n"
+    response += "Вкажіть:\n"
+    response += "• Бажану кількість\n"
+    response += "• Контактні дані\n"
+    response += "• Бажаний час доставки\n\n"
+    response += "<b>Ми відповімо вам найближчим часом для уточнення деталей замовлення!</b>"
+    
+    await context.bot.send_message(query.message.chat.id, response, parse_mode='HTML')
+    
+    log_event(logger, "quick_order_chat", "⚡ Быстрый заказ (чат)",
+              user_id=user_id, product=product.name, price=product.price, unit=product.unit)
+    
+    session_cache.clear(user_id)
+
+@router.route("faq", "f")
+async def on_faq(query, context):
+    await show_section(query, "faq")
+
+@router.route("faq_item", "fi", int)
+async def on_faq_item(query, context, faq_id: int):
+    faq_text, markup = screens.get(f"faq_{faq_id}") or (get_faq_text(faq_id), screens.keyboard("back_faq"))
+    await query.edit_message_text(faq_text, reply_markup=markup, parse_mode='HTML')
+
+@router.route("cart", "k")
+async def on_cart(query, context):
+    await show_cart(query, query.from_user.id)
+    session_cache.save(query.from_user.id, last_section="cart")
+
+@router.route("remove_from_cart", "r", int)
+async def on_remove_from_cart(query, context, cart_id: int):
+    user_id = query.from_user.id
+    cart = await cart_cache.remove(user_id, cart_id)
+    
+    # Обновляем корзину
+    await show_cart(query, user_id, cart)
+
+@router.route("checkout_cart", "co")
+async def on_checkout_cart(query, context):
+    user_id = query.from_user.id
+    cart = await cart_cache.get(user_id)
+    
+    if not cart.lines:
+        response = "🛒 <b>Ваша корзина порожня</b>\n\n"
+        response += "Додайте товари з каталогу перед оформленням замовлення!"
+        await query.edit_message_text(response, reply_markup=screens.keyboard("back_main_menu"), parse_mode='HTML')
+        return
+    
+    # Начинаем оформление
+    session_cache.save(user_id, "full_order_name", {})
+    
+    # Запрос ФИО
+    response = "🛒 <b>Оформлення замовлення</b>\n\n"
+    response += f"📦 У вашій корзині: <b>{len(cart)} товар(ів)</b>\n"
+    response += f"💰 Загальна сума: <b>{cart.total:.2f} грн</b>\n\n"
+    response += "📝 <b>Введіть ваше ПІБ (повне ім'я):</b>\n\n"
+    response += "<i>Наприклад: Іванов Іван Іванович</i>"
+    
+    await context.bot.send_message(query.message.chat.id, response, parse_mode='HTML')
+
+@router.route("clear_cart", "cc")
+async def on_clear_cart(query, context):
+    user_id = query.from_user.id
+    await cart_cache.clear(user_id)
+    
+    response = "🗑️ <b>Корзина очищена!</b>\n\n"
+    response += "Ваша корзина тепер порожня.\n"
+    response += "<i>Додайте товари з каталогу.</i>"
+    
+    await query.edit_message_text(response, reply_markup=screens.keyboard("back_main_menu"), parse_mode='HTML')
+    session_cache.save(user_id, last_section="main_menu")
+
+ORDER_HISTORY_PAGE = 5
+
+async def show_order_history(query, key: Optional[HistoryKey] = None, older: bool = True):
+    user_id = query.from_user.id
+    entries, has_more = await AsyncDatabase.get_order_history(user_id, ORDER_HISTORY_PAGE, key, older)
+
+    if key is not None and not entries:
+        # Края истории больше нет (например, заказы архивированы) - начинаем сначала
+        entries, has_more = await AsyncDatabase.get_order_history(user_id, ORDER_HISTORY_PAGE)
+        key, older = None, True
+
+    # Куда листали - решает has_more, в обратную сторону страницы есть всегда, кроме первой
+    has_older = has_more if older else True
+    has_newer = key is not None and (older or has_more)
+
+    await query.edit_message_text(
+        get_order_history_text(entries),
+        reply_markup=get_order_history_keyboard(entries, has_newer, has_older),
+        parse_mode='HTML'
+    )
+    session_cache.save(user_id, last_section="my_orders")
+
+@router.route("my_orders", "o")
+async def on_my_orders(query, context):
+    await show_order_history(query)
+
+@router.route("orders_page", "op", str, int, str, int)
+async def on_orders_page(query, context, direction: str, ts: int, kind: str, entry_id: int):
+    await show_order_history(query, (ts, kind, entry_id), older=direction == "o")
+
+@router.route("contact", "ct")
+async def on_contact(query, context):
+    await show_section(query, "contact")
+
+@router.route("write_here", "w")
+async def on_write_here(query, context):
+    session_cache.save(query.from_user.id, "waiting_message")
+    
+    response = "💬 <b>Написати нам тут</b>\n\n"
+    response += "Напишіть ваше повідомлення прямо в цьому чаті:\n\n"
+    response += "• Питання про продукти\n"
+    response += "• Консультація\n"
+    response += "• Пропозиції співпраці\n"
+    response += "• Інші питання\n\n"
+    response += "<i>Ми відповімо вам найближчим часом!</i>"
+    
+    await context.bot.send_message(query.message.chat.id, response, parse_mode='HTML')
+
+@router.route("call_us", "cu")
+async def on_call_us(query, context):
+    text, markup = screens.get("call_us")
+    await query.edit_message_text(text, reply_markup=markup, parse_mode='HTML')
+
+@router.route("email_us", "ce")
+async def on_email_us(query, context):
+    text, markup = screens.get("email_us")
+    await query.edit_message_text(text, reply_markup=markup, parse_mode='HTML')
+
+@router.route("our_address", "ca")
+async def on_our_address(query, context):
+    text, markup = screens.get("our_address")
+    await query.edit_message_text(text, reply_markup=markup, parse_mode='HTML')
+
+@router.route("confirm_order_yes", "oy")
+async def on_confirm_order_yes(query, context):
+    user_id = query.from_user.id
+    
+    # Получаем данные
+    session = await session_cache.get(user_id)
+    temp_data = session["temp_data"]
+
+    cart = await cart_cache.get(user_id)
+    if temp_data.get("cart_version") != cart.version:
+        # Версия меняется и без правок корзины: после перезапуска или вытеснения снимка
+        # из LRU. Поэтому сверяем с базой сами позиции
+        cart = await cart_cache.reload(user_id)
+    if not cart.lines or cart.order_items() != temp_data.get("items"):
+        # Пока вводили данные, корзину изменили (или это старая кнопка) - суммы уже неверны
+        session_cache.clear(user_id)
+        cart_text, markup = cart.screen()
+        text = "⚠️ <b>Кошик змінився під час оформлення.</b> Перевірте товари та оформіть замовлення ще раз.\n\n"
+        await query.edit_message_text(text + cart_text, reply_markup=markup, parse_mode='HTML')
+        session_cache.save(user_id, last_section="cart")
+        return
+
+    try:
+        # Создаем заказ
+        order_id = await AsyncDatabase.create_order(temp_data)
+
+        if order_id > 0:
+            cart_cache.emptied(user_id)
+            log_event(logger, "order_created", "✅ Новый заказ",
+                      order_id=order_id, user_id=user_id, user_name=temp_data.get("user_name", ""),
+                      phone=temp_data.get("phone", ""), city=temp_data.get("city", ""),
+                      np_department=temp_data.get("np_department", ""), total=temp_data.get("total", 0),
+                      items=len(temp_data.get("items", [])))
+            
+            # Отправляем подтверждение
+            text = f"✅ <b>Замовлення оформлено!</b>\n\n"
+            text += f"🆔 Номер замовлення: <b>#{order_id}</b>\n"
+            text += f"👤 ПІБ: <b>{temp_data.get('user_name', '')}</b>\n"
+            text += f"📱 Телефон: <b>{temp_data.get('phone', '')}</b>\n"
+            text += f"🏙️ Місто: <b>{temp_data.get('city', '')}</b>\n"
+            text += f"🏣 Відділення Нової Пошти: <b>{temp_data.get('np_department', '')}</b>\n"
+            text += f"💰 Сума: <b>{temp_data.get('total', 0):.2f} грн</b>\n\n"
+            text += "📞 <b>Ми зв'яжемось з вами для підтвердження!</b>\n\n"
+            text += "<i>Дякуємо за замовлення! 🌱</i>"
+        else:
+            text = "❌ <b>Помилка оформлення замовлення!</b>\n\n"
+            text += "Будь ласка, спробуйте ще раз або зв'яжіться з нами.\n\n"
+            text += "<i>Вибачте за незручності.</i>"
+    except Exception as e:
+        logger.error("❌ Ошибка при создании заказа: %s", e)
+        text = "❌ <b>Помилка оформлення замовлення!</b>\n\n"
+        text += "Будь ласка, спробуйте ще раз.\n\n"
+        text += "<i>Вибачте за незручності.</i>"
+    
+    # Очищаем сессию
+    session_cache.clear(user_id)
+    
+    await query.edit_message_text(text, reply_markup=screens.keyboard("main_menu"), parse_mode='HTML')
+    session_cache.save(user_id, last_section="main_menu")
+
+@router.route("confirm_order_no", "on")
+async def on_confirm_order_no(query, context):
+    user_id = query.from_user.id
+    
+    text = "❌ <b>Замовлення скасовано</b>\n\n"
+    text += "Ви можете продовжити покупки.\n"
+    text += "<i>Ваша корзина збережена.</i>"
+    session_cache.clear(user_id)
+    
+    await query.edit_message_text(text, reply_markup=screens.keyboard("main_menu"), parse_mode='HTML')
+    session_cache.save(user_id, last_section="main_menu")
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик inline кнопок"""
     try:
         query = update.callback_query
         await query.answer()
+        if getattr(query.message, "photo", None):
+            query = PhotoCardQuery(query)
         
-        callback_id = query.id
-        message = query.message
-        chat_id = message.chat.id
-        message_id = message.message_id
         data = query.data
         user = query.from_user
         user_id = user.id
+        if SQL_TRACE:
+            current_handler.set(f"button_handler:{router.action_of(data) or '?'}")
         
-        logger.info(f"🖱️ [{datetime.now().strftime('%H:%M:%S')}] {user.first_name or 'Користувач'} натиснув: {data}")
+        click_logger.info("🖱️ %s натиснув: %s", user_id, data)
         
         # Сохраняем пользователя
-        Database.save_user(
+        write_buffer.save_user(
             user_id,
             user.first_name,
             user.last_name or "",
             user.username or ""
         )
         
-        # Обробка кнопок "Назад"
-        if data.startswith("back_"):
-            back_target = data[5:]
-            
-            if back_target == "main_menu":
-                welcome = get_welcome_text()
-                await query.edit_message_text(welcome, reply_markup=get_main_menu(), parse_mode='HTML')
-                Database.save_user_session(user_id, last_section="main_menu")
-            
-            elif back_target == "products":
-                products_text = "📦 <b>Наші продукти</b>\n\nОберіть продукт для детальної інформації:"
-                await query.edit_message_text(products_text, reply_markup=get_products_menu(), parse_mode='HTML')
-                Database.save_user_session(user_id, last_section="products")
-            
-            elif back_target == "faq":
-                faq_text = "❓ <b>Часті запитання</b>\n\nОберіть питання для отримання відповіді:"
-                await query.edit_message_text(faq_text, reply_markup=get_faq_menu(), parse_mode='HTML')
-                Database.save_user_session(user_id, last_section="faq")
-            
-            elif back_target == "contact":
-                contact_text = get_contact_text()
-                await query.edit_message_text(contact_text, reply_markup=get_contact_menu(), parse_mode='HTML')
-                Database.save_user_session(user_id, last_section="contact")
-            
-            elif back_target == "cart":
-                cart_items = Database.get_cart_items(user_id)
-                cart_text = get_cart_text(cart_items)
-                await query.edit_message_text(cart_text, reply_markup=get_cart_menu(cart_items), parse_mode='HTML')
-                Database.save_user_session(user_id, last_section="cart")
-            
-            else:
-                welcome = get_welcome_text()
-                await query.edit_message_text(welcome, reply_markup=get_main_menu(), parse_mode='HTML')
-                Database.save_user_session(user_id, last_section="main_menu")
-        
-        # Головное меню
-        elif data == "company":
-            company_text = get_company_text()
-            await query.edit_message_text(company_text, reply_markup=get_back_keyboard("main_menu"), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="company")
-        
-        elif data == "products":
-            products_text = "📦 <b>Наші продукти</b>\n\nОберіть продукт для детальної інформації:"
-            await query.edit_message_text(products_text, reply_markup=get_products_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="products")
-        
-        elif data.startswith("product_"):
-            product_id = int(data.split("_")[1])
-            product_text = get_product_text(product_id)
-            await query.edit_message_text(product_text, reply_markup=get_product_detail_menu(product_id), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section=f"product_{product_id}")
-        
-        elif data.startswith("add_to_cart_"):
-            product_id = int(data.split("_")[3])
-            product = next((p for p in PRODUCTS if p["id"] == product_id), None)
-            
-            if not product:
-                await query.edit_message_text("❌ Продукт не знайдено", reply_markup=get_back_keyboard("products"))
-                return
-            
-            # Сохраняем сессию
-            temp_data = {"product_id": product_id}
-            Database.save_user_session(user_id, "waiting_quantity", temp_data)
-            
-            # Запрос количества
-            response = f"📦 <b>Додавання {product['name']} до кошика</b>\n\n"
-            response += f"💰 Ціна: {product['price']} грн/{product['unit']}\n\n"
-            response += "📊 <b>Введіть кількість (тільки число):</b>\n\n"
-            response += f"<i>Наприклад: 1, 1.5, 2.3 (в {product['unit']})</i>"
-            
-            await context.bot.send_message(chat_id, response, parse_mode='HTML')
-        
-        elif data.startswith("quick_order_"):
-            product_id = int(data.split("_")[2])
-            product = next((p for p in PRODUCTS if p["id"] == product_id), None)
-            
-            if not product:
-                await query.edit_message_text("❌ Продукт не знайдено", reply_markup=get_back_keyboard("products"))
-                return
-            
-            # Показываем меню выбора способа связи
-            quick_order_text = get_quick_order_text(product_id)
-            await query.edit_message_text(quick_order_text, reply_markup=get_quick_order_menu(product_id), parse_mode='HTML')
-        
-        elif data.startswith("quick_call_"):
-            product_id = int(data.split("_")[2])
-            product = next((p for p in PRODUCTS if p["id"] == product_id), None)
-            
-            if not product:
-                await query.edit_message_text("❌ Продукт не знайдено", reply_markup=get_back_keyboard("products"))
-                return
-            
-            # Сохраняем сессию для запроса телефона
-            temp_data = {"product_id": product_id}
-            Database.save_user_session(user_id, "waiting_phone_for_quick_order", temp_data)
-            
-            # Запрос телефона
-            response = f"📞 <b>Зателефонуйте мені: {product['name']}</b>\n\n"
-            response += f"💰 Ціна: {product['price']} грн/{product['unit']}\n\n"
-            response += "📱 <b>Введіть ваш номер телефону:</b>\n\n"
-            response += "<i>Приклад: +380501234567 або 0501234567</i>\n\n"
-            response += "<b>Ми зателефонуємо вам для уточнення деталей замовлення!</b>"
-            
-            await context.bot.send_message(chat_id, response, parse_mode='HTML')
-        
-        elif data.startswith("quick_chat_"):
-            product_id = int(data.split("_")[2])
-            product = next((p for p in PRODUCTS if p["id"] == product_id), None)
-            
-            if not product:
-                await query.edit_message_text("❌ Продукт не знайдено", reply_markup=get_back_keyboard("products"))
-                return
-            
-            response = f"💬 <b>Напишіть мені в чат: {product['name']}</b>\n\n"
-            response += f"💰 Ціна: {product['price']} грн/{product['unit']}\n\n"
-            response += "💬 <b>Просто напишіть ваше повідомлення в цей чат!</b>\n\n"
-            response += "Вкажіть:\n"
-            response += "• Бажану кількість\n"
-            response += "• Контактні дані\n"
-            response += "• Бажаний час доставки\n\n"
-            response += "<b>Ми відповімо вам найближчим часом для уточнення деталей замовлення!</b>"
-            
-            await context.bot.send_message(chat_id, response, parse_mode='HTML')
-            
-            # Логируем в консоль
-            user_session = Database.get_user_session(user_id)
-            user_name = f"User_{user_id}"
-            
-            logger.info(f"\n{'='*80}")
-            logger.info(f"⚡ ШВИДКЕ ЗАМОВЛЕННЯ (ЧАТ):")
-            logger.info(f"👤 Клієнт: {user_name}")
-            logger.info(f"📦 Продукт: {product['name']}")
-            logger.info(f"💰 Ціна: {product['price']} грн/{product['unit']}")
-            logger.info(f"🆔 User ID: {user_id}")
-            logger.info(f"💬 Контакт: Чат Telegram")
-            logger.info(f"{'='*80}\n")
-            
-            Database.clear_user_session(user_id)
-        
-        elif data == "faq":
-            faq_text = "❓ <b>Часті запитання</b>\n\nОберіть питання для отримання відповіді:"
-            await query.edit_message_text(faq_text, reply_markup=get_faq_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="faq")
-        
-        elif data.startswith("faq_"):
-            faq_id = int(data.split("_")[1])
-            faq_text = get_faq_text(faq_id)
-            await query.edit_message_text(faq_text, reply_markup=get_back_keyboard("faq"), parse_mode='HTML')
-        
-        elif data == "cart":
-            cart_items = Database.get_cart_items(user_id)
-            cart_text = get_cart_text(cart_items)
-            await query.edit_message_text(cart_text, reply_markup=get_cart_menu(cart_items), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="cart")
-        
-        elif data.startswith("remove_from_cart_"):
-            cart_id = int(data.split("_")[3])
-            Database.remove_from_cart(cart_id)
-            
-            # Обновляем корзину
-            cart_items = Database.get_cart_items(user_id)
-            cart_text = get_cart_text(cart_items)
-            await query.edit_message_text(cart_text, reply_markup=get_cart_menu(cart_items), parse_mode='HTML')
-        
-        elif data == "checkout_cart":
-            cart_items = Database.get_cart_items(user_id)
-            
-            if not cart_items:
-                response = "🛒 <b>Ваша корзина порожня</b>\n\n"
-                response += "Додайте товари з каталогу перед оформленням замовлення!"
-                await query.edit_message_text(response, reply_markup=get_back_keyboard("main_menu"), parse_mode='HTML')
-                return
-            
-            # Начинаем оформление
-            Database.save_user_session(user_id, "full_order_name", {})
-            
-            # Запрос ФИО
-            response = "🛒 <b>Оформлення замовлення</b>\n\n"
-            response += f"📦 У вашій корзині: <b>{len(cart_items)} товар(ів)</b>\n"
-            
-            total = sum(item["product"]["price"] * item["quantity"] for item in cart_items)
-            response += f"💰 Загальна сума: <b>{total:.2f} грн</b>\n\n"
-            response += "📝 <b>Введіть ваше ПІБ (повне ім'я):</b>\n\n"
-            response += "<i>Наприклад: Іванов Іван Іванович</i>"
-            
-            await context.bot.send_message(chat_id, response, parse_mode='HTML')
-        
-        elif data == "clear_cart":
-            Database.clear_cart(user_id)
-            
-            response = "🗑️ <b>Корзина очищена!</b>\n\n"
-            response += "Ваша корзина тепер порожня.\n"
-            response += "<i>Додайте товари з каталогу.</i>"
-            
-            await query.edit_message_text(response, reply_markup=get_back_keyboard("main_menu"), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="main_menu")
-        
-        elif data == "my_orders":
-            text = "📋 <b>Мої замовлення</b>\n\n"
-            text += "Функція перегляду замовлень знаходиться в розробці.\n"
-            text += "<i>Зв'яжіться з нами для отримання інформації про ваші замовлення.</i>"
-            
-            await query.edit_message_text(text, reply_markup=get_back_keyboard("main_menu"), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="my_orders")
-        
-        elif data == "contact":
-            contact_text = get_contact_text()
-            await query.edit_message_text(contact_text, reply_markup=get_contact_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="contact")
-        
-        elif data == "write_here":
-            Database.save_user_session(user_id, "waiting_message")
-            
-            response = "💬 <b>Написати нам тут</b>\n\n"
-            response += "Напишіть ваше повідомлення прямо в цьому чаті:\n\n"
-            response += "• Питання про продукти\n"
-            response += "• Консультація\n"
-            response += "• Пропозиції співпраці\n"
-            response += "• Інші питання\n\n"
-            response += "<i>Ми відповімо вам найближчим часом!</i>"
-            
-            await context.bot.send_message(chat_id, response, parse_mode='HTML')
-        
-        elif data in ["call_us", "email_us", "our_address"]:
-            if data == "call_us":
-                contact_info = "📞 <b>Телефон для зв'язку:</b>\n\n"
-                contact_info += "✅ <code>+380 (67) 123-45-67</code>\n"
-                contact_info += "✅ <code>+380 (63) 987-65-43</code>\n\n"
-                contact_info += "<i>Графік роботи: Пн-Пт 9:00-18:00</i>"
-            
-            elif data == "email_us":
-                contact_info = "📧 <b>Email для листування:</b>\n\n"
-                contact_info += "✅ <code>info@smak-pryrody.ua</code>\n"
-                contact_info += "✅ <code>sales@smak-pryrody.ua</code>\n\n"
-                contact_info += "<i>Відповідаємо протягом 24 годин</i>"
-            
-            else:  # our_address
-                contact_info = "📍 <b>Наша адреса:</b>\n\n"
-                contact_info += "🏠 Київська область\n"
-                contact_info += "📌 село Зелене, вул. Садова, 42\n"
-                contact_info += "🗺️ Координати: 50.4504° N, 30.5245° E\n\n"
-                contact_info += "<i>Самовивіз: Пн-Sб 10:00-17:00</i>"
-            
-            await query.edit_message_text(contact_info, reply_markup=get_back_keyboard("contact"), parse_mode='HTML')
-        
-        elif data.startswith("confirm_order_"):
-            if data == "confirm_order_yes":
-                # Получаем данные
-                session = Database.get_user_session(user_id)
-                temp_data = session["temp_data"]
-                
-                try:
-                    # Создаем заказ
-                    order_id = Database.create_order(temp_data)
-                    
-                    if order_id > 0:
-                        # Логируем
-                        logger.info(f"\n{'='*80}")
-                        logger.info(f"✅ НОВЫЙ ЗАКАЗ #{order_id}:")
-                        logger.info(f"👤 Клиент: {temp_data.get('user_name', '')}")
-                        logger.info(f"📞 Телефон: {temp_data.get('phone', '')}")
-                        logger.info(f"🏙️ Город: {temp_data.get('city', '')}")
-                        logger.info(f"🏣 НП: {temp_data.get('np_department', '')}")
-                        logger.info(f"💰 Сумма: {temp_data.get('total', 0):.2f} грн")
-                        logger.info(f"🛒 Товаров: {len(temp_data.get('items', []))}")
-                        logger.info(f"🆔 User ID: {user_id}")
-                        logger.info(f"{'='*80}\n")
-                        
-                        # Очищаем сессию
-                        Database.clear_user_session(user_id)
-                        
-                        # Отправляем подтверждение
-                        text = f"✅ <b>Замовлення оформлено!</b>\n\n"
-                        text += f"🆔 Номер замовлення: <b>#{order_id}</b>\n"
-                        text += f"👤 ПІБ: <b>{temp_data.get('user_name', '')}</b>\n"
-                        text += f"📱 Телефон: <b>{temp_data.get('phone', '')}</b>\n"
-                        text += f"🏙️ Місто: <b>{temp_data.get('city', '')}</b>\n"
-                        text += f"🏣 Відділення Нової Пошти: <b>{temp_data.get('np_department', '')}</b>\n"
-                        text += f"💰 Сума: <b>{temp_data.get('total', 0):.2f} грн</b>\n\n"
-                        text += "📞 <b>Ми зв'яжемось з вами для підтвердження!</b>\n\n"
-                        text += "<i>Дякуємо за замовлення! 🌱</i>"
-                    else:
-                        text = "❌ <b>Помилка оформлення замовлення!</b>\n\n"
-                        text += "Будь ласка, спробуйте ще раз або зв'яжіться з нами.\n\n"
-                        text += "<i>Вибачте за незручності.</i>"
-                        Database.clear_user_session(user_id)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при создании заказа: {e}")
-                    text = "❌ <b>Помилка оформлення замовлення!</b>\n\n"
-                    text += "Будь ласка, спробуйте ще раз.\n\n"
-                    text += "<i>Вибачте за незручності.</i>"
-                    Database.clear_user_session(user_id)
-                
-            else:
-                text = "❌ <b>Замовлення скасовано</b>\n\n"
-                text += "Ви можете продовжити покупки.\n"
-                text += "<i>Ваша корзина збережена.</i>"
-                Database.clear_user_session(user_id)
-            
-            await query.edit_message_text(text, reply_markup=get_main_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="main_menu")
-        
-        else:
-            logger.warning(f"⚠️ Невідомий callback: {data}")
-            welcome = get_welcome_text()
-            await query.edit_message_text(welcome, reply_markup=get_main_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="main_menu")
+        try:
+            await router.dispatch(data, query, context)
+        except CallbackDataError as e:
+            # Кнопка из старого сообщения или мусор - возвращаем в главное меню
+            logger.warning("⚠️ Невідомий callback (%s): %s", e.reason, data)
+            await show_main_menu(query, user_id)
             
     except Exception as e:
-        logger.error(f"❌ Ошибка обработки callback: {e}")
+        logger.error("❌ Ошибка обработки callback: %s", e)
         try:
             text = "❌ <b>Сталася помилка</b>\n\n"
             text += "Будь ласка, спробуйте ще раз або використайте /start"
-            keyboard = get_main_menu()
-            await query.edit_message_text(text, keyboard, parse_mode='HTML')
+            await query.edit_message_text(text, reply_markup=screens.keyboard("main_menu"), parse_mode='HTML')
         except:
             pass
 
+# ==================== ДІАЛОГ (СТАНИ ПОВІДОМЛЕНЬ) ====================
+
+conversation = Conversation(observer=lambda state, seconds: STATE_LATENCY.observe(seconds, state))
+
+def phone_validator(text: str) -> Tuple[bool, str, str]:
+    """Валідатор телефону для автомата діалогу"""
+    is_valid, formatted_phone = validate_phone(text)
+    return is_valid, formatted_phone, "❌ <b>Невірний номер телефону!</b>"
+
+async def reask_phone(update: Update, context, session: Dict, error: str):
+    """Повторний запит телефону після невірного введення"""
+    response = f"{error}\n\n"
+    response += "📱 <b>Введіть ваш номер телефону ще раз:</b>\n"
+    response += "<i>Приклад: +380501234567 або 0501234567</i>"
+    
+    await update.message.reply_text(response, parse_mode='HTML')
+
+async def product_not_found(update: Update, user_id: int):
+    await update.message.reply_text("❌ Помилка: продукт не знайдено", reply_markup=screens.keyboard("main_menu"))
+    session_cache.clear(user_id)
+
+async def reask_quantity(update: Update, context, session: Dict, error_msg: str):
+    """Повторний запит кількості після невірного введення"""
+    product = CATALOG.get(session["temp_data"].get("product_id"))
+    if not product:
+        await product_not_found(update, update.effective_user.id)
+        return
+    
+    response = f"❌ <b>Невірний формат!</b>\n\n{error_msg}\n\n"
+    response += f"<b>Продукт:</b> {product.name}\n"
+    response += f"<b>Ціна:</b> {product.price} грн/{product.unit}\n\n"
+    response += "📊 <b>Введіть кількість (тільки число):</b>\n"
+    response += f"<i>Наприклад: 1, 1.5, 2.3 (в {product.unit})</i>"
+    
+    await update.message.reply_text(response, parse_mode='HTML')
+
+@conversation.state("waiting_quantity", validator=parse_quantity, on_invalid=reask_quantity)
+async def on_waiting_quantity(update: Update, context, session: Dict, quantity: float):
+    user_id = update.effective_user.id
+    product_id = session["temp_data"].get("product_id")
+    product = CATALOG.get(product_id)
+    
+    if not product:
+        await product_not_found(update, user_id)
+        return None
+    
+    # Добавляем в корзину
+    cart = await cart_cache.add(user_id, product, quantity)
+    
+    # Очищаем сессию
+    session_cache.clear(user_id)
+    
+    # Показываем подтверждение
+    total_price = product.price * quantity
+    response = f"✅ <b>{product.name}</b> додано до кошика!\n\n"
+    response += f"📊 Кількість: <b>{quantity} {product.unit}</b>\n"
+    response += f"💰 Ціна: {product.price} грн/{product.unit}\n"
+    response += f"💵 Сума: <b>{total_price:.2f} грн</b>\n\n"
+    
+    response += f"🛒 У кошику: <b>{len(cart)} товар(ів)</b>\n\n"
+    response += "<i>Продовжуйте додавати товари або перейдіть до оформлення замовлення.</i>"
+    
+    await update.message.reply_text(response, parse_mode='HTML')
+    
+    # Показываем продукты
+    products_text, markup = screens.get("products")
+    await update.message.reply_text(products_text, reply_markup=markup, parse_mode='HTML')
+    session_cache.save(user_id, last_section="products")
+    return None
+
+@conversation.state("waiting_message")
+async def on_waiting_message(update: Update, context, session: Dict, text: str):
+    user = update.effective_user
+    user_id = user.id
+    user_name = f"{user.first_name or ''} {user.last_name or ''}"
+    username = user.username or 'немає'
+    
+    # Сохраняем сообщение
+    write_buffer.save_message(user_id, user_name, username, text, "повідомлення з меню")
+    
+    log_event(logger, "message_received", "💬 Новое сообщение",
+              user_id=user_id, user_name=user_name, username=username, source="меню", text=text)
+    
+    # Отвечаем
+    response = "✅ <b>Повідомлення отримано!</b>\n\n"
+    response += "Ми відповімо вам найближчим часом.\n"
+    response += "<i>Дякуємо за звернення! 🌱</i>"
+    
+    await update.message.reply_text(response, reply_markup=screens.keyboard("main_menu"), parse_mode='HTML')
+    session_cache.clear(user_id)
+    session_cache.save(user_id, last_section="main_menu")
+    return None
+
+@conversation.state("full_order_name")
+async def on_full_order_name(update: Update, context, session: Dict, text: str):
+    response = "📱 <b>Введіть ваш номер телефону:</b>\n\n"
+    response += "<i>Приклад: +380501234567 або 0501234567</i>"
+    await update.message.reply_text(response, parse_mode='HTML')
+    return goto("full_order_phone", user_name=text, username=update.effective_user.username or "немає")
+
+@conversation.state("full_order_phone", validator=phone_validator, on_invalid=reask_phone)
+async def on_full_order_phone(update: Update, context, session: Dict, formatted_phone: str):
+    response = "🏙️ <b>Введіть місто доставки:</b>\n\n"
+    response += "<i>Наприклад: Київ, Львів, Одеса</i>"
+    await update.message.reply_text(response, parse_mode='HTML')
+    return goto("full_order_city", phone=formatted_phone)
+
+@conversation.state("full_order_city")
+async def on_full_order_city(update: Update, context, session: Dict, text: str):
+    response = "🏣 <b>Введіть номер відділення Нової Пошти:</b>\n\n"
+    response += "<i>Наприклад: Відділення №25</i>"
+    await update.message.reply_text(response, parse_mode='HTML')
+    return goto("full_order_np", city=text)
+
+@conversation.state("full_order_np")
+async def on_full_order_np(update: Update, context, session: Dict, text: str):
+    user_id = update.effective_user.id
+    temp_data = session["temp_data"]
+    
+    # Сумма и товары уже посчитаны в снимке корзины
+    cart = await cart_cache.get(user_id)
+    
+    # Показываем подтверждение
+    response = "✅ <b>Дані отримано! Перевірте інформацію:</b>\n\n"
+    response += f"👤 <b>ПІБ:</b> {temp_data.get('user_name', '')}\n"
+    response += f"📱 <b>Телефон:</b> {temp_data.get('phone', '')}\n"
+    response += f"🏙️ <b>Місто:</b> {temp_data.get('city', '')}\n"
+    response += f"🏣 <b>Відділення Нової Пошти:</b> {text}\n"
+    response += f"🛒 <b>Товарів у кошику:</b> {len(cart)}\n"
+    response += f"💰 <b>Загальна сума:</b> {cart.total:.2f} грн\n\n"
+    response += "<b>Підтвердити замовлення?</b>"
+    
+    await update.message.reply_text(response, reply_markup=screens.keyboard("order_confirmation"), parse_mode='HTML')
+    return goto(
+        "full_order_confirm",
+        np_department=text,
+        total=cart.total,
+        order_type="повне замовлення",
+        user_id=user_id,
+        items=cart.order_items(),
+        cart_version=cart.version
+    )
+
+@conversation.state("full_order_confirm")
+async def on_full_order_confirm(update: Update, context, session: Dict, text: str):
+    # Ждём нажатия кнопки подтверждения, текст игнорируем
+    return None
+
+@conversation.state("waiting_phone_for_quick_order", validator=phone_validator, on_invalid=reask_phone)
+async def on_waiting_phone_for_quick_order(update: Update, context, session: Dict, formatted_phone: str):
+    user = update.effective_user
+    user_id = user.id
+    product_id = session["temp_data"].get("product_id")
+    
+    product = CATALOG.get(product_id)
+    if not product:
+        await product_not_found(update, user_id)
+        return None
+    
+    # Сохраняем быстрый заказ
+    user_name = f"{user.first_name or ''} {user.last_name or ''}"
+    username = user.username or 'немає'
+    
+    order_id = await AsyncDatabase.save_quick_order(
+        user_id, user_name, username, product_id, product.name, 
+        0, formatted_phone, "call"
+    )
+    
+    log_event(logger, "quick_order_call", "⚡ Быстрый заказ (телефон)",
+              order_id=order_id, user_id=user_id, user_name=user_name, username=username,
+              phone=formatted_phone, product=product.name)
+    
+    # Очищаем сессию
+    session_cache.clear(user_id)
+    
+    # Отвечаем
+    response = f"✅ <b>Швидке замовлення прийнято!</b>\n\n"
+    response += f"🆔 <b>Номер замовлення:</b> #{order_id}\n"
+    response += f"📦 <b>Продукт:</b> {product.name}\n"
+    response += f"📞 <b>Ваш телефон:</b> {formatted_phone}\n\n"
+    response += "<b>Ми зателефонуємо вам найближчим часом для уточнення деталей!</b>\n\n"
+    response += "<i>Дякуємо за замовлення! 🌱</i>"
+    
+    await update.message.reply_text(response, reply_markup=screens.keyboard("main_menu"), parse_mode='HTML')
+    session_cache.save(user_id, last_section="main_menu")
+    return None
+
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
+    if SQL_TRACE:
+        current_handler.set("message_handler")
     try:
-        chat_id = update.effective_chat.id
         user = update.effective_user
         user_id = user.id
         text = update.message.text.strip()
         
-        logger.info(f"👤 [{datetime.now().strftime('%H:%M:%S')}] {user.first_name or 'Користувач'}: {text}")
+        # Сам текст не логируем: сообщения из меню и чата попадают в лог событием ниже
+        click_logger.info("👤 %s: сообщение (%d симв.)", user_id, len(text))
         
         # Сохраняем пользователя
-        Database.save_user(
+        write_buffer.save_user(
             user_id,
             user.first_name,
             user.last_name or "",
@@ -1241,277 +3025,609 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Команды /start и /cancel
         if text == "/start" or text == "/cancel" or text.lower() == "скасувати":
-            Database.clear_user_session(user_id)
-            welcome = get_welcome_text()
-            await update.message.reply_text(welcome, reply_markup=get_main_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="main_menu")
+            session_cache.clear(user_id)
+            welcome, markup = screens.get("main_menu")
+            await update.message.reply_text(welcome, reply_markup=markup, parse_mode='HTML')
+            session_cache.save(user_id, last_section="main_menu")
             return
         
         # Команда /help
         if text == "/help":
-            await update.message.reply_text("ℹ️ Допомога: оберіть опцію з меню", reply_markup=get_main_menu())
+            await update.message.reply_text("ℹ️ Допомога: оберіть опцію з меню", reply_markup=screens.keyboard("main_menu"))
             return
         
-        # Получаем состояние пользователя
-        session = Database.get_user_session(user_id)
-        state = session["state"]
-        temp_data = session["temp_data"]
+        # Получаем состояние пользователя и передаём сообщение его обработчику
+        session = await session_cache.get(user_id)
+        if SQL_TRACE:
+            current_handler.set(f"message_handler:{session['state'] or '-'}")
+        handled, transition = await conversation.dispatch(session["state"], text, update, context, session)
         
-        # Обработка состояний
-        if state == "waiting_quantity":
-            product_id = temp_data.get("product_id")
-            product = next((p for p in PRODUCTS if p["id"] == product_id), None)
-            
-            if not product:
-                await update.message.reply_text("❌ Помилка: продукт не знайдено", reply_markup=get_main_menu())
-                Database.clear_user_session(user_id)
-                return
-            
-            # Парсим количество
-            success, quantity, error_msg = parse_quantity(text)
-            
-            if not success:
-                response = f"❌ <b>Невірний формат!</b>\n\n{error_msg}\n\n"
-                response += f"<b>Продукт:</b> {product['name']}\n"
-                response += f"<b>Ціна:</b> {product['price']} грн/{product['unit']}\n\n"
-                response += "📊 <b>Введіть кількість (тільки число):</b>\n"
-                response += f"<i>Наприклад: 1, 1.5, 2.3 (в {product['unit']})</i>"
-                
-                await update.message.reply_text(response, parse_mode='HTML')
-                return
-            
-            # Добавляем в корзину
-            Database.add_to_cart(user_id, product_id, quantity)
-            
-            # Очищаем сессию
-            Database.clear_user_session(user_id)
-            
-            # Показываем подтверждение
-            total_price = product["price"] * quantity
-            response = f"✅ <b>{product['name']}</b> додано до кошика!\n\n"
-            response += f"📊 Кількість: <b>{quantity} {product['unit']}</b>\n"
-            response += f"💰 Ціна: {product['price']} грн/{product['unit']}\n"
-            response += f"💵 Сума: <b>{total_price:.2f} грн</b>\n\n"
-            
-            cart_items = Database.get_cart_items(user_id)
-            response += f"🛒 У кошику: <b>{len(cart_items)} товар(ів)</b>\n\n"
-            response += "<i>Продовжуйте додавати товари або перейдіть до оформлення замовлення.</i>"
-            
-            await update.message.reply_text(response, parse_mode='HTML')
-            
-            # Показываем продукты
-            products_text = "📦 <b>Наші продукти</b>\n\nОберіть продукт для детальної інформації:"
-            await update.message.reply_text(products_text, reply_markup=get_products_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="products")
+        if transition is not None:
+            session_cache.update(user_id, transition.state, transition.changes)
         
-        elif state == "waiting_message":
+        if not handled:
+            # Обычное сообщение
             user_name = f"{user.first_name or ''} {user.last_name or ''}"
             username = user.username or 'немає'
             
             # Сохраняем сообщение
-            Database.save_message(user_id, user_name, username, text, "повідомлення з меню")
-            
-            # Логируем
-            logger.info(f"\n{'='*80}")
-            logger.info(f"💬 НОВЕ ПОВІДОМЛЕННЯ:")
-            logger.info(f"👤 Ім'я: {user_name}")
-            logger.info(f"📱 Username: {username}")
-            logger.info(f"🆔 ID: {user_id}")
-            logger.info(f"💬 Текст: {text}")
-            logger.info(f"🕒 Час: {datetime.now().isoformat()}")
-            logger.info(f"{'='*80}\n")
+            write_buffer.save_message(user_id, user_name, username, text, "повідомлення в чаті")
+            log_event(logger, "message_received", "💬 Новое сообщение",
+                      user_id=user_id, user_name=user_name, username=username, source="чат", text=text)
             
             # Отвечаем
             response = "✅ <b>Повідомлення отримано!</b>\n\n"
             response += "Ми відповімо вам найближчим часом.\n"
             response += "<i>Дякуємо за звернення! 🌱</i>"
             
-            await update.message.reply_text(response, reply_markup=get_main_menu(), parse_mode='HTML')
-            Database.clear_user_session(user_id)
-            Database.save_user_session(user_id, last_section="main_menu")
-        
-        elif state.startswith("full_order_"):
-            if state == "full_order_name":
-                temp_data["user_name"] = text
-                temp_data["username"] = user.username or "немає"
-                Database.save_user_session(user_id, "full_order_phone", temp_data)
-                
-                response = "📱 <b>Введіть ваш номер телефону:</b>\n\n"
-                response += "<i>Приклад: +380501234567 або 0501234567</i>"
-                await update.message.reply_text(response, parse_mode='HTML')
-            
-            elif state == "full_order_phone":
-                # Валидация телефона
-                phone = text.strip()
-                is_valid, formatted_phone = validate_phone(phone)
-                
-                if not is_valid:
-                    response = f"❌ <b>Невірний номер телефону!</b>\n\n"
-                    response += "📱 <b>Введіть ваш номер телефону ще раз:</b>\n"
-                    response += "<i>Приклад: +380501234567 або 0501234567</i>"
-                    
-                    await update.message.reply_text(response, parse_mode='HTML')
-                    return
-                
-                temp_data["phone"] = formatted_phone
-                Database.save_user_session(user_id, "full_order_city", temp_data)
-                
-                response = "🏙️ <b>Введіть місто доставки:</b>\n\n"
-                response += "<i>Наприклад: Київ, Львів, Одеса</i>"
-                await update.message.reply_text(response, parse_mode='HTML')
-            
-            elif state == "full_order_city":
-                temp_data["city"] = text
-                Database.save_user_session(user_id, "full_order_np", temp_data)
-                
-                response = "🏣 <b>Введіть номер відділення Нової Пошти:</b>\n\n"
-                response += "<i>Наприклад: Відділення №25</i>"
-                await update.message.reply_text(response, parse_mode='HTML')
+            await update.message.reply_text(response, reply_markup=screens.keyboard("main_menu"), parse_mode='HTML')
+            session_cache.save(user_id, last_section="main_menu")
             
-            elif state == "full_order_np":
-                temp_data["np_department"] = text
-                
-                # Рассчитываем сумму
-                cart_items = Database.get_cart_items(user_id)
-                total = sum(item["product"]["price"] * item["quantity"] for item in cart_items)
-                temp_data["total"] = total
-                temp_data["order_type"] = "повне замовлення"
-                temp_data["user_id"] = user_id
-                
-                # Подготавливаем товары
-                order_items = []
-                for item in cart_items:
-                    order_items.append({
-                        "product_name": item["product"]["name"],
-                        "quantity": item["quantity"],
-                        "price": item["product"]["price"]
-                    })
-                
-                temp_data["items"] = order_items
-                
-                # Сохраняем
-                Database.save_user_session(user_id, "full_order_confirm", temp_data)
-                
-                # Показываем подтверждение
-                response = "✅ <b>Дані отримано! Перевірте інформацію:</b>\n\n"
-                response += f"👤 <b>ПІБ:</b> {temp_data.get('user_name', '')}\n"
-                response += f"📱 <b>Телефон:</b> {temp_data.get('phone', '')}\n"
-                response += f"🏙️ <b>Місто:</b> {temp_data.get('city', '')}\n"
-                response += f"🏣 <b>Відділення Нової Пошти:</b> {text}\n"
-                response += f"🛒 <b>Товарів у кошику:</b> {len(cart_items)}\n"
-                response += f"💰 <b>Загальна сума:</b> {total:.2f} грн\n\n"
-                response += "<b>Підтвердити замовлення?</b>"
-                
-                await update.message.reply_text(response, reply_markup=get_order_confirmation_keyboard(), parse_mode='HTML')
+    except Exception as e:
+        logger.error("❌ ОШИБКА В message_handler: %s", e)
+
+# ==================== ОГРАНИЧЕНИЕ ИСХОДЯЩИХ ЗАПРОСОВ ====================
+
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+OUTBOUND_RETRIES = metrics.counter(
+    "bot_outbound_retries_total", "Повторы запросов к Bot API после RetryAfter", ["method"])
+
+outbound_limiter = OutboundLimiter(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    global_burst=OUTBOUND_GLOBAL_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    max_retries=OUTBOUND_MAX_RETRIES,
+    on_retry=lambda method, wait: OUTBOUND_RETRIES.inc(method)
+)
+
+metrics.gauge("bot_outbound_queue_depth", "Исходящие запросы, ждущие лимита",
+              lambda: outbound_limiter.queue_depth)
+metrics.gauge("bot_outbound_paused_seconds", "Сколько ещё длится пауза после RetryAfter",
+              lambda: outbound_limiter.paused_for)
+
+# ==================== ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ОБНОВЛЕНИЙ ====================
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))
+
+UPDATE_WAIT = metrics.histogram(
+    "bot_update_wait_seconds", "Ожидание обновления перед обработкой (очередь пользователя и слоты)")
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей.
+
+    Обновления одного пользователя выстраиваются в цепочку и
+    обрабатываются строго по порядку, поэтому шаги full_order_* одного
+    чата не перемешиваются. Одновременно выполняется не больше
+    concurrency обработчиков; ожидающий своей очереди пользователь
+    слот не занимает. max_pending ограничивает число принятых, но ещё
+    не завершённых обновлений.
+    """
+
+    def __init__(self, concurrency: int = 16, max_pending: int = 1000):
+        super().__init__(max(2, max_pending))
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # user_id -> future завершения последнего принятого обновления пользователя
+        self._tails: Dict[int, asyncio.Future] = {}
+        # Места, занятые AdmissionQueue до создания задачи обновления
+        self._admitted = 0
+        self.running = 0
+        self.pending = 0
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    @property
+    def waiting(self) -> int:
+        """Приняты, но ещё ждут очереди пользователя или свободного слота"""
+        return self.pending - self.running
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.max_concurrent_updates
+
+    async def admit(self):
+        """Занимает место под следующее обновление; вызывается до создания его задачи"""
+        await self._semaphore.acquire()
+        self._admitted += 1
+
+    def cancel_admission(self):
+        self._admitted -= 1
+        self._semaphore.release()
+
+    async def process_update(self, update: object, coroutine: Awaitable):
+        if not self._admitted:
+            # Обновление пришло в обход AdmissionQueue
+            await super().process_update(update, coroutine)
+            return
+        self._admitted -= 1
+        try:
+            await self.do_process_update(update, coroutine)
+        finally:
+            self._semaphore.release()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        key = self._key(update)
+        previous = None
+        done = None
+        if key is not None:
+            # Место в цепочке занимается до первого await - в порядке поступления
+            previous = self._tails.get(key)
+            done = asyncio.get_running_loop().create_future()
+            self._tails[key] = done
         
-        elif state == "waiting_phone_for_quick_order":
-            phone = text.strip()
-            product_id = temp_data.get("product_id")
-            
-            product = next((p for p in PRODUCTS if p["id"] == product_id), None)
-            if not product:
-                await update.message.reply_text("❌ Помилка: продукт не знайдено", reply_markup=get_main_menu())
-                Database.clear_user_session(user_id)
-                return
-            
-            # Валидация
-            is_valid, formatted_phone = validate_phone(phone)
-            
-            if not is_valid:
-                response = f"❌ <b>Невірний номер телефону!</b>\n\n"
-                response += "📱 <b>Введіть ваш номер телефону ще раз:</b>\n"
-                response += "<i>Приклад: +380501234567 або 0501234567</i>"
-                
-                await update.message.reply_text(response, parse_mode='HTML')
-                return
-            
-            # Сохраняем быстрый заказ
-            user_name = f"{user.first_name or ''} {user.last_name or ''}"
-            username = user.username or 'немає'
-            
-            order_id = Database.save_quick_order(
-                user_id, user_name, username, product_id, product["name"], 
-                0, formatted_phone, "call"
-            )
-            
-            # Логируем
-            logger.info(f"\n{'='*80}")
-            logger.info(f"⚡ ШВИДКЕ ЗАМОВЛЕННЯ #{order_id} (ТЕЛЕФОН):")
-            logger.info(f"👤 Клієнт: {user_name}")
-            logger.info(f"📞 Телефон: {formatted_phone}")
-            logger.info(f"📦 Продукт: {product['name']}")
-            logger.info(f"🆔 User ID: {user_id}")
-            logger.info(f"📱 Username: {username}")
-            logger.info(f"{'='*80}\n")
-            
-            # Очищаем сессию
-            Database.clear_user_session(user_id)
-            
-            # Отвечаем
-            response = f"✅ <b>Швидке замовлення прийнято!</b>\n\n"
-            response += f"🆔 <b>Номер замовлення:</b> #{order_id}\n"
-            response += f"📦 <b>Продукт:</b> {product['name']}\n"
-            response += f"📞 <b>Ваш телефон:</b> {formatted_phone}\n\n"
-            response += "<b>Ми зателефонуємо вам найближчим часом для уточнення деталей!</b>\n\n"
-            response += "<i>Дякуємо за замовлення! 🌱</i>"
-            
-            await update.message.reply_text(response, reply_markup=get_main_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="main_menu")
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            if previous is not None:
+                # shield: отмена этой задачи не должна отменять future предыдущего обновления
+                await asyncio.shield(previous)
+            async with self._slots:
+                UPDATE_WAIT.observe(time.perf_counter() - started)
+                self.running += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        finally:
+            self.pending -= 1
+            if done is not None:
+                if not done.done():
+                    done.set_result(None)
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+
+    async def initialize(self):
+        # Семафор привязывается к циклу событий, поэтому создаётся при запуске
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._semaphore = asyncio.BoundedSemaphore(self.max_concurrent_updates)
+        self._admitted = 0
+        self._tails.clear()
+
+    async def shutdown(self):
+        pass
+
+
+class AdmissionQueue(asyncio.Queue):
+    """Очередь обновлений, из которой следующее берётся только при свободном месте.
+
+    Application создаёт задачу на каждое обновление сразу после get(), и
+    без этого очередь опустошалась бы в неограниченное число задач. Здесь
+    место в процессоре занимается до get(), поэтому при max_pending
+    принятых обновлений очередь заполняется и polling ждёт на put().
+    """
+
+    def __init__(self, processor: PerUserUpdateProcessor, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.processor = processor
+
+    async def get(self):
+        await self.processor.admit()
+        try:
+            item = await super().get()
+        except BaseException:
+            self.processor.cancel_admission()
+            raise
+        if item is _STOP_SIGNAL:
+            # Маркер остановки не обрабатывается - занятое под него место сразу освобождаем
+            self.processor.cancel_admission()
+        return item
+
+update_processor = PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING)
+
+metrics.gauge("bot_update_concurrency_limit", "Максимум одновременно обрабатываемых обновлений",
+              lambda: update_processor.concurrency)
+metrics.gauge("bot_updates_running", "Обновления в обработке", lambda: update_processor.running)
+metrics.gauge("bot_updates_waiting", "Обновления, ждущие очереди пользователя или слота",
+              lambda: update_processor.waiting)
+
+# ==================== HTTP: ЗДОРОВЬЕ СЕРВИСА ====================
+
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "10000"))
+HEALTH_LAG_INTERVAL = float(os.getenv("HEALTH_LAG_INTERVAL", "1"))
+HEALTH_MAX_LAG = float(os.getenv("HEALTH_MAX_LAG", "2"))
+HEALTH_STALL_SECONDS = float(os.getenv("HEALTH_STALL_SECONDS", "60"))
+HEALTH_DB_TIMEOUT = float(os.getenv("HEALTH_DB_TIMEOUT", "2"))
+
+# Один HTTP-сервер в цикле событий бота: здоровье, webhook
+http_server = HttpServer(HTTP_HOST, PORT)
+
+class HealthMonitor:
+    """Живучесть бота для /health.
+
+    Задержка цикла событий измеряется фоновой задачей: насколько позже
+    заданного она просыпается; в отчёт идёт максимум за последние
+    lag_window секунд, чтобы короткая блокировка не потерялась. Время последнего обработанного обновления
+    отмечает обработчик, который идёт после всех остальных. Бот считается
+    нездоровым, если цикл событий тормозит, база не отвечает или очередь
+    обновлений не пуста, а обработка давно стоит на месте.
+    """
+
+    def __init__(self, interval: float = 1, max_lag: float = 2, stall_seconds: float = 60,
+                 lag_window: float = 30):
+        self.interval = interval
+        self.max_lag = max_lag
+        self.stall_seconds = stall_seconds
+        self._lags = deque(maxlen=max(1, int(lag_window / interval)))
+        self.started_at: Optional[float] = None
+        self.last_update_at: Optional[float] = None
+        self.application: Optional[Application] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._lags.append(max(0.0, loop.time() - expected))
+
+    @property
+    def loop_lag(self) -> float:
+        return max(self._lags, default=0.0)
+
+    def start(self, application: Application):
+        self.application = application
+        self.started_at = time.monotonic()
+        self._lags.clear()
+        if self._task is None:
+            self._task = asyncio.create_task(self._measure_lag())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def mark_update(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        """Отмечает обработанное обновление"""
+        self.last_update_at = time.monotonic()
+
+    async def _database_ok(self) -> bool:
+        try:
+            return await asyncio.wait_for(AsyncDatabase.ping(), HEALTH_DB_TIMEOUT)
+        except Exception as e:
+            logger.warning("⚠️ База недоступна для /health: %s", e)
+            return False
+
+    async def status(self) -> Dict:
+        now = time.monotonic()
+        queue_depth = self.application.update_queue.qsize() if self.application else 0
+        queue_depth += update_processor.waiting
+        since_update = None if self.last_update_at is None else now - self.last_update_at
+        idle_since = self.last_update_at or self.started_at or now
+        database_ok = await self._database_ok()
+        
+        problems = []
+        if self.application is None or not self.application.running:
+            problems.append("application_not_running")
+        if self.loop_lag > self.max_lag:
+            problems.append("event_loop_lag")
+        if not database_ok:
+            problems.append("database_unreachable")
+        if queue_depth and now - idle_since > self.stall_seconds:
+            problems.append("updates_stalled")
+        
+        return {
+            "status": "ok" if not problems else "fail",
+            "problems": problems,
+            "mode": BOT_MODE,
+            "uptime_seconds": round(now - self.started_at, 1) if self.started_at else 0,
+            "event_loop_lag_ms": round(self.loop_lag * 1000, 1),
+            "seconds_since_last_update": None if since_update is None else round(since_update, 1),
+            "update_queue_depth": queue_depth,
+            "updates_running": update_processor.running,
+            "database": "ok" if database_ok else "unreachable",
+        }
+
+health = HealthMonitor(HEALTH_LAG_INTERVAL, HEALTH_MAX_LAG, HEALTH_STALL_SECONDS)
+
+metrics.gauge("bot_event_loop_lag_seconds", "Задержка цикла событий (максимум за окно)",
+              lambda: health.loop_lag)
+metrics.gauge("bot_update_queue_depth", "Обновления в очереди на обработку",
+              lambda: health.application.update_queue.qsize() if health.application else 0)
+metrics.gauge("bot_session_cache_size", "Сессии в кэше", lambda: len(session_cache))
+
+@http_server.route("GET", "/")
+async def http_home(request: Request) -> Response:
+    return text_response("🌱 Бот фермы 'Смак природи' работает.")
+
+@http_server.route("GET", "/metrics")
+async def http_metrics(request: Request) -> Response:
+    return Response(200, metrics.render().encode("utf-8"), Registry.CONTENT_TYPE)
+
+@http_server.route("GET", "/health")
+async def http_health(request: Request) -> Response:
+    status = await health.status()
+    return Response(
+        200 if status["status"] == "ok" else 503,
+        json.dumps(status).encode("utf-8"),
+        "application/json"
+    )
+
+# ==================== WEBHOOK ====================
+
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Публичный адрес сервиса; Render сам передаёт RENDER_EXTERNAL_URL
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+
+class WebhookReceiver:
+    """Приём обновлений от Telegram по HTTP.
+
+    Запрос только проверяется и кладётся в очередь обновлений Application,
+    ответ отправляется сразу, обработка идёт отдельно. Если очередь
+    заполнена или обработчик уже принял максимум обновлений, отвечаем
+    503 - Telegram повторит доставку позже.
+    """
+
+    def __init__(self, application: Application, secret: str):
+        self.application = application
+        self.secret = secret.encode()
+        self.received = 0
+        self.rejected = 0
+        self.overloaded = 0
+
+    async def handle(self, request: Request) -> Response:
+        token = request.headers.get("x-telegram-bot-api-secret-token", "").encode()
+        if not hmac.compare_digest(token, self.secret):
+            self.rejected += 1
+            return text_response("Forbidden", 403)
+        
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            self.rejected += 1
+            logger.warning("⚠️ Некорректное обновление webhook: %s", e)
+            return text_response("Bad Request", 400)
+        
+        try:
+            if update_processor.saturated:
+                raise asyncio.QueueFull
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.overloaded += 1
+            return text_response("Overloaded", 503, headers=(("Retry-After", "1"),))
+        
+        self.received += 1
+        return Response()
+
+    def stats(self) -> Dict[str, int]:
+        return {"received": self.received, "rejected": self.rejected, "overloaded": self.overloaded}
+
+async def run_webhook(application: Application):
+    """Запуск бота в режиме webhook; обновления принимает общий HTTP-сервер"""
+    receiver = WebhookReceiver(application, WEBHOOK_SECRET)
+    http_server.add_route("POST", WEBHOOK_PATH, receiver.handle)
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
         
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            logger.info("🔗 Webhook: %s%s", WEBHOOK_URL.rstrip('/'), WEBHOOK_PATH)
         else:
-            # Обычное сообщение
-            user_name = f"{user.first_name or ''} {user.last_name or ''}"
-            username = user.username or 'немає'
-            
-            # Сохраняем сообщение
-            Database.save_message(user_id, user_name, username, text, "повідомлення в чаті")
-            
-            # Отвечаем
-            response = "✅ <b>Повідомлення отримано!</b>\n\n"
-            response += "Ми відповімо вам найближчим часом.\n"
-            response += "<i>Дякуємо за звернення! 🌱</i>"
-            
-            await update.message.reply_text(response, reply_markup=get_main_menu(), parse_mode='HTML')
-            Database.save_user_session(user_id, last_section="main_menu")
-            
-    except Exception as e:
-        logger.error(f"❌ ОШИБКА В message_handler: {e}")
+            logger.warning("⚠️ WEBHOOK_URL не задан, webhook в Telegram не зарегистрирован")
+        
+        await application.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        # И после ошибки set_webhook/post_init: закрываем HTTP-клиент и сохраняем буферы
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info("📊 Webhook: %s", receiver.stats())
 
 # ==================== ЗАПУСК БОТА ====================
 
+async def on_startup(application: Application):
+    """Запуск фонових задач і HTTP-сервера після ініціалізації бота"""
+    write_buffer.start()
+    session_cache.start()
+    application.bot_data["photo_warmup"] = asyncio.create_task(warm_up_photos(application.bot))
+    if ARCHIVE_INTERVAL > 0:
+        retention_job.start()
+    health.start(application)
+    await http_server.start()
+
+async def on_shutdown(application: Application):
+    """Завершення роботи: зберігаємо буфери і дочікуємося запитів до бази"""
+    await http_server.stop()
+    await health.stop()
+    await retention_job.stop()
+    photo_warmup = application.bot_data.get("photo_warmup")
+    if photo_warmup is not None and not photo_warmup.done():
+        photo_warmup.cancel()
+    await write_buffer.stop()
+    await session_cache.stop()
+    logger.info("📊 Кеш сессий: %s", session_cache.stats())
+    AsyncDatabase.shutdown()
+
+def build_application(request: BaseRequest = None) -> Application:
+    """Создание приложения с обработчиками; request - для подмены транспорта Bot API"""
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .update_queue(AdmissionQueue(update_processor, maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(update_processor)
+        .rate_limiter(outbound_limiter)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_API_URL:
+        # Свой сервер Bot API (или локальная заглушка для нагрузочных тестов)
+        builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    builder = builder.request(InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+    application = builder.build()
+    
+    # Добавляем обработчики
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    # Отметка для /health - после всех обработчиков
+    application.add_handler(TypeHandler(Update, health.mark_update), group=1)
+    return application
+
+def run_export(argv: List[str]):
+    """python bot.py export <набір> - вивантаження в CSV/JSONL з read-only з'єднання"""
+    parser = argparse.ArgumentParser(prog="bot.py export", description="Вивантаження замовлень і повідомлень")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--output", default="-", help="файл (за замовчуванням stdout)")
+    parser.add_argument("--since", help="created_at від, включно (наприклад 2026-01-01)")
+    parser.add_argument("--until", help="created_at до, не включно")
+    parser.add_argument("--status", action="append", default=[], help="статус замовлення; можна кілька разів")
+    parser.add_argument("--watermark", help="файл-мітка: вивантажити лише нове з минулого запуску")
+    parser.add_argument("--batch", type=int, default=1000, help="рядків на fetchmany")
+    parser.add_argument("--archive", action="store_true", help="разом з архівами з ARCHIVE_DIR")
+    args = parser.parse_args(argv)
+    if args.status and DATASETS[args.dataset].status is None:
+        parser.error(f"{args.dataset} не має статусу")
+
+    watermarks = load_watermarks(args.watermark) if args.watermark else {}
+    watermark = watermark_key(args.dataset, args.since, args.until, args.status)
+    conn = open_reporting(DB_PATH, ARCHIVE_DIR, args.since, args.until) if args.archive else open_readonly(DB_PATH)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    try:
+        count, last_id = export_dataset(
+            conn, args.dataset, out, args.format, after_id=watermarks.get(watermark, 0),
+            since=args.since, until=args.until, statuses=args.status, batch=args.batch
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        conn.close()
+
+    # Мітку сдвигаем только после успешной записи всего набора
+    if args.watermark:
+        watermarks[watermark] = last_id
+        save_watermarks(args.watermark, watermarks)
+    logger.info("📤 Выгружено %s: %s записей, последний id %s", args.dataset, count, last_id)
+
+def run_archive(argv: List[str]):
+    """python bot.py archive - один прохід архівації без запуску бота"""
+    parser = argparse.ArgumentParser(prog="bot.py archive", description="Архівація старих даних")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="перевести базу в auto_vacuum=INCREMENTAL (повний VACUUM, блокує запис)")
+    args = parser.parse_args(argv)
+
+    if args.enable_incremental_vacuum:
+        conn = Database.connections.acquire_writer()
+        try:
+            started = time.perf_counter()
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            logger.info("🧹 auto_vacuum=INCREMENTAL, VACUUM: %.1f с", time.perf_counter() - started)
+        finally:
+            Database.connections.release(conn)
+
+    moved = asyncio.run(run_retention())
+    logger.info("✅ Архивация завершена: %s", dict(moved) or 'нечего переносить')
+
+def run_prepare_images(argv: List[str]):
+    """python bot.py prepare-images - те саме, що python -m imagecache з каталогами бота"""
+    sys.exit(subprocess.call(prepare_images_command(*argv), cwd=os.path.dirname(os.path.abspath(__file__))))
+
 def main():
     """Основная функция запуска бота"""
+    # python bot.py export ... только читает базу, поэтому идёт до init_database
+    if sys.argv[1:2] == ["export"]:
+        run_export(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["prepare-images"]:
+        run_prepare_images(sys.argv[2:])
+        return
+    
     # Инициализируем базу данных
     init_database()
     
+    # python bot.py reconcile-stats - пересчёт счётчиков статистики без запуска бота
+    if sys.argv[1:] == ["reconcile-stats"]:
+        drift = Database.reconcile_statistics()
+        for name, (before, after) in drift.items():
+            logger.warning("⚠️ Счётчик %s: %s -> %s", name, before, after)
+        logger.info("✅ Счётчики пересчитаны, расхождений: %s", len(drift))
+        return
+    if sys.argv[1:2] == ["archive"]:
+        run_archive(sys.argv[2:])
+        return
+    
+    # Команды выше работают без токена; запуск бота без него невозможен
+    if not TOKEN:
+        logger.error("❌ Токен не найден! Добавьте BOT_TOKEN в переменные окружения Render")
+        sys.exit(1)
+    
+    # Готовим статические экраны и таблицу состояний диалога
+    screens.rebuild()
+    conversation.compile()
+    
     # Логируем статистику
     stats = Database.get_statistics()
     logger.info("=" * 80)
     logger.info("🌱 БОТ ФЕРМИ 'Смак природи' ЗАПУЩЕНО")
-    logger.info(f"🔑 Токен: {TOKEN[:10]}...")
+    logger.info("🔑 Токен: %s...", TOKEN[:10])
     logger.info("=" * 80)
     logger.info("📊 Статистика:")
-    logger.info(f"• Користувачів: {stats.get('total_users', 0)}")
-    logger.info(f"• Замовлень: {stats.get('total_orders', 0)}")
-    logger.info(f"• Повідомлень: {stats.get('total_messages', 0)}")
-    logger.info(f"• Швидких замовлень: {stats.get('quick_orders', 0)}")
-    logger.info(f"• Активних кошиків: {stats.get('active_carts', 0)}")
-    logger.info(f"• Продуктів у базі: {len(PRODUCTS)}")
+    logger.info("• Користувачів: %s", stats.get('total_users', 0))
+    logger.info("• Замовлень: %s", stats.get('total_orders', 0))
+    logger.info("• Повідомлень: %s", stats.get('total_messages', 0))
+    logger.info("• Швидких замовлень: %s", stats.get('quick_orders', 0))
+    logger.info("• Активних кошиків: %s", stats.get('active_carts', 0))
+    logger.info("• Продуктів у базі: %s", len(CATALOG))
     logger.info("=" * 80)
     logger.info("🔄 Очікування повідомлень...\n")
     
-    # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
-    
-    # Добавляем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("cancel", cancel_command))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    # Создаем приложение и запускаем бота
+    application = build_application()
     
-    # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,166 @@
+"""
+МАРШРУТИЗАЦІЯ INLINE-КНОПОК
+
+Компактний формат callback_data з версією та диспетчер, що знаходить
+обробник дії одним зверненням до словника.
+
+Формат: <версія><код дії>[:<аргумент>...], наприклад "1p:3" - продукт №3.
+"""
+
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+# Telegram обмежує callback_data 64 байтами
+MAX_CALLBACK_BYTES = 64
+SEPARATOR = ":"
+
+
+class CallbackDataError(ValueError):
+    """Некоректні дані кнопки.
+
+    reason: "stale" - кнопка іншої версії (наприклад, з повідомлення,
+    надісланого до оновлення бота), "unknown" - невідомий код дії,
+    "invalid" - неправильні аргументи.
+    """
+
+    def __init__(self, reason: str, data: str):
+        super().__init__(f"{reason} callback data: {data!r}")
+        self.reason = reason
+        self.data = data
+
+
+class CallbackData(NamedTuple):
+    action: str
+    args: Tuple
+
+
+class CallbackCodec:
+    """Кодування і розбір callback_data для зареєстрованих дій"""
+
+    def __init__(self, version: str = "1"):
+        if len(version) != 1 or version == SEPARATOR:
+            raise ValueError("Version must be a single character")
+        self.version = version
+        self._by_action: Dict[str, Tuple[str, Tuple[type, ...]]] = {}
+        self._by_code: Dict[str, Tuple[str, Tuple[type, ...]]] = {}
+
+    def register(self, action: str, code: str, *arg_types: type):
+        """Реєструє дію з коротким кодом і типами аргументів (int або str)"""
+        if SEPARATOR in code:
+            raise ValueError(f"Code must not contain '{SEPARATOR}': {code!r}")
+        if code in self._by_code:
+            raise ValueError(f"Code {code!r} is already used by {self._by_code[code][0]!r}")
+        if action in self._by_action:
+            raise ValueError(f"Action {action!r} is already registered")
+        self._by_action[action] = (code, arg_types)
+        self._by_code[code] = (action, arg_types)
+
+    def encode(self, action: str, *args) -> str:
+        """Повертає callback_data для дії"""
+        code, arg_types = self._by_action[action]
+        if len(args) != len(arg_types):
+            raise ValueError(f"{action} expects {len(arg_types)} argument(s), got {len(args)}")
+
+        parts = [self.version + code]
+        for value in args:
+            value = str(value)
+            if SEPARATOR in value:
+                raise ValueError(f"Argument must not contain '{SEPARATOR}': {value!r}")
+            parts.append(value)
+
+        data = SEPARATOR.join(parts)
+        if len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"Callback data longer than {MAX_CALLBACK_BYTES} bytes: {data!r}")
+        return data
+
+    def decode(self, data: str) -> CallbackData:
+        """Розбирає callback_data, кидає CallbackDataError якщо дані некоректні"""
+        if not data or data[0] != self.version:
+            raise CallbackDataError("stale", data)
+
+        code, *raw_args = data[1:].split(SEPARATOR)
+        entry = self._by_code.get(code)
+        if entry is None:
+            raise CallbackDataError("unknown", data)
+
+        action, arg_types = entry
+        if len(raw_args) != len(arg_types):
+            raise CallbackDataError("invalid", data)
+
+        try:
+            args = tuple(arg_type(raw) for arg_type, raw in zip(arg_types, raw_args))
+        except ValueError:
+            raise CallbackDataError("invalid", data) from None
+
+        return CallbackData(action, args)
+
+
+Handler = Callable[..., Awaitable]
+# Спостерігач отримує назву дії і тривалість обробника в секундах
+Observer = Callable[[str, float], None]
+# Викликається з причиною відхилення (stale, unknown, invalid)
+RejectObserver = Callable[[str], None]
+
+
+class CallbackRouter:
+    """Диспетчер inline-кнопок: дія -> обробник.
+
+    Обробник викликається як handler(*context_args, *callback_args).
+    Лічильники натискань по діях і відхилених даних - у stats; якщо
+    задано observer, йому передається тривалість кожного обробника,
+    а on_reject - причина кожного відхилення.
+    """
+
+    def __init__(self, codec: CallbackCodec = None, observer: Optional[Observer] = None,
+                 on_reject: Optional[RejectObserver] = None):
+        self.codec = codec or CallbackCodec()
+        self.observer = observer
+        self.on_reject = on_reject
+        self._handlers: Dict[str, Handler] = {}
+        self.stats: Counter = Counter()
+
+    def route(self, action: str, code: str, *arg_types: type):
+        """Декоратор: реєструє обробник дії"""
+        def decorator(handler: Handler) -> Handler:
+            self.codec.register(action, code, *arg_types)
+            self._handlers[action] = handler
+            return handler
+        return decorator
+
+    def encode(self, action: str, *args) -> str:
+        return self.codec.encode(action, *args)
+
+    def action_of(self, data: str) -> Optional[str]:
+        """Назва дії для callback_data або None, без обліку в stats"""
+        try:
+            return self.codec.decode(data).action
+        except CallbackDataError:
+            return None
+
+    async def dispatch(self, data: str, *context_args) -> CallbackData:
+        """Викликає обробник для callback_data.
+
+        Кидає CallbackDataError для застарілих або невідомих даних,
+        попередньо врахувавши їх у stats.
+        """
+        try:
+            callback = self.codec.decode(data)
+        except CallbackDataError as e:
+            self.stats[f"rejected_{e.reason}"] += 1
+            if self.on_reject is not None:
+                self.on_reject(e.reason)
+            raise
+
+        self.stats[callback.action] += 1
+        handler = self._handlers[callback.action]
+        if self.observer is None:
+            await handler(*context_args, *callback.args)
+            return callback
+
+        started = time.perf_counter()
+        try:
+            await handler(*context_args, *callback.args)
+        finally:
+            self.observer(callback.action, time.perf_counter() - started)
+        return callback
@@ -0,0 +1,103 @@
+"""
+КАТАЛОГ ПРОДУКТІВ ФЕРМИ "СМАК ПРИРОДИ"
+
+Індекси за id та категорією, щоб пошук продукту не залежав від розміру каталогу.
+"""
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class Product:
+    """Незмінний запис продукту"""
+
+    __slots__ = ("id", "name", "category", "description", "price", "unit", "image")
+
+    def __init__(self, id: int, name: str, category: str, description: str,
+                 price: float, unit: str, image: str = ""):
+        setattr_ = object.__setattr__
+        setattr_(self, "id", id)
+        setattr_(self, "name", name)
+        setattr_(self, "category", category)
+        setattr_(self, "description", description)
+        setattr_(self, "price", price)
+        setattr_(self, "unit", unit)
+        setattr_(self, "image", image)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Product is immutable, cannot set '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Product is immutable, cannot delete '{name}'")
+
+    def _key(self) -> Tuple:
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Product):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"Product(id={self.id!r}, name={self.name!r}, price={self.price!r})"
+
+
+class Catalog:
+    """Каталог продуктів з індексами за id та категорією.
+
+    Порядок продуктів зберігається таким, як його передали. Після replace()
+    зростає version і викликаються підписники, щоб похідні кеші
+    (наприклад, готові меню) могли перебудуватися.
+    """
+
+    def __init__(self, products: Iterable[Product] = ()):
+        self.version = 0
+        self._listeners: List[Callable[["Catalog"], None]] = []
+        self._build(products)
+
+    def _build(self, products: Iterable[Product]):
+        by_id: Dict[int, Product] = {}
+        by_category: Dict[str, List[Product]] = {}
+
+        for product in products:
+            if product.id in by_id:
+                raise ValueError(f"Duplicate product id: {product.id}")
+            by_id[product.id] = product
+            by_category.setdefault(product.category, []).append(product)
+
+        self._products: Tuple[Product, ...] = tuple(by_id.values())
+        self._by_id = by_id
+        self._by_category = {category: tuple(items) for category, items in by_category.items()}
+
+    def get(self, product_id: int) -> Optional[Product]:
+        """Повертає продукт за id або None"""
+        return self._by_id.get(product_id)
+
+    def by_category(self, category: str) -> Tuple[Product, ...]:
+        """Повертає продукти категорії в порядку каталогу"""
+        return self._by_category.get(category, ())
+
+    def categories(self) -> List[str]:
+        return list(self._by_category)
+
+    def replace(self, products: Iterable[Product]):
+        """Замінює вміст каталогу і сповіщає підписників"""
+        self._build(products)
+        self.version += 1
+        for listener in self._listeners:
+            listener(self)
+
+    def subscribe(self, listener: Callable[["Catalog"], None]):
+        """Реєструє функцію, яку буде викликано після зміни каталогу"""
+        self._listeners.append(listener)
+
+    def __iter__(self) -> Iterator[Product]:
+        return iter(self._products)
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def __contains__(self, product_id: int) -> bool:
+        return product_id in self._by_id
@@ -0,0 +1,107 @@
+"""
+СКІНЧЕННИЙ АВТОМАТ ДІАЛОГУ
+
+Стани діалогу описуються декларативно: назва стану, валідатор введення
+та обробник. Після compile() таблиця переходів незмінна, а вибір
+обробника для повідомлення - одне звернення до словника.
+"""
+
+import time
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+# Валідатор повертає (успіх, значення, текст помилки)
+Validator = Callable[[str], Tuple[bool, Any, str]]
+Handler = Callable[..., Awaitable[Optional["Transition"]]]
+# Спостерігач отримує назву стану і тривалість обробки в секундах
+Observer = Callable[[str, float], None]
+
+
+class Transition(NamedTuple):
+    """Перехід у наступний стан зі зміненими полями тимчасових даних"""
+    state: str
+    changes: Dict[str, Any]
+
+
+def goto(state: str, **changes) -> Transition:
+    """Перехід у стан state; зберігаються лише передані поля"""
+    return Transition(state, changes)
+
+
+class State(NamedTuple):
+    name: str
+    handler: Handler
+    validator: Optional[Validator]
+    on_invalid: Optional[Handler]
+
+
+class Conversation:
+    """Таблиця станів діалогу.
+
+    Обробник стану викликається як handler(*args, value), де value - текст
+    повідомлення або значення, яке повернув валідатор. Якщо валідатор
+    відхилив введення, викликається on_invalid(*args, error) і стан не
+    змінюється. Обробник повертає Transition або None, якщо сесією він
+    розпорядився сам. Якщо задано observer, йому передається тривалість
+    обробки кожного повідомлення.
+    """
+
+    def __init__(self, observer: Optional[Observer] = None):
+        self.observer = observer
+        self._states: Dict[str, State] = {}
+        self._table: Optional[MappingProxyType] = None
+
+    def state(self, name: str, validator: Validator = None, on_invalid: Handler = None):
+        """Декоратор: реєструє обробник стану"""
+        if validator is not None and on_invalid is None:
+            raise ValueError(f"State {name!r} has a validator but no on_invalid handler")
+
+        def decorator(handler: Handler) -> Handler:
+            if self._table is not None:
+                raise RuntimeError("Conversation is already compiled")
+            if name in self._states:
+                raise ValueError(f"State {name!r} is already registered")
+            self._states[name] = State(name, handler, validator, on_invalid)
+            return handler
+        return decorator
+
+    def compile(self) -> "Conversation":
+        """Фіксує таблицю переходів"""
+        if self._table is None:
+            self._table = MappingProxyType(dict(self._states))
+        return self
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._states
+
+    async def dispatch(self, state_name: str, text: str, *args) -> Tuple[bool, Optional[Transition]]:
+        """Обробляє повідомлення у стані state_name.
+
+        Повертає (чи був стан у таблиці, перехід або None).
+        """
+        if self._table is None:
+            self.compile()
+
+        state = self._table.get(state_name)
+        if state is None:
+            return False, None
+
+        if self.observer is None:
+            return True, await self._handle(state, text, args)
+
+        started = time.perf_counter()
+        try:
+            return True, await self._handle(state, text, args)
+        finally:
+            self.observer(state.name, time.perf_counter() - started)
+
+    @staticmethod
+    async def _handle(state: State, text: str, args: Tuple) -> Optional[Transition]:
+        value = text
+        if state.validator is not None:
+            ok, value, error = state.validator(text)
+            if not ok:
+                await state.on_invalid(*args, error)
+                return None
+
+        return await state.handler(*args, value)
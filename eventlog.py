@@ -0,0 +1,146 @@
+"""
+НЕБЛОКУЮЧЕ ЖУРНАЛЮВАННЯ
+
+Обробники бота лише підставляють аргументи в повідомлення і кладуть запис
+у чергу (QueueHandler), а форматування рядка чи JSON і запис у stderr
+виконує окремий потік QueueListener. Черга обмежена:
+якщо потік виводу не встигає, нові записи відкидаються і рахуються, а
+обробка оновлень не чекає на I/O.
+
+Події (замовлення, повідомлення) пишуться одним рядком з полями:
+    log_event(logger, "order_created", "✅ Новый заказ", order_id=1, total=250.0)
+У форматі text поля додаються до повідомлення як JSON, у форматі json
+кожен запис - окремий JSON-об'єкт.
+
+Часті записи (натискання кнопок) можна проріджувати SamplingFilter.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Optional, TextIO
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+FORMATS = ("text", "json")
+
+# Викликається для кожного відкинутого запису
+DropObserver = Callable[[logging.LogRecord], None]
+
+_exception_formatter = logging.Formatter()
+
+
+def log_event(logger: logging.Logger, event: str, message: str, level: int = logging.INFO, **fields):
+    """Один запис події з полями"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"event": event, "fields": fields})
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class EventFormatter(logging.Formatter):
+    """Звичайний текстовий формат; поля події дописуються в кінець рядка"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + _dumps(fields)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Один JSON-об'єкт на запис"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            entry["event"] = event
+            entry.update(getattr(record, "fields", None) or {})
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate is not None:
+            entry["sample_rate"] = sample_rate
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return _dumps(entry)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, що не блокує потік виклику"""
+
+    def __init__(self, log_queue: queue.Queue, on_drop: Optional[DropObserver] = None):
+        super().__init__(log_queue)
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Як у QueueHandler.prepare: аргументи підставляються зараз, поки об'єкти
+        # не змінилися, а traceback стає текстом і не тримає кадри стека.
+        # На відміну від нього, решту формату (час, рівень, поля події, JSON)
+        # додає форматер потоку виводу
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.on_drop:
+                self.on_drop(record)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускає лише частку rate записів (0..1); частка потрапляє в запис"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1:
+            return True
+        record.sample_rate = self.rate
+        return random.random() < self.rate
+
+
+def setup_logging(fmt: str = "text", level: int = logging.INFO, queue_size: int = 10000,
+                  stream: TextIO = None, on_drop: Optional[DropObserver] = None) -> QueueListener:
+    """Підключає до кореневого логера чергу з потоком виводу і запускає його"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown log format: {fmt}")
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else EventFormatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue, on_drop))
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # Поток вывода - демон; при выходе дописываем то, что осталось в очереди
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,172 @@
+"""
+ВИВАНТАЖЕННЯ ЗАМОВЛЕНЬ І ПОВІДОМЛЕНЬ
+
+Потокове вивантаження таблиць бота в CSV або JSONL для операторів.
+Рядки читаються пачками через fetchmany і одразу пишуться у вихідний
+потік, тож пам'ять не залежить від обсягу історії. База відкривається
+лише для читання: у режимі WAL читач не блокує запис бота.
+
+Інкрементальне вивантаження запам'ятовує найбільший вивантажений id
+кожного набору у файлі-мітці; наступний запуск бере лише новіші записи.
+Вивантаження з фільтрами (--since, --until, --status) має окрему мітку для
+кожного набору фільтрів: інакше відфільтровані рядки опинилися б нижче
+спільної мітки і не потрапили б у наступне повне вивантаження.
+Зміни статусу вже вивантажених замовлень мітка не відстежує.
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+from itertools import groupby
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, TextIO, Tuple
+from urllib.parse import quote
+
+
+class Dataset(NamedTuple):
+    table: str
+    key: str                   # монотонний id для мітки
+    columns: Tuple[str, ...]   # колонки CSV в порядку SELECT
+    select: str
+    status: Optional[str]      # колонка статусу, якщо є
+    items: int = 0             # скільки останніх колонок - позиція замовлення
+
+
+ORDER_COLUMNS = ("order_id", "created_at", "status", "order_type", "user_id", "user_name", "username",
+                 "phone", "city", "np_department", "total")
+ITEM_COLUMNS = ("product_name", "quantity", "price_per_unit")
+
+DATASETS: Dict[str, Dataset] = {
+    # Одна строка CSV на позицию; в JSONL позиции собираются в items заказа
+    "orders": Dataset(
+        "orders", "o.order_id", ORDER_COLUMNS + ITEM_COLUMNS,
+        "SELECT " + ", ".join(f"o.{c}" for c in ORDER_COLUMNS) + ", " + ", ".join(f"i.{c}" for c in ITEM_COLUMNS) +
+        " FROM orders o LEFT JOIN order_items i ON i.order_id = o.order_id",
+        "o.status", items=len(ITEM_COLUMNS),
+    ),
+    "quick_orders": Dataset(
+        "quick_orders", "id",
+        ("id", "created_at", "status", "contact_method", "user_id", "user_name", "username", "phone",
+         "product_id", "product_name", "quantity"),
+        "SELECT id, created_at, status, contact_method, user_id, user_name, username, phone, "
+        "product_id, product_name, quantity FROM quick_orders",
+        "status",
+    ),
+    "messages": Dataset(
+        "messages", "id",
+        ("id", "created_at", "message_type", "user_id", "user_name", "username", "text"),
+        "SELECT id, created_at, message_type, user_id, user_name, username, text FROM messages",
+        None,
+    ),
+}
+
+FORMATS = ("csv", "jsonl")
+
+
+def open_readonly(path: str) -> sqlite3.Connection:
+    """З'єднання, що не може нічого записати в базу"""
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def query(dataset: Dataset, after_id: int = 0, since: str = None, until: str = None,
+          statuses: Sequence[str] = ()) -> Tuple[str, List]:
+    """SQL і параметри вивантаження з фільтрами"""
+    prefix = "o." if dataset.table == "orders" else ""
+    where, params = [f"{dataset.key} > ?"], [after_id]
+    if since:
+        where.append(f"{prefix}created_at >= ?")
+        params.append(since)
+    if until:
+        where.append(f"{prefix}created_at < ?")
+        params.append(until)
+    if statuses:
+        if dataset.status is None:
+            raise ValueError(f"{dataset.table} has no status column")
+        where.append(f"{dataset.status} IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    order = f"{dataset.key}, i.id" if dataset.table == "orders" else dataset.key
+    return f"{dataset.select} WHERE {' AND '.join(where)} ORDER BY {order}", params
+
+
+def stream(conn: sqlite3.Connection, sql: str, params: Sequence, batch: int = 1000) -> Iterator[tuple]:
+    """Рядки запиту пачками по batch"""
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def records(dataset: Dataset, rows: Iterator[tuple]) -> Iterator[dict]:
+    """Записи JSONL: замовлення разом зі списком позицій"""
+    if not dataset.items:
+        for row in rows:
+            yield dict(zip(dataset.columns, row))
+        return
+
+    head = len(dataset.columns) - dataset.items
+    item_columns = dataset.columns[head:]
+    # Позиции заказа идут подряд (ORDER BY order_id), так что группировка потоковая
+    for _, group in groupby(rows, key=lambda row: row[0]):
+        first = next(group)
+        record = dict(zip(dataset.columns[:head], first[:head]))
+        record["items"] = [dict(zip(item_columns, row[head:])) for row in (first, *group)
+                           if row[head] is not None]
+        yield record
+
+
+def export_dataset(conn: sqlite3.Connection, name: str, out: TextIO, fmt: str = "csv", after_id: int = 0,
+                   since: str = None, until: str = None, statuses: Sequence[str] = (),
+                   batch: int = 1000) -> Tuple[int, int]:
+    """Пише набір name у out; повертає (кількість записів, найбільший id)"""
+    dataset = DATASETS[name]
+    sql, params = query(dataset, after_id, since, until, statuses)
+    rows = stream(conn, sql, params, batch)
+    count, last_id = 0, after_id
+
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(dataset.columns)
+        for row in rows:
+            writer.writerow(row)
+            count, last_id = count + 1, row[0]
+    elif fmt == "jsonl":
+        for record in records(dataset, rows):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count, last_id = count + 1, record[dataset.columns[0]]
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    return count, last_id
+
+
+def watermark_key(name: str, since: str = None, until: str = None, statuses: Sequence[str] = ()) -> str:
+    """Ключ мітки: назва набору, для фільтрованого вивантаження - разом з фільтрами"""
+    filters = [("since", since), ("until", until)] + [("status", status) for status in sorted(statuses)]
+    filters = [(key, value) for key, value in filters if value]
+    if not filters:
+        return name
+    return name + "?" + "&".join(f"{key}={quote(value)}" for key, value in filters)
+
+
+def load_watermarks(path: str) -> Dict[str, int]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_watermarks(path: str, watermarks: Dict[str, int]):
+    """Атомарно перезаписує файл-мітку"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".watermark-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(temp_path, path)
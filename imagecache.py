@@ -0,0 +1,263 @@
+"""
+ПІДГОТОВКА ЗОБРАЖЕНЬ ПРОДУКТІВ
+
+Для кожного фото з static/products створюються стиснуті варіанти: фото
+для карток (не більше 1024 px за більшою стороною) і мініатюра 320 px.
+Варіанти лежать у кеші за хешем вмісту джерела:
+    <cache>/<хеш[:2]>/<хеш>/photo-1024q78.jpg
+тому однаковий файл під різними іменами обробляється один раз, а змінений
+файл отримує новий каталог. Параметри варіанта входять в ім'я файлу, і
+зміна налаштувань теж призводить до повторної обробки.
+
+Хеші джерел запам'ятовуються в index.json разом з розміром і mtime: файл
+без змін не перечитується. Обробка змінених файлів іде паралельно в
+кількох процесах (spawn). Такі процеси імпортують головний модуль
+батьківського процесу, тому підготовка запускається цим модулем, а не з
+bot.py - інакше кожен процес заново налаштовував би логування і бота:
+    python -m imagecache [--workers N] [--force]
+Бот запускає ту саму команду окремим процесом і читає звіт з --json.
+
+Якщо JPEG-джерело вже менше за перекодований варіант, у кеш кладеться
+його копія. Для PNG і інших форматів варіант завжди перекодовується в
+JPEG, тож файл з розширенням .jpg справді містить JPEG.
+
+Потрібен Pillow (pip install Pillow). Без нього available() повертає
+False, і бот надсилає оригінальні файли.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from photos import EXTENSIONS, file_hash
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен - подготовка недоступна
+    Image = ImageOps = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX_FILE = "index.json"
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+
+class Variant(NamedTuple):
+    max_side: int
+    quality: int
+
+    @property
+    def suffix(self) -> str:
+        return f"{self.max_side}q{self.quality}"
+
+
+VARIANTS: Dict[str, Variant] = {
+    # Карточка в клиенте Telegram занимает ширину экрана телефона - 1024 px хватает с запасом
+    "photo": Variant(1024, 78),
+    "thumb": Variant(320, 75),
+}
+
+
+class ImageReport(NamedTuple):
+    name: str
+    source_bytes: int
+    variants: Dict[str, int]   # варіант -> розмір у байтах
+    processed: bool            # False - взято з кешу
+
+    def saved_by(self, name: str) -> int:
+        """Скільки байтів економить варіант name порівняно з джерелом"""
+        return self.source_bytes - self.variants.get(name, self.source_bytes)
+
+    @property
+    def saved(self) -> int:
+        """Економія фото для карток - варіанта, який надсилає бот"""
+        return self.saved_by("photo")
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def _write_atomic(path: str, data: bytes):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _render(source: str, variant: Variant) -> bytes:
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((variant.max_side, variant.max_side), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=variant.quality, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+def _process(source: str, directory: str, variants: Dict[str, Variant]) -> Dict[str, int]:
+    """Робота одного процесу: створює варіанти source у directory"""
+    os.makedirs(directory, exist_ok=True)
+    source_bytes = os.path.getsize(source)
+    source_is_jpeg = os.path.splitext(source)[1].lower() in JPEG_EXTENSIONS
+    sizes = {}
+    for name, variant in variants.items():
+        data = _render(source, variant)
+        if source_is_jpeg and len(data) >= source_bytes:
+            # Перекодирование не помогло (исходник уже маленький и сжатый) - оставляем как есть
+            with open(source, "rb") as f:
+                data = f.read()
+        _write_atomic(os.path.join(directory, f"{name}-{variant.suffix}.jpg"), data)
+        sizes[name] = len(data)
+    return sizes
+
+
+class ImageCache:
+    """Кеш стиснутих варіантів за хешем вмісту джерела"""
+
+    def __init__(self, directory: str, variants: Dict[str, Variant] = None):
+        self.directory = directory
+        self.variants = variants or VARIANTS
+        self._index_path = os.path.join(directory, INDEX_FILE)
+
+    def entry_dir(self, content_hash: str) -> str:
+        return os.path.join(self.directory, content_hash[:2], content_hash)
+
+    def variant_path(self, content_hash: str, name: str) -> str:
+        return os.path.join(self.entry_dir(content_hash), f"{name}-{self.variants[name].suffix}.jpg")
+
+    def variant_key(self, name: str) -> str:
+        """Частина ключа file_id, що відрізняє варіант від джерела"""
+        return f"{name}-{self.variants[name].suffix}"
+
+    def lookup(self, content_hash: str, name: str = "photo") -> Optional[str]:
+        """Шлях до готового варіанта або None"""
+        path = self.variant_path(content_hash, name)
+        return path if os.path.isfile(path) else None
+
+    def _complete(self, content_hash: str) -> bool:
+        return all(os.path.isfile(self.variant_path(content_hash, name)) for name in self.variants)
+
+    def _load_index(self) -> Dict[str, List]:
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def hashes(self, sources: Iterable[str]) -> Dict[str, str]:
+        """Хеші джерел; незмінені файли (розмір і mtime) не перечитуються"""
+        index = self._load_index()
+        result, changed = {}, False
+        for source in sources:
+            stat = os.stat(source)
+            key = os.path.abspath(source)
+            cached = index.get(key)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                result[source] = cached[2]
+                continue
+            result[source] = file_hash(source)
+            index[key] = [stat.st_size, stat.st_mtime_ns, result[source]]
+            changed = True
+        if changed:
+            os.makedirs(self.directory, exist_ok=True)
+            _write_atomic(self._index_path, json.dumps(index, indent=1).encode("utf-8"))
+        return result
+
+    def prepare(self, sources: Iterable[str], workers: int = None, force: bool = False) -> List[ImageReport]:
+        """Створює відсутні варіанти для sources; повертає звіт по кожному файлу"""
+        if not available():
+            raise RuntimeError("Pillow is not installed; run: pip install Pillow")
+
+        hashes = self.hashes(sources)
+        # Одинаковые файлы обрабатываем один раз
+        pending: Dict[str, str] = {}
+        for source, content_hash in hashes.items():
+            if (force or not self._complete(content_hash)) and content_hash not in pending:
+                pending[content_hash] = source
+
+        processed: Dict[str, Dict[str, int]] = {}
+        if pending:
+            workers = min(workers or os.cpu_count() or 1, len(pending))
+            # spawn: бот вызывает подготовку из потока при работающем цикле событий,
+            # а fork скопировал бы в дочерние процессы его потоки и блокировки
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = {content_hash: pool.submit(_process, source, self.entry_dir(content_hash), self.variants)
+                           for content_hash, source in pending.items()}
+                processed = {content_hash: future.result() for content_hash, future in futures.items()}
+
+        reports = []
+        for source, content_hash in hashes.items():
+            sizes = processed.get(content_hash) or {
+                name: os.path.getsize(self.variant_path(content_hash, name)) for name in self.variants
+            }
+            reports.append(ImageReport(os.path.basename(source), os.path.getsize(source), sizes,
+                                       pending.get(content_hash) == source))
+        return reports
+
+
+def sources_in(directory: str) -> List[str]:
+    """Фото в каталозі directory"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(EXTENSIONS))
+
+
+def _percent(saved: int, source: int) -> float:
+    return saved / source * 100 if source else 0
+
+
+def format_report(reports: List[ImageReport]) -> List[str]:
+    """Рядки таблиці звіту: розмір і економія кожного варіанта"""
+    names = list(reports[0].variants) if reports else []
+    lines = [f"{'файл':<16} {'джерело':>10} " + " ".join(f"{name:>10} {'':>6}" for name in names)]
+    for report in reports:
+        lines.append(f"{report.name:<16} {report.source_bytes:>10} " +
+                     " ".join(f"{report.variants.get(name, 0):>10} "
+                              f"{-_percent(report.saved_by(name), report.source_bytes):>+5.0f}%" for name in names) +
+                     ("" if report.processed else "  (кеш)"))
+    total_source = sum(report.source_bytes for report in reports)
+    lines.append(f"Всього джерел: {total_source} байт")
+    for name in names:
+        saved = sum(report.saved_by(name) for report in reports)
+        lines.append(f"  {name}: {total_source - saved} байт, економія {saved} "
+                     f"({_percent(saved, total_source):.0f}%)")
+    return lines
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(prog="python -m imagecache",
+                                     description="Підготовка стиснутих варіантів фото продуктів")
+    parser.add_argument("--source-dir", default=os.getenv("PRODUCT_PHOTOS_DIR", os.path.join(ROOT, "static", "products")))
+    parser.add_argument("--cache-dir", default=os.getenv("IMAGE_CACHE_DIR", os.path.join(ROOT, "static", "cache")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("IMAGE_WORKERS", "0")) or None,
+                        help="процесів (за замовчуванням - ядер)")
+    parser.add_argument("--force", action="store_true", help="обробити всі файли заново")
+    parser.add_argument("--json", action="store_true", help="звіт JSON-рядками, по одному на файл")
+    args = parser.parse_args(argv)
+
+    if not available():
+        parser.error("Pillow is not installed; run: pip install Pillow")
+    started = time.perf_counter()
+    reports = ImageCache(args.cache_dir).prepare(sources_in(args.source_dir), args.workers, args.force)
+    if args.json:
+        for report in reports:
+            print(json.dumps(report._asdict(), ensure_ascii=False))
+        return
+    for line in format_report(reports):
+        print(line)
+    print(f"Оброблено {sum(report.processed for report in reports)}, "
+          f"з кешу {sum(not report.processed for report in reports)}, "
+          f"{time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
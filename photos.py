@@ -0,0 +1,102 @@
+"""
+ФОТО ПРОДУКТІВ
+
+Фото лежать у static/products/<id продукту>.jpg. Кожен файл завантажується
+в Telegram лише раз: отриманий file_id зберігається в базі за ключем
+(id продукту, хеш вмісту), і наступні відправки передають тільки його.
+Змінений файл має інший хеш, тож для нього file_id ще немає і фото
+завантажиться заново; повернутий старий файл знову знайде свій file_id.
+
+Хеш перераховується лише тоді, коли змінилися розмір або mtime файлу,
+тому перевірка актуальності при кожній відправці - це один stat().
+
+Якщо підключено кеш стиснутих варіантів (imagecache.ImageCache) і в ньому
+вже є варіант для цього хешу, надсилається він; ключ file_id тоді
+"<хеш>:<варіант>", щоб не сплутати його із завантаженим оригіналом.
+"""
+
+import hashlib
+import os
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class Photo(NamedTuple):
+    product_id: int
+    path: str
+    content_hash: str
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProductPhotos:
+    """Файли фото продуктів і їхні file_id у Telegram"""
+
+    def __init__(self, directory: str, cache=None):
+        self.directory = directory
+        self.cache = cache
+        # path -> ((розмір, mtime), хеш)
+        self._hashes: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        # (product_id, хеш) -> file_id
+        self._file_ids: Dict[Tuple[int, str], str] = {}
+
+    def path(self, product_id: int) -> Optional[str]:
+        for extension in EXTENSIONS:
+            path = os.path.join(self.directory, f"{product_id}{extension}")
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _hash(self, path: str) -> str:
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        content_hash = file_hash(path)
+        self._hashes[path] = (signature, content_hash)
+        return content_hash
+
+    def current(self, product_id: int) -> Optional[Photo]:
+        """Поточний файл фото продукту або None, якщо фото немає"""
+        path = self.path(product_id)
+        if path is None:
+            return None
+        try:
+            content_hash = self._hash(path)
+        except OSError:
+            return None
+        if self.cache is not None:
+            variant = self.cache.lookup(content_hash, "photo")
+            if variant is not None:
+                return Photo(product_id, variant, f"{content_hash}:{self.cache.variant_key('photo')}")
+        return Photo(product_id, path, content_hash)
+
+    def file_id(self, photo: Photo) -> Optional[str]:
+        return self._file_ids.get((photo.product_id, photo.content_hash))
+
+    def remember(self, photo: Photo, file_id: str):
+        self._file_ids[(photo.product_id, photo.content_hash)] = file_id
+
+    def forget(self, photo: Photo):
+        """Telegram не прийняв file_id - наступна відправка завантажить файл"""
+        self._file_ids.pop((photo.product_id, photo.content_hash), None)
+
+    def load(self, rows: Iterable[Tuple[int, str, str]]):
+        """Заповнює file_id з рядків бази (product_id, content_hash, file_id)"""
+        for product_id, content_hash, file_id in rows:
+            self._file_ids[(product_id, content_hash)] = file_id
+
+    def missing(self, product_ids: Iterable[int]) -> Iterable[Photo]:
+        """Фото, для яких ще немає file_id"""
+        for product_id in product_ids:
+            photo = self.current(product_id)
+            if photo is not None and self.file_id(photo) is None:
+                yield photo
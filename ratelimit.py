@@ -0,0 +1,212 @@
+"""
+ОБМЕЖЕННЯ ВИХІДНИХ ЗАПИТІВ ДО BOT API
+
+Черга відправки з відрами токенів: загальний ліміт бота (~30 повідомлень/с)
+і ліміт на чат для нових повідомлень у групах і каналах (~1 повідомлення/с
+з невеликим запасом). Особисті чати і редагування повідомлень обмежує лише
+загальний ліміт: відповідь на натискання кнопки не повинна чекати. Інтерактивні
+відповіді мають пріоритет над масовими розсилками. Відповідь 429
+RetryAfter призупиняє всю відправку на вказаний час, після чого запит
+повторюється з наростаючою паузою.
+
+Масова відправка позначається так:
+    await bot.send_message(chat_id, text, rate_limit_args=BULK)
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+INTERACTIVE = 0
+BULK = {"priority": 10}
+
+# Методи, що надсилають або змінюють повідомлення і підпадають під ліміти
+LIMITED_PREFIXES = ("send", "edit", "copyMessage", "forwardMessage")
+# Нові повідомлення, на які діє ще й ліміт чату
+CHAT_LIMITED_PREFIXES = ("send", "copyMessage", "forwardMessage")
+
+# (метод, пауза перед повтором у секундах)
+RetryObserver = Callable[[str, float], None]
+
+
+class TokenBucket:
+    """Відро токенів з резервуванням: take() повертає, скільки чекати"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Скільки чекати до наступного токена, нічого не забираючи"""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> float:
+        """Забирає токен (можливо, наперед) і повертає час очікування"""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+def _group_chat(chat_id) -> bool:
+    """Групи і супергрупи мають від'ємний id; рядком (@username) задаються канали"""
+    if isinstance(chat_id, str):
+        return True
+    return chat_id is not None and chat_id < 0
+
+
+def _seconds(retry_after) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class OutboundLimiter(BaseRateLimiter):
+    """Обмежувач відправки для Application.builder().rate_limiter(...)
+
+    Нове повідомлення в групу спочатку чекає на ліміт свого чату (не займаючи
+    загальної черги), потім стає в загальну чергу з пріоритетом. Окремий
+    диспетчер видає загальні токени в порядку пріоритету, а всередині
+    пріоритету - в порядку надходження.
+    """
+
+    def __init__(self, global_rate: float = 30, global_burst: float = 30,
+                 chat_rate: float = 1, chat_burst: float = 3, max_retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 30, on_retry: Optional[RetryObserver] = None):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_retry = on_retry
+        self.stats: Counter = Counter()
+
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._chat_waiting = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Запити, що чекають на ліміт чату або загальний токен"""
+        return len(self._waiters) + self._chat_waiting
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    async def initialize(self):
+        # Application и Updater инициализируют один и тот же бот - второй диспетчер не нужен
+        if self._dispatcher is not None and not self._dispatcher.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future in self._waiters:
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._waiters:
+                delay = max(self.paused_for, self._global.delay())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                self._global.take()
+                future.set_result(None)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Полные вёдра ничего не помнят - их можно выбросить
+                self._chats = {key: value for key, value in self._chats.items() if not value.full}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id, priority: int):
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).take()
+            if delay:
+                self.stats["chat_throttled"] += 1
+                self._chat_waiting += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._chat_waiting -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    def _pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[Dict]):
+        if not endpoint.startswith(LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", INTERACTIVE)
+        chat_id = data.get("chat_id")
+        if not (endpoint.startswith(CHAT_LIMITED_PREFIXES) and _group_chat(chat_id)):
+            chat_id = None
+
+        for attempt in itertools.count():
+            await self._acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    self.stats["gave_up"] += 1
+                    raise
+                # Telegram просит паузу для всего бота; сверху - растущая случайная добавка
+                backoff = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                wait = _seconds(e.retry_after) + backoff
+                self._pause(wait)
+                self.stats["retried"] += 1
+                if self.on_retry:
+                    self.on_retry(endpoint, wait)
@@ -0,0 +1,220 @@
+"""
+АРХІВАЦІЯ ТА ТЕРМІНИ ЗБЕРІГАННЯ ДАНИХ
+
+Закриті замовлення і старі повідомлення переносяться з робочої бази в
+помісячні файли архіву (archive-2026-01.db) через ATTACH, невеликими
+пачками: кожна пачка спочатку фіксується в архіві, а потім видаляється з
+робочої бази окремою короткою транзакцією. Збій між цими кроками лишає
+рядок в обох базах, і наступний прохід просто завершить перенесення.
+
+Видалення з робочої бази зменшує лічильники статистики (їх ведуть тригери),
+тому разом з ним та сама транзакція додає перенесені рядки до окремого
+лічильника archived_<таблиця>: загальна кількість замовлень і повідомлень
+після архівації не змінюється.
+
+Застарілі сесії видаляються без архіву. Звільнені сторінки повертаються
+файловій системі через PRAGMA incremental_vacuum.
+
+Для звітів open_reporting() відкриває базу лише для читання і підключає
+архіви: тимчасові представлення з іменами таблиць (orders, messages, ...)
+об'єднують живі та архівні рядки, тож звичайні запити бачать всю історію.
+"""
+
+import glob
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+ARCHIVE_PREFIX = "archive-"
+ARCHIVE_ALIAS = "archive"
+
+
+class ArchivedTable(NamedTuple):
+    name: str
+    key: str
+    closed_only: bool                           # лише замовлення з закритим статусом
+    counter: str                                # лічильник статистики, що веде таблицю
+    children: Tuple[Tuple[str, str], ...] = ()  # (таблиця, колонка з ключем батька)
+
+    @property
+    def archived_counter(self) -> str:
+        return f"archived_{self.name}"
+
+
+ARCHIVED_TABLES: Dict[str, ArchivedTable] = {
+    "orders": ArchivedTable("orders", "order_id", True, "total_orders", (("order_items", "order_id"),)),
+    "quick_orders": ArchivedTable("quick_orders", "id", True, "quick_orders"),
+    "messages": ArchivedTable("messages", "id", False, "total_messages"),
+}
+
+# Таблиці, що є в архівах; порядок важливий для представлень звітів
+REPORTING_TABLES = ("orders", "order_items", "quick_orders", "messages")
+
+
+class RetentionPolicy(NamedTuple):
+    orders_days: int = 180
+    messages_days: int = 365
+    sessions_days: int = 30
+    closed_statuses: Tuple[str, ...] = ("виконано", "скасовано")
+
+    @staticmethod
+    def cutoff(days: int) -> str:
+        return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def archive_path(directory: str, month: str) -> str:
+    return os.path.join(directory, f"{ARCHIVE_PREFIX}{month}.db")
+
+
+def archive_months(directory: str, since: str = None, until: str = None) -> List[Tuple[str, str]]:
+    """Наявні архіви [(місяць, шлях)] у межах since..until (дати або місяці)"""
+    result = []
+    for path in sorted(glob.glob(os.path.join(directory, f"{ARCHIVE_PREFIX}????-??.db"))):
+        month = os.path.basename(path)[len(ARCHIVE_PREFIX):-3]
+        if since and month < since[:7]:
+            continue
+        if until and month > until[:7]:
+            continue
+        result.append((month, path))
+    return result
+
+
+def _quote_uri(path: str) -> str:
+    return quote(os.path.abspath(path))
+
+
+class Archiver:
+    """Операції архівації на з'єднанні для запису; кожен виклик - коротка пачка"""
+
+    def __init__(self, directory: str, policy: RetentionPolicy = RetentionPolicy(), batch: int = 500):
+        self.directory = directory
+        self.policy = policy
+        self.batch = batch
+
+    def candidates(self, conn: sqlite3.Connection, table: str, after_id: int = 0) -> List[Tuple[int, str]]:
+        """Наступна пачка рядків для архіву: [(id, місяць)] за зростанням id"""
+        spec = ARCHIVED_TABLES[table]
+        days = self.policy.orders_days if spec.closed_only else self.policy.messages_days
+        where, params = f"{spec.key} > ? AND created_at < ?", [after_id, self.policy.cutoff(days)]
+        if spec.closed_only:
+            where += f" AND status IN ({','.join('?' * len(self.policy.closed_statuses))})"
+            params.extend(self.policy.closed_statuses)
+        # Старые строки лежат в начале таблицы, поэтому обход по id быстро набирает пачку
+        return conn.execute(
+            f"SELECT {spec.key}, strftime('%Y-%m', created_at) FROM {spec.name} "
+            f"WHERE {where} ORDER BY {spec.key} LIMIT ?",
+            (*params, self.batch)
+        ).fetchall()
+
+    @staticmethod
+    def _columns(conn: sqlite3.Connection, table: str) -> str:
+        return ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+
+    def _ensure_tables(self, conn: sqlite3.Connection, tables: Sequence[str]):
+        for table in tables:
+            sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()[0]
+            conn.execute(re.sub(r"^CREATE TABLE\s+(IF NOT EXISTS\s+)?[\"`]?\w+[\"`]?",
+                                f"CREATE TABLE IF NOT EXISTS {ARCHIVE_ALIAS}.{table}", sql, count=1))
+
+    def move(self, conn: sqlite3.Connection, table: str, month: str, ids: Sequence[int]) -> int:
+        """Переносить рядки ids (і їх дочірні рядки) в архів місяця month"""
+        spec = ARCHIVED_TABLES[table]
+        parts = [(spec.name, spec.key)] + list(spec.children)
+        placeholders = ",".join("?" * len(ids))
+
+        os.makedirs(self.directory, exist_ok=True)
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_ALIAS}", (archive_path(self.directory, month),))
+        try:
+            self._ensure_tables(conn, [name for name, _ in parts])
+            # Сначала фиксируем копию в архиве: повтор после сбоя пропустит уже скопированное
+            conn.execute("BEGIN IMMEDIATE")
+            for name, column in parts:
+                # Явный список колонок: в архиве, созданном по старой схеме, порядок колонок может отличаться
+                columns = self._columns(conn, name)
+                conn.execute(f"INSERT OR IGNORE INTO {ARCHIVE_ALIAS}.{name} ({columns}) "
+                             f"SELECT {columns} FROM main.{name} WHERE {column} IN ({placeholders})", ids)
+            conn.commit()
+
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = 0
+            for name, column in reversed(parts):
+                cursor = conn.execute(f"DELETE FROM main.{name} WHERE {column} IN ({placeholders})", ids)
+                if name == spec.name:
+                    deleted = cursor.rowcount
+            # Триггер уже вычел удалённые строки из spec.counter - переносим их в счётчик архива
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (spec.archived_counter, deleted)
+            )
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.execute(f"DETACH DATABASE {ARCHIVE_ALIAS}")
+        return len(ids)
+
+    def delete_stale_sessions(self, conn: sqlite3.Connection) -> int:
+        """Видаляє пачку сесій, що не оновлювалися sessions_days днів"""
+        cursor = conn.execute(
+            "DELETE FROM user_sessions WHERE rowid IN "
+            "(SELECT rowid FROM user_sessions WHERE updated_at < ? LIMIT ?)",
+            (self.policy.cutoff(self.policy.sessions_days), self.batch)
+        )
+        conn.commit()
+        return cursor.rowcount
+
+    @staticmethod
+    def vacuum_step(conn: sqlite3.Connection, pages: int) -> Optional[int]:
+        """Повертає до pages вільних сторінок ОС; результат - скільки лишилось,
+        або None, якщо база не в режимі auto_vacuum=INCREMENTAL"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return None
+        # execute() делает один шаг прагмы, то есть освобождает одну страницу;
+        # executescript выполняет её до конца
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def group_by_month(rows: Sequence[Tuple[int, str]]) -> List[Tuple[str, List[int]]]:
+    """[(id, місяць)] -> [(місяць, [id])]"""
+    ordered = sorted(rows, key=lambda row: row[1])
+    return [(month, [row_id for row_id, _ in group]) for month, group in groupby(ordered, key=lambda row: row[1])]
+
+
+def open_reporting(db_path: str, directory: str, since: str = None, until: str = None) -> sqlite3.Connection:
+    """Read-only з'єднання, де orders, order_items, quick_orders і messages -
+    об'єднання робочої бази з архівами місяців since..until"""
+    conn = sqlite3.connect(f"file:{_quote_uri(db_path)}?mode=ro", uri=True)
+    archives = archive_months(directory, since, until)
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(archives) > limit:
+        conn.close()
+        raise ValueError(f"{len(archives)} archive files match, SQLite can attach at most {limit}; "
+                         f"narrow the date range")
+
+    schemas = []
+    for index, (_, path) in enumerate(archives):
+        schema = f"archive_{index}"
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{_quote_uri(path)}?mode=ro",))
+        schemas.append(schema)
+
+    for table in REPORTING_TABLES:
+        columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+        parts = [f"SELECT {columns} FROM main.{table}"]
+        for schema in schemas:
+            if conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                            (table,)).fetchone():
+                parts.append(f"SELECT {columns} FROM {schema}.{table}")
+        # Временное представление перекрывает одноимённую таблицу main в запросах без схемы
+        conn.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(parts)}")
+
+    conn.execute("PRAGMA query_only=ON")
+    return conn
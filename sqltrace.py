@@ -0,0 +1,213 @@
+"""
+ТРАСУВАННЯ SQL-ЗАПИТІВ
+
+Підкласи sqlite3.Connection і sqlite3.Cursor, що вимірюють кожен запит:
+тривалість (разом з першою вибіркою рядків), кількість рядків,
+очікування блокувань і обробник бота, з якого прийшов запит. Повільні
+запити потрапляють у окремий лог разом з EXPLAIN QUERY PLAN.
+
+З'єднання з трасуванням створюються лише якщо його ввімкнено, тож
+вимкнене трасування не додає до запитів жодної роботи.
+"""
+
+import logging
+import re
+import sqlite3
+import time
+from contextvars import ContextVar
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+
+# Обробник бота, від імені якого виконуються запити; контекст копіюється
+# в потоки бази разом із викликом
+current_handler: ContextVar[str] = ContextVar("sql_handler", default="-")
+
+slow_logger = logging.getLogger("sql.slow")
+
+_LABEL_RE = re.compile(
+    r"^\s*(SELECT|INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM|REPLACE\s+INTO|BEGIN|COMMIT|ROLLBACK|PRAGMA|CREATE|DROP|ALTER)"
+    r"(?:.*?\bFROM\s+(\w+)|\s+(\w+))?",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# (мітка запиту, обробник, секунди, рядки)
+StatementObserver = Callable[[str, str, float, int], None]
+# (секунди очікування, чи закінчилося помилкою "database is locked")
+LockObserver = Callable[[float, bool], None]
+
+
+def statement_label(sql: str) -> str:
+    """Коротка мітка запиту: дія і таблиця, наприклад "SELECT carts" """
+    match = _LABEL_RE.match(sql)
+    if not match:
+        return sql.split(None, 1)[0].upper() if sql.strip() else "?"
+    verb = match.group(1).split()[0].upper()
+    table = match.group(2) or match.group(3)
+    if verb in ("BEGIN", "COMMIT", "ROLLBACK") or not table:
+        return verb
+    return f"{verb} {table}"
+
+
+class SqlTracer:
+    """Збирає виміри запитів і пише повільні запити в лог"""
+
+    def __init__(self, slow_threshold: float = 0.1, on_statement: StatementObserver = None,
+                 on_lock_wait: LockObserver = None):
+        self.slow_threshold = slow_threshold
+        self.on_statement = on_statement
+        self.on_lock_wait = on_lock_wait
+        self._labels: Dict[str, str] = {}
+
+    def connection_factory(self):
+        """Фабрика для sqlite3.connect(factory=...)"""
+        return partial(TracedConnection, tracer=self)
+
+    def label(self, sql: str) -> str:
+        label = self._labels.get(sql)
+        if label is None:
+            if len(self._labels) > 1024:
+                self._labels.clear()
+            label = self._labels[sql] = statement_label(sql)
+        return label
+
+    def lock_wait(self, seconds: float, timed_out: bool = False):
+        if self.on_lock_wait:
+            self.on_lock_wait(seconds, timed_out)
+
+    def record(self, conn: sqlite3.Connection, sql: str, params, seconds: float, rows: int):
+        label = self.label(sql)
+        handler = current_handler.get()
+
+        if self.on_statement:
+            self.on_statement(label, handler, seconds, rows)
+        if label in ("BEGIN", "COMMIT"):
+            # Ожидание блокировки записи SQLite приходится на BEGIN IMMEDIATE и COMMIT
+            self.lock_wait(seconds)
+
+        if seconds >= self.slow_threshold and slow_logger.isEnabledFor(logging.WARNING):
+            slow_logger.warning(
+                "🐢 Медленный запрос %.1f мс, строк: %s, обработчик: %s\n%s\nПлан:\n%s",
+                seconds * 1000, rows, handler, " ".join(sql.split()), self.explain(conn, sql, params)
+            )
+
+    @staticmethod
+    def explain(conn: sqlite3.Connection, sql: str, params) -> str:
+        if label_verb(sql) in ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "CREATE", "DROP", "ALTER"):
+            return "  -"
+        try:
+            # Обычный курсор, чтобы EXPLAIN сам не попал в трассировку
+            cursor = sqlite3.Cursor(conn)
+            rows = cursor.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+        except sqlite3.Error as e:
+            return f"  (не удалось получить план: {e})"
+
+        depth = {0: 0}
+        lines = []
+        for node_id, parent, _, detail in rows:
+            depth[node_id] = depth.get(parent, 0) + 1
+            lines.append("  " * depth[node_id] + detail)
+        return "\n".join(lines) or "  -"
+
+
+def label_verb(sql: str) -> str:
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Курсор, що вимірює запити.
+
+    Для SELECT вимір завершується на першій вибірці рядків, бо SQLite
+    виконує запит поступово під час читання результату.
+    """
+
+    def __init__(self, conn: "TracedConnection"):
+        super().__init__(conn)
+        self._tracer: SqlTracer = conn.tracer
+        self._pending: Optional[Tuple[str, object, float]] = None
+
+    def _finish(self, rows: int):
+        if self._pending is not None:
+            sql, params, started = self._pending
+            self._pending = None
+            self._tracer.record(self.connection, sql, params, time.perf_counter() - started, rows)
+
+    def _run(self, method, sql: str, params, explain_params):
+        self._finish(0)
+        started = time.perf_counter()
+        try:
+            method(sql, params)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                self._tracer.lock_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        if self.description is None:
+            self._tracer.record(self.connection, sql, explain_params,
+                                time.perf_counter() - started, max(self.rowcount, 0))
+        else:
+            self._pending = (sql, explain_params, started)
+        return self
+
+    def execute(self, sql: str, params=()):
+        return self._run(super().execute, sql, params, params)
+
+    def executemany(self, sql: str, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        return self._run(super().executemany, sql, seq_of_params,
+                         seq_of_params[0] if seq_of_params else ())
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._finish(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size: int = None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._finish(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._finish(len(rows))
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish(0)
+            raise
+        self._finish(1)
+        return row
+
+    def close(self):
+        self._finish(0)
+        super().close()
+
+
+class TracedConnection(sqlite3.Connection):
+    """З'єднання, всі курсори якого трасуються.
+
+    Скорочення conn.execute() у sqlite3 створюють курсор в обхід cursor(),
+    тому вони перевизначені і йдуть через трасований курсор.
+    """
+
+    def __init__(self, *args, tracer: SqlTracer, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tracer = tracer
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TracedCursor)
+
+    def execute(self, sql: str, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script: str):
+        # Скрипт не делится на запросы - в трассировку попадает целиком
+        cursor = self.cursor()
+        started = time.perf_counter()
+        sqlite3.Cursor.executescript(cursor, script)
+        self.tracer.record(self, script, None, time.perf_counter() - started, 0)
+        return cursor
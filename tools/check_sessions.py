@@ -0,0 +1,127 @@
+"""
+Перевірка кешу сесій на гонках із записом у базу.
+
+Кожен сценарій працює з тимчасовою базою: запис пачки сесій притримується,
+поки користувач встигає змінити сесію ще раз, або рядок сесії видаляється
+в обхід кешу (як це робить архівація). Потім перевіряється, що після
+наступного flush у базі лежить той самий стан, що й у кеші.
+
+Запуск:
+    python tools/check_sessions.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_bot():
+    os.environ.setdefault("BOT_TOKEN", "0:check")
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="check_sessions_"), "farm_bot.db")
+    sys.path.insert(0, ROOT)
+    import bot
+
+    bot.init_database()
+    return bot
+
+
+class HeldWrites:
+    """Притримує Database.save_sessions, поки не викликано release()"""
+
+    def __init__(self, bot, fail: bool = False):
+        self.bot = bot
+        self.fail = fail
+        self.started = threading.Event()
+        self._release = threading.Event()
+        self._original = bot.Database.save_sessions
+
+    def __enter__(self):
+        def held(*args, **kwargs):
+            self.started.set()
+            self._release.wait(5)
+            if self.fail:
+                raise self.bot.sqlite3.OperationalError("disk I/O error")
+            return self._original(*args, **kwargs)
+
+        self.bot.Database.save_sessions = held
+        return self
+
+    def release(self):
+        self._release.set()
+
+    def __exit__(self, *exc):
+        self.bot.Database.save_sessions = self._original
+
+
+def db_row(bot, user_id: int):
+    conn = bot.Database.connections.acquire_reader()
+    try:
+        return conn.execute("SELECT state, temp_data FROM user_sessions WHERE user_id = ?", (user_id,)).fetchone()
+    finally:
+        bot.Database.connections.release(conn)
+
+
+async def save_during_flush(bot, user_id: int, fail: bool):
+    """У базі A; користувач зберігає B, під час запису B повертається до A"""
+    cache = bot.SessionCache(interval=60)
+    cache.save(user_id, "A", {"x": 1})
+    await cache.flush()
+    await cache.get(user_id)
+
+    cache.save(user_id, "B", {"x": 2})
+    with HeldWrites(bot, fail) as writes:
+        flush = asyncio.create_task(cache.flush())
+        await asyncio.to_thread(writes.started.wait, 5)
+        cache.save(user_id, "A", {"x": 1})
+        writes.release()
+        await flush
+    await cache.flush()
+
+    cached = (await cache.get(user_id))["state"]
+    return cached, db_row(bot, user_id)
+
+
+async def patch_deleted_row(bot, user_id: int):
+    """Архівація видалила застарілий рядок, а кеш ще вважає його збереженим"""
+    cache = bot.SessionCache(interval=60)
+    cache.save(user_id, "A", {"x": 1})
+    await cache.flush()
+    await cache.get(user_id)
+
+    conn = bot.Database.connections.acquire_writer()
+    try:
+        conn.execute("DELETE FROM user_sessions WHERE user_id = ?", (user_id,))
+        conn.commit()
+    finally:
+        bot.Database.connections.release(conn)
+
+    cache.update(user_id, "B", {"y": 2})
+    await cache.flush()
+    return (await cache.get(user_id))["state"], db_row(bot, user_id)
+
+
+async def main():
+    bot = load_bot()
+    failures = 0
+    for user_id, fail in ((1, False), (2, True)):
+        name = "збій запису B" if fail else "запис B успішний"
+        cached, stored = await save_during_flush(bot, user_id, fail)
+        ok = cached == "A" and stored == ("A", '{"x": 1}')
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} save B, flush, save A ({name}): кеш {cached}, база {stored}")
+
+    cached, stored = await patch_deleted_row(bot, 3)
+    ok = cached == "B" and stored == ("B", '{"x": 1, "y": 2}')
+    failures += not ok
+    print(f"{'OK  ' if ok else 'FAIL'} update після видалення рядка: кеш {cached}, база {stored}")
+    bot.AsyncDatabase.shutdown()
+    if failures:
+        raise SystemExit(f"Сценаріїв з розбіжністю: {failures}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""
+Локальна заглушка Telegram Bot API для навантажувальних тестів.
+
+Реалізує getUpdates (long polling), sendMessage, editMessageText,
+answerCallbackQuery та службові методи, які викликає бот під час
+запуску. Дозволяє задати затримку відповідей, частку відповідей
+429 RetryAfter і частку помилок сервера, а також імітувати ліміти
+Telegram (30 повідомлень/с загалом і 1/с на чат).
+
+Оновлення для бота додаються через push_update() (в тому ж процесі)
+або POST /_inject зі списком JSON-оновлень.
+
+Запуск окремо:
+    python tools/fake_telegram.py --port 8081 --token 123:TEST --latency-ms 30 --retry-after-rate 0.01
+    BOT_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:TEST python bot.py
+"""
+
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from webserver import HttpServer, Request, Response  # noqa: E402
+
+# Методи, що повертають повідомлення
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageCaption", "editMessageMedia",
+                   "editMessageReplyMarkup", "sendPhoto"}
+SERVICE_METHODS = {"getMe", "getUpdates", "deleteWebhook", "setWebhook", "getWebhookInfo",
+                   "answerCallbackQuery", "deleteMessage", "setMyCommands", "sendMediaGroup",
+                   "logOut", "close"}
+# Обмежуються лімітами Telegram
+LIMITED_METHODS = MESSAGE_METHODS | {"sendMediaGroup"}
+
+
+def parse_params(request: Request) -> Dict[str, str]:
+    """Параметри виклику: form-urlencoded, multipart або JSON"""
+    content_type = request.headers.get("content-type", "")
+    if not request.body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(request.body)
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + request.body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and part.get_filename() is None:
+                params[name] = part.get_content()
+            elif name:
+                params[name] = f"<file {part.get_filename()}>"
+        return params
+    return {key: values[0] for key, values in parse_qs(request.body.decode("utf-8")).items()}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Забирає токен; повертає 0 або скільки секунд чекати"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeTelegram:
+    """Стан заглушки: черга оновлень, відповіді бота і ін'єкція помилок"""
+
+    def __init__(self, token: str, latency: float = 0.0, jitter: float = 0.0,
+                 retry_after_rate: float = 0.0, retry_after: int = 1, error_rate: float = 0.0,
+                 flood_limits: bool = False, seed: Optional[int] = None):
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.flood_limits = flood_limits
+        self.random = random.Random(seed)
+
+        self._updates: List[dict] = []
+        self._update_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._global_bucket = TokenBucket(30, 30)
+        self._chat_buckets: Dict[int, TokenBucket] = defaultdict(lambda: TokenBucket(1, 3))
+
+        # chat_id -> функції, що чекають на відповідь бота в цей чат
+        self._reply_listeners: Dict[int, List[Callable[[str, dict], None]]] = defaultdict(list)
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+
+    # ---------- оновлення для бота ----------
+
+    def push_update(self, update: dict) -> int:
+        """Додає оновлення в чергу getUpdates; update_id призначається тут"""
+        update = dict(update)
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_update.set()
+        return update["update_id"]
+
+    def on_reply(self, chat_id: int, listener: Callable[[str, dict], None]):
+        """Одноразово викликає listener(метод, параметри) на наступну відповідь у чат"""
+        self._reply_listeners[chat_id].append(listener)
+
+    @property
+    def pending_updates(self) -> int:
+        return len(self._updates)
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    # ---------- HTTP ----------
+
+    def install(self, server: HttpServer):
+        for method in MESSAGE_METHODS | SERVICE_METHODS:
+            server.add_route("POST", f"/bot{self.token}/{method}", self._handler(method))
+        server.add_route("POST", "/_inject", self._inject)
+
+    def _handler(self, method: str):
+        async def handle(request: Request) -> Response:
+            return await self.call(method, parse_params(request))
+        return handle
+
+    async def _inject(self, request: Request) -> Response:
+        updates = json.loads(request.body)
+        for update in updates if isinstance(updates, list) else [updates]:
+            self.push_update(update)
+        return Response(200, b'{"ok":true}', "application/json")
+
+    @staticmethod
+    def _json(status: int, payload: dict) -> Response:
+        return Response(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _error(self, status: int, description: str, **parameters) -> Response:
+        payload = {"ok": False, "error_code": status, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return self._json(status, payload)
+
+    async def call(self, method: str, params: dict) -> Response:
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return self._json(200, {"ok": True, "result": await self._get_updates(params)})
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+
+        if method in LIMITED_METHODS:
+            if self.random.random() < self.retry_after_rate:
+                self.injected["retry_after"] += 1
+                return self._error(429, f"Too Many Requests: retry after {self.retry_after}",
+                                   retry_after=self.retry_after)
+            if self.flood_limits:
+                chat_id = int(params.get("chat_id") or 0)
+                wait = max(self._global_bucket.take(), self._chat_buckets[chat_id].take())
+                if wait:
+                    self.injected["flood_limit"] += 1
+                    retry_after = max(1, int(wait + 0.999))
+                    return self._error(429, f"Too Many Requests: retry after {retry_after}",
+                                       retry_after=retry_after)
+        if self.random.random() < self.error_rate:
+            self.injected["server_error"] += 1
+            return self._error(500, "Internal Server Error")
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method in MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            result = {"message_id": int(params.get("message_id") or next(self._message_ids)),
+                      "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                      "text": params.get("text") or ""}
+            listeners = self._reply_listeners.pop(chat_id, None)
+            for listener in listeners or ():
+                listener(method, params)
+        else:
+            result = True
+        return self._json(200, {"ok": True, "result": result})
+
+    def stats(self) -> Dict:
+        return {"calls": dict(self.calls), "injected": dict(self.injected)}
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--token", default=os.getenv("BOT_TOKEN", "123456:TEST"))
+    parser.add_argument("--latency-ms", type=float, default=0, help="середня затримка відповіді")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="розкид затримки")
+    parser.add_argument("--retry-after-rate", type=float, default=0, help="частка відповідей 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after у відповіді 429, с")
+    parser.add_argument("--error-rate", type=float, default=0, help="частка відповідей 500")
+    parser.add_argument("--flood-limits", action="store_true", help="ліміти 30/с загалом і 1/с на чат")
+    parser.add_argument("--seed", type=int)
+
+
+def from_arguments(args) -> FakeTelegram:
+    return FakeTelegram(
+        args.token, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        retry_after_rate=args.retry_after_rate, retry_after=args.retry_after,
+        error_rate=args.error_rate, flood_limits=args.flood_limits, seed=args.seed,
+    )
+
+
+async def serve(args):
+    fake = from_arguments(args)
+    server = HttpServer(args.host, args.port)
+    fake.install(server)
+    await server.start()
+    print(f"Bot API: BOT_API_URL=http://{args.host}:{server.bound_port} BOT_TOKEN={args.token}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(json.dumps(fake.stats(), ensure_ascii=False))
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
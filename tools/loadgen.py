@@ -0,0 +1,296 @@
+"""
+Генератор навантаження: віртуальні користувачі проти бота через заглушку Bot API.
+
+Піднімає tools/fake_telegram.py в цьому ж процесі і запускає бота
+(незмінений main() з bot.py) окремим процесом з BOT_API_URL на заглушку.
+Кожен віртуальний користувач натискає кнопки бота, використовуючи його
+справжні callback_data (products, product, add_to_cart, cart,
+checkout_cart, ...), і чекає на відповідь перед наступним кроком.
+Затримка кроку - від появи оновлення в getUpdates до першої відповіді
+бота в чат.
+
+Замість користувачів можна відтворити записаний потік оновлень (JSONL).
+
+Запуск:
+    python tools/loadgen.py --users 2000 --duration 60 --latency-ms 30
+    python tools/loadgen.py --replay updates.jsonl --rate 200
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_telegram import ROOT, FakeTelegram, add_arguments, from_arguments  # noqa: E402
+from webserver import HttpServer  # noqa: E402
+
+
+def load_router(token: str):
+    """callback_data бота беремо з його ж маршрутизатора"""
+    os.environ.setdefault("BOT_TOKEN", token)
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "loadgen.db"))
+    import bot
+    return bot.router
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.timeouts: Counter = Counter()
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    def report(self) -> Dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        everything = sorted(value for values in self.latencies.values() for value in values)
+
+        def summary(values: List[float]) -> Dict:
+            values = sorted(values)
+            if not values:
+                return {"count": 0}
+            pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1)
+            return {"count": len(values), "p50_ms": pick(0.5), "p95_ms": pick(0.95),
+                    "p99_ms": pick(0.99), "max_ms": round(values[-1] * 1000, 1)}
+
+        return {
+            "elapsed_s": round(elapsed, 1),
+            "throughput_per_s": round(len(everything) / elapsed, 1) if elapsed else 0,
+            "total": summary(everything),
+            "timeouts": dict(self.timeouts),
+            "steps": {name: summary(values) for name, values in sorted(self.latencies.items())},
+        }
+
+
+class Client:
+    """Відправка оновлень у заглушку і очікування відповіді бота"""
+
+    def __init__(self, fake: FakeTelegram, recorder: Recorder, timeout: float):
+        self.fake = fake
+        self.recorder = recorder
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+
+    async def send(self, step: str, user_id: int, update: dict) -> bool:
+        loop = asyncio.get_running_loop()
+        replied = loop.create_future()
+        self.fake.on_reply(user_id, lambda method, params: replied.done() or replied.set_result(None))
+
+        started = time.monotonic()
+        self.fake.push_update(update)
+        try:
+            await asyncio.wait_for(replied, self.timeout)
+        except asyncio.TimeoutError:
+            self.recorder.timeouts[step] += 1
+            return False
+        self.recorder.latencies[step].append(time.monotonic() - started)
+        return True
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        message = {"message_id": next(self._ids), "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id), "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return {"message": message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        return {"callback_query": {
+            "id": str(next(self._ids)), "chat_instance": str(user_id), "data": data, "from": self._user(user_id),
+            "message": {"message_id": next(self._ids), "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"}, "text": "menu"},
+        }}
+
+
+def journeys(router, rng: random.Random):
+    """Сценарії натискань: список (крок, тип, значення)"""
+    product = lambda: rng.randint(1, 6)
+
+    def browse():
+        p = product()
+        return [("products", "cb", router.encode("products")),
+                ("product", "cb", router.encode("product", p)),
+                ("faq", "cb", router.encode("faq")),
+                ("faq_item", "cb", router.encode("faq_item", rng.randint(1, 5))),
+                ("main_menu", "cb", router.encode("main_menu"))]
+
+    def add_to_cart():
+        p = product()
+        return [("products", "cb", router.encode("products")),
+                ("product", "cb", router.encode("product", p)),
+                ("add_to_cart", "cb", router.encode("add_to_cart", p)),
+                ("quantity", "msg", str(rng.choice([1, 2, 0.5, 1.5]))),
+                ("cart", "cb", router.encode("cart"))]
+
+    def checkout():
+        return add_to_cart() + [
+            ("checkout_cart", "cb", router.encode("checkout_cart")),
+            ("name", "msg", "Навантаження Тест"),
+            ("phone", "msg", "0501234567"),
+            ("city", "msg", "Київ"),
+            ("np_department", "msg", "Відділення №1"),
+            ("confirm_order_yes", "cb", router.encode("confirm_order_yes")),
+        ]
+
+    def quick_call():
+        p = product()
+        return [("quick_order", "cb", router.encode("quick_order", p)),
+                ("quick_call", "cb", router.encode("quick_call", p)),
+                ("phone", "msg", "+380671112233")]
+
+    return [(browse, 4), (add_to_cart, 3), (checkout, 2), (quick_call, 1)]
+
+
+async def virtual_user(client: Client, user_id: int, router, rng: random.Random,
+                       deadline: float, think: float):
+    choices = journeys(router, rng)
+    await client.send("start", user_id, client.message(user_id, "/start"))
+    while time.monotonic() < deadline:
+        journey = rng.choices([make for make, _ in choices], [weight for _, weight in choices])[0]
+        for step, kind, value in journey():
+            if time.monotonic() >= deadline:
+                return
+            update = client.callback(user_id, value) if kind == "cb" else client.message(user_id, value)
+            if not await client.send(step, user_id, update):
+                # Бот не відповів - починаємо з головного меню
+                await client.send("start", user_id, client.message(user_id, "/start"))
+                break
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+
+
+async def replay(client: Client, path: str, rate: float):
+    """Відтворює записані оновлення з заданою частотою"""
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+
+    tasks = []
+    for update in updates:
+        body = update.get("message") or update.get("callback_query") or {}
+        chat = (body.get("chat") or body.get("message", {}).get("chat") or {}).get("id")
+        step = "message" if "message" in update else "callback_query"
+        if chat is None:
+            client.fake.push_update(update)
+        else:
+            tasks.append(asyncio.create_task(client.send(step, chat, update)))
+        if rate:
+            await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+
+def spawn_bot(args, api_url: str, log_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": args.token,
+        "BOT_API_URL": api_url,
+        "BOT_MODE": "polling",
+        "DB_PATH": args.db or os.path.join(tempfile.mkdtemp(), "farm_bot.db"),
+        "PORT": str(args.bot_port),
+        "HTTP_HOST": "127.0.0.1",
+    })
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], env=env,
+                            stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+
+
+async def run(args) -> Dict:
+    fake = from_arguments(args)
+    server = HttpServer(args.host, args.port)
+    fake.install(server)
+    await server.start()
+    api_url = f"http://{args.host}:{server.bound_port}"
+
+    process = None
+    if args.spawn:
+        process = spawn_bot(args, api_url, args.bot_log)
+        print(f"Бот запущено (pid {process.pid}), лог: {args.bot_log}")
+    else:
+        print(f"Запустіть бота: BOT_API_URL={api_url} BOT_TOKEN={args.token} python bot.py")
+
+    # Бот готовий, коли почав опитувати getUpdates
+    while not fake.calls["getUpdates"]:
+        if process and process.poll() is not None:
+            raise SystemExit(f"Бот завершився з кодом {process.returncode}, див. {args.bot_log}")
+        await asyncio.sleep(0.1)
+
+    recorder = Recorder()
+    client = Client(fake, recorder, args.timeout)
+    try:
+        if args.replay:
+            await replay(client, args.replay, args.rate)
+        else:
+            router = load_router(args.token)
+            deadline = time.monotonic() + args.duration
+            rng = random.Random(args.seed)
+            users = []
+            for index in range(args.users):
+                user_rng = random.Random(rng.random())
+                users.append(asyncio.create_task(virtual_user(
+                    client, 10_000_000 + index, router, user_rng, deadline, args.think_ms / 1000)))
+                if args.ramp:
+                    await asyncio.sleep(args.ramp / args.users)
+            await asyncio.gather(*users)
+        recorder.finished = time.monotonic()
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        await server.stop()
+
+    report = recorder.report()
+    report["bot_api"] = fake.stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.set_defaults(port=0)
+    parser.add_argument("--users", type=int, default=1000, help="віртуальних користувачів")
+    parser.add_argument("--duration", type=float, default=30, help="тривалість, с")
+    parser.add_argument("--ramp", type=float, default=5, help="час запуску всіх користувачів, с")
+    parser.add_argument("--think-ms", type=float, default=1000, help="середня пауза між натисканнями")
+    parser.add_argument("--timeout", type=float, default=30, help="очікування відповіді на крок, с")
+    parser.add_argument("--replay", help="JSONL з записаними оновленнями замість користувачів")
+    parser.add_argument("--rate", type=float, default=100, help="оновлень/с при --replay (0 - без пауз)")
+    parser.add_argument("--no-spawn", dest="spawn", action="store_false", help="бот запускається окремо")
+    parser.add_argument("--bot-port", type=int, default=0, help="PORT для HTTP-сервера бота")
+    parser.add_argument("--bot-log", default=os.path.join(tempfile.gettempdir(), "loadgen-bot.log"))
+    parser.add_argument("--db", help="база бота (за замовчуванням тимчасова)")
+    parser.add_argument("--output", help="файл JSON зі звітом")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    total = report["total"]
+    print(f"\nЧас: {report['elapsed_s']} с, відповідей: {total.get('count', 0)}, "
+          f"пропускна здатність: {report['throughput_per_s']}/с")
+    if total.get("count"):
+        print(f"Затримка: p50 {total['p50_ms']} мс, p95 {total['p95_ms']} мс, "
+              f"p99 {total['p99_ms']} мс, max {total['max_ms']} мс")
+    print(f"Без відповіді: {sum(report['timeouts'].values())} {report['timeouts']}")
+    print(f"Bot API: {report['bot_api']}")
+    print(f"\n{'крок':<18} {'к-сть':>7} {'p50':>8} {'p99':>8}")
+    for name, step in report["steps"].items():
+        if step["count"]:
+            print(f"{name:<18} {step['count']:>7} {step['p50_ms']:>8} {step['p99_ms']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Відправка записаних оновлень Telegram на webhook бота.
+
+Читає оновлення з JSONL-файлу (один JSON-об'єкт Update на рядок) і надсилає
+їх POST-запитами з заголовком секрету, як це робить Telegram. Дозволяє
+перевірити режим webhook локально, без реєстрації адреси в Telegram.
+
+Запуск:
+    BOT_MODE=webhook WEBHOOK_SECRET=test python bot.py
+    python tools/post_updates.py updates.jsonl --url http://127.0.0.1:10000/telegram --secret test
+"""
+
+import argparse
+import asyncio
+import json
+from collections import Counter
+from typing import Callable, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+
+class WebhookClient:
+    """Одне keep-alive з'єднання з webhook"""
+
+    def __init__(self, url: str, secret: str = ""):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.path = parts.path or "/"
+        self.secret = secret
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def post(self, update: dict) -> int:
+        """Надсилає оновлення і повертає HTTP-статус відповіді"""
+        if self._writer is None:
+            await self.connect()
+
+        body = json.dumps(update, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"POST {self.path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {self.secret}\r\n"
+            "\r\n"
+        )
+        self._writer.write(head.encode("latin-1") + body)
+        await self._writer.drain()
+
+        response = await self._reader.readuntil(b"\r\n\r\n")
+        lines = response.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        length = 0
+        closing = False
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+            elif name.lower() == "connection" and value.strip().lower() == "close":
+                closing = True
+        if length:
+            await self._reader.readexactly(length)
+        if closing:
+            await self.close()
+        return status
+
+
+async def post_updates(url: str, updates: Iterable[dict], secret: str = "", connections: int = 1,
+                       on_sent: Callable[[dict, int], None] = None) -> Counter:
+    """Надсилає оновлення через кілька паралельних з'єднань, повертає лічильник статусів"""
+    pending: "asyncio.Queue[dict]" = asyncio.Queue()
+    for update in updates:
+        pending.put_nowait(update)
+    statuses: Counter = Counter()
+
+    async def worker():
+        client = WebhookClient(url, secret)
+        try:
+            while not pending.empty():
+                update = pending.get_nowait()
+                status = await client.post(update)
+                statuses[status] += 1
+                if on_sent:
+                    on_sent(update, status)
+        finally:
+            await client.close()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, connections))))
+    return statuses
+
+
+def read_updates(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", help="JSONL-файл з оновленнями")
+    parser.add_argument("--url", default="http://127.0.0.1:10000/telegram")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--connections", type=int, default=1)
+    args = parser.parse_args()
+
+    statuses = asyncio.run(post_updates(args.url, read_updates(args.updates), args.secret, args.connections))
+    for status, count in sorted(statuses.items()):
+        print(f"{status}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+ВБУДОВАНИЙ HTTP-СЕРВЕР
+
+Мінімальний HTTP/1.1 сервер на asyncio, що працює в циклі подій бота:
+без окремих процесів і сторонніх залежностей. Підтримує keep-alive,
+тіло запиту з Content-Length і таблицю маршрутів (метод, шлях) -> обробник.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 16 * 1024
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: str
+    headers: Dict[str, str]
+    body: bytes
+
+
+class Response(NamedTuple):
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: Tuple[Tuple[str, str], ...] = ()
+
+
+def text_response(text: str, status: int = 200, **kwargs) -> Response:
+    return Response(status, text.encode("utf-8"), **kwargs)
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HttpError(Exception):
+    def __init__(self, status: int):
+        super().__init__(REASONS.get(status, str(status)))
+        self.status = status
+
+
+class HttpServer:
+    """HTTP-сервер з таблицею маршрутів.
+
+    Обробники мають бути швидкими: вони виконуються в тому ж циклі
+    подій, що й обробка оновлень бота.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 10000,
+                 max_body: int = 1024 * 1024, keepalive_timeout: float = 75):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.keepalive_timeout = keepalive_timeout
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    def route(self, method: str, path: str):
+        """Декоратор: реєструє обробник для методу і шляху"""
+        def decorator(handler: Handler) -> Handler:
+            self.add_route(method, path, handler)
+            return handler
+        return decorator
+
+    def add_route(self, method: str, path: str, handler: Handler):
+        key = (method.upper(), path)
+        if key in self._routes:
+            raise ValueError(f"Route {method} {path} is already registered")
+        self._routes[key] = handler
+
+    @property
+    def bound_port(self) -> int:
+        """Фактичний порт (корисно, якщо port=0)"""
+        if self._server is None or not self._server.sockets:
+            return self.port
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._serve, self.host, self.port, limit=MAX_HEADER_BYTES
+        )
+        logger.info("🌐 HTTP-сервер слухає %s:%s", self.host, self.bound_port)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        # Закрываем и keep-alive соединения, которые ждут следующего запроса
+        tasks = list(self._connections)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(431)
+
+        try:
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            raise HttpError(400)
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(411)
+
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HttpError(400)
+        if length < 0:
+            raise HttpError(400)
+        if length > self.max_body:
+            raise HttpError(413)
+
+        body = await reader.readexactly(length) if length else b""
+        path, _, query = target.partition("?")
+        return Request(method.upper(), path, query, headers, body)
+
+    @staticmethod
+    def _encode(response: Response, keep_alive: bool) -> bytes:
+        reason = REASONS.get(response.status, "")
+        head = [
+            f"HTTP/1.1 {response.status} {reason}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            "Connection: keep-alive" if keep_alive else "Connection: close",
+        ]
+        head.extend(f"{name}: {value}" for name, value in response.headers)
+        return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + response.body
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return text_response("Method Not Allowed", 405)
+            return text_response("Not Found", 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error("❌ Помилка HTTP-обробника %s %s: %s", request.method, request.path, e)
+            return text_response("Internal Server Error", 500)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except HttpError as e:
+                    writer.write(self._encode(text_response(str(e), e.status), keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                response = await self._dispatch(request)
+                writer.write(self._encode(response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()